@@ -3,6 +3,7 @@ from __future__ import absolute_import, unicode_literals
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
 
 
 # set the default Django settings module for the 'celery' program.
@@ -15,3 +16,11 @@ app = Celery("accurate_replica")
 # pickle the object when using Windows.
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def reset_clients_after_fork(**kwargs):
+    """pool children must not reuse connections opened by the parent"""
+    from lazy_clients import reset_clients
+
+    reset_clients()
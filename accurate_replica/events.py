@@ -0,0 +1,214 @@
+"""
+ASGI server for the dashboard's live fax events.
+
+Runs next to gunicorn, e.g.
+`uvicorn accurate_replica.events:application --uds /tmp/events.socket`, and
+nginx routes FAX_EVENTS_URL to it. A page's EventSource keeps its request
+open for as long as the page is, which would pin a gunicorn sync worker per
+open tab; here an open stream is a coroutine waiting on a queue. The process
+holds a single redis subscription to fax.events.CHANNEL and fans every message
+out to the streams that asked for the fax.
+
+Any other request is passed on to Django, so in development this one server
+can serve the whole site.
+"""
+import asyncio
+from importlib import import_module
+import logging
+import os
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+from uuid import UUID
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "accurate_replica.settings")
+
+django_application = get_asgi_application()
+
+# n.b. these need the apps loaded by get_asgi_application
+from asgiref.sync import sync_to_async  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.http.cookie import parse_cookie  # noqa: E402
+from redis.asyncio import Redis  # noqa: E402
+from redis.exceptions import RedisError  # noqa: E402
+import ujson as json  # noqa: E402
+
+from fax import events  # noqa: E402
+
+
+logger = logging.getLogger(__name__)
+
+HEADERS = [
+    (b"content-type", b"text/event-stream"),
+    (b"cache-control", b"no-cache"),
+    # n.b. nginx would otherwise hold events back until its buffer fills
+    (b"x-accel-buffering", b"no"),
+]
+KEEP_ALIVE = b": keep-alive\n\n"
+
+
+class Stream:
+    """the events one open page asked for, by fax uuid, and new faxes when `received`"""
+
+    def __init__(self, faxes, received=False):
+        self.faxes = faxes
+        self.received = received
+        self.queue = asyncio.Queue(settings.FAX_EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event, fields):
+        if fields["uuid"] not in self.faxes and not (self.received and event == events.RECEIVED):
+            return
+        try:
+            self.queue.put_nowait((event, fields))
+        except asyncio.QueueFull:
+            # a client this far behind is told to reload, see `stream_events`
+            self.overflowed = True
+
+
+class Broadcaster:
+    """one redis subscription for the process, fanned out to every open stream"""
+
+    def __init__(self):
+        self.streams = set()
+        self.task = None
+
+    def add(self, stream):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.listen())
+        self.streams.add(stream)
+
+    def remove(self, stream):
+        self.streams.discard(stream)
+
+    async def listen(self):
+        while True:
+            client = Redis.from_url(settings.REDIS_URL)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(events.CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.dispatch(message["data"])
+            except (RedisError, OSError):
+                # n.b. whatever is published meanwhile is lost, see fax.events
+                logger.exception("Lost the fax events subscription, subscribing again.")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+    def dispatch(self, data):
+        """offer a published message to every stream; one that can't be read is logged and skipped"""
+        try:
+            event, fields = events.decode(data)
+            for stream in list(self.streams):
+                stream.offer(event, fields)
+        except Exception:
+            # n.b. anything raised here would end the subscription for every page
+            logger.exception(f"Skipped an unreadable fax event: {data!r}")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+broadcaster = Broadcaster()
+
+
+def is_logged_in(session_key):
+    """whether `session_key` is a logged in user's session, as AuthenticationMiddleware decides"""
+    try:
+        session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+        return get_user(SimpleNamespace(session=session)).is_authenticated
+    finally:
+        # n.b. sync_to_async's threads are reused; leave no connection open in them
+        connection.close()
+
+
+def requested_faxes(values):
+    """the valid fax uuids in `values`, up to FAX_EVENTS_MAX_FAXES of them"""
+    faxes = set()
+    for value in values[: settings.FAX_EVENTS_MAX_FAXES]:
+        try:
+            faxes.add(str(UUID(value)))
+        except ValueError:
+            continue
+    return faxes
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def respond(send, status):
+    headers = [(b"content-type", b"text/plain")]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def stream_events(scope, receive, send):
+    cookies = parse_cookie(dict(scope["headers"]).get(b"cookie", b"").decode("latin-1"))
+    session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not session_key or not await sync_to_async(is_logged_in)(session_key):
+        return await respond(send, 403)
+
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    stream = Stream(requested_faxes(query.get("fax", [])), received=query.get("received") == ["1"])
+    await send({"type": "http.response.start", "status": 200, "headers": HEADERS})
+    await send({"type": "http.response.body", "body": KEEP_ALIVE, "more_body": True})
+
+    broadcaster.add(stream)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    getter = None
+    try:
+        while True:
+            getter = getter or asyncio.ensure_future(stream.queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected},
+                timeout=settings.FAX_EVENTS_KEEP_ALIVE,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                break
+            if getter in done:
+                event, fields = getter.result()
+                getter = None
+                chunk = f"event: {event}\ndata: {json.dumps(fields)}\n\n".encode()
+            else:
+                # n.b. proxies close connections that are quiet for too long
+                chunk = KEEP_ALIVE
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+            if stream.overflowed and stream.queue.empty():
+                await send({"type": "http.response.body", "body": b"event: stale\ndata: {}\n\n"})
+                break
+    finally:
+        broadcaster.remove(stream)
+        for task in (getter, disconnected):
+            if task is not None:
+                task.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await broadcaster.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == settings.FAX_EVENTS_URL:
+        if scope["method"] != "GET":
+            return await respond(send, 405)
+        return await stream_events(scope, receive, send)
+    return await django_application(scope, receive, send)
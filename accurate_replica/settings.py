@@ -102,6 +102,7 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
                 "dashboard.context_processors.fax_number",
+                "dashboard.context_processors.fax_events_url",
             ]
         },
     }
@@ -122,11 +123,24 @@ DEFAULT_FROM_EMAIL = env("DEFAULT_FROM_EMAIL")
 EMAIL_BACKEND = "sendgrid_backend.SendgridBackend"
 SENDGRID_API_KEY = env("SENDGRID_API_KEY")
 SENDGRID_SANDBOX_MODE_IN_DEBUG = env("SENDGRID_SANDBOX_MODE_IN_DEBUG") or not DEBUG
+# sendgrid accepts at most 1000 recipients per request
+NOTIFICATION_BATCH_SIZE = env.int("NOTIFICATION_BATCH_SIZE", default=1000)
+# 0 emails every inbound fax as it arrives, otherwise one summary per window (seconds)
+FAX_NOTIFICATION_DIGEST_WINDOW = env.int("FAX_NOTIFICATION_DIGEST_WINDOW", default=0)
+FAX_NOTIFICATION_DIGEST_LOCK_TIMEOUT = 5 * 60
+# the zone of the times listed in a digest
+FAX_NOTIFICATION_TIME_ZONE = env("FAX_NOTIFICATION_TIME_ZONE", default="America/New_York")
 
 # Auth0
 AUTH0_DOMAIN = env("AUTH0_DOMAIN")
 AUTH0_CLIENT_ID = env("AUTH0_CLIENT_ID")
 AUTH0_CLIENT_SECRET = env("AUTH0_CLIENT_SECRET")
+# Management api tokens are cached in memory and redis and refreshed this many
+# seconds before they expire, see auth0_tokens.py
+AUTH0_TOKEN_REFRESH_MARGIN = env.int("AUTH0_TOKEN_REFRESH_MARGIN", default=5 * 60)
+# one process fetches a token while the others wait up to AUTH0_TOKEN_LOCK_WAIT
+AUTH0_TOKEN_LOCK_TIMEOUT = 30
+AUTH0_TOKEN_LOCK_WAIT = 10
 
 SOCIAL_AUTH_AUTH0_DOMAIN = AUTH0_DOMAIN
 SOCIAL_AUTH_AUTH0_KEY = AUTH0_CLIENT_ID
@@ -169,13 +183,82 @@ TWILIO_ACCOUNT_SID = env("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = env("TWILIO_AUTH_TOKEN")
 TWILIO_NUMBER = DEFAULT_FROM_NUMBER = env("DEFAULT_FROM_NUMBER")
 TWILIO_NUMBER_SID = env("TWILIO_NUMBER_SID")
+TWILIO_VALIDATE_WEBHOOKS = env.bool("TWILIO_VALIDATE_WEBHOOKS", default=True)
+
+# Requests per second and burst size per endpoint class, shared by every
+# process through redis, see rate_limits.py
+TWILIO_RATE_LIMITS = {
+    "fax-create": (env.float("TWILIO_FAX_CREATE_RATE", default=1.0), 5),
+    "fax-fetch": (env.float("TWILIO_FAX_FETCH_RATE", default=10.0), 20),
+    "numbers": (1.0, 1),
+    "default": (env.float("TWILIO_DEFAULT_RATE", default=5.0), 10),
+}
+TWILIO_RATE_LIMIT_MAX_RETRIES = 100
+
+# Keep-alive connections per host for each process-wide client, see
+# lazy_clients.py; a process never holds more open than its concurrent requests
+TWILIO_HTTP_POOL_SIZE = env.int("TWILIO_HTTP_POOL_SIZE", default=10)
+HTTP_POOL_SIZE = env.int("HTTP_POOL_SIZE", default=10)
 
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 DATABASES = {"default": env.db()}
 REDIS_URL = env("REDIS_URL")
+# unbounded when unset; with a limit, callers beyond it get a ConnectionError
+REDIS_MAX_CONNECTIONS = env.int("REDIS_MAX_CONNECTIONS", default=None)
 CELERY_BROKER_URL = REDIS_URL
+CELERY_BEAT_SCHEDULE = {}
+CELERY_TASK_ROUTES = {
+    "fax.tasks._notify_inbound_fax": {"queue": "notifications"},
+    "fax.tasks._send_notification_batch": {"queue": "notifications"},
+    "fax.tasks._send_notification_digest": {"queue": "notifications"},
+    "fax.tasks._render_thumbnails": {"queue": "media"},
+    "fax.tasks._prepare_fax_media": {"queue": "media"},
+    "fax.tasks._send_bulk_fax": {"queue": "media"},
+    "fax.tasks._purge_media_blobs": {"queue": "media"},
+    # n.b. published to the queue for the fax's priority, see FAX_SEND_QUEUES
+    "fax.tasks._send_fax": {"queue": "send"},
+    "fax.tasks._send_queued_faxes": {"queue": "send"},
+}
+
+if FAX_NOTIFICATION_DIGEST_WINDOW:
+    CELERY_BEAT_SCHEDULE["send-notification-digest"] = {
+        "task": "fax.tasks._send_notification_digest",
+        "schedule": FAX_NOTIFICATION_DIGEST_WINDOW,
+    }
+
+# Snapshots of twilio's fax resources are cached in redis for this many
+# seconds, far longer once the fax reached a terminal status, see fax.resources
+FAX_RESOURCE_TTL = env.int("FAX_RESOURCE_TTL", default=60)
+FAX_RESOURCE_TERMINAL_TTL = 30 * 24 * 60 * 60
+
+# Inbound fax webhooks: "sync" stores each fax while twilio waits, "buffered"
+# appends them to a redis stream that a periodic task drains in batches
+FAX_INGEST_MODE = env("FAX_INGEST_MODE", default="sync")
+FAX_INGEST_STREAM = "fax:ingest"
+FAX_INGEST_BATCH_SIZE = env.int("FAX_INGEST_BATCH_SIZE", default=500)
+FAX_INGEST_INTERVAL = env.float("FAX_INGEST_INTERVAL", default=1.0)
+FAX_INGEST_LOCK_TIMEOUT = 5 * 60
+# deliveries of a webhook that keeps failing before it is dead-lettered, see fax.ingest
+FAX_INGEST_MAX_DELIVERIES = 5
+
+if FAX_INGEST_MODE == "buffered":
+    CELERY_BEAT_SCHEDULE["drain-inbound-faxes"] = {
+        "task": "fax.tasks._drain_inbound_faxes",
+        "schedule": FAX_INGEST_INTERVAL,
+    }
+
+# Outbound status callbacks: 0 writes each one as it arrives, otherwise the
+# latest status per fax is held in redis and flushed once per window (seconds)
+FAX_STATUS_COALESCE_WINDOW = env.float("FAX_STATUS_COALESCE_WINDOW", default=0)
+FAX_STATUS_FLUSH_LOCK_TIMEOUT = 5 * 60
+
+if FAX_STATUS_COALESCE_WINDOW:
+    CELERY_BEAT_SCHEDULE["flush-status-updates"] = {
+        "task": "fax.tasks._flush_status_updates",
+        "schedule": FAX_STATUS_COALESCE_WINDOW,
+    }
 
 # Media
 MEDIA_URL = "/media/"
@@ -185,9 +268,111 @@ AWS_ACCESS_KEY_ID = env("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = env("AWS_SECRET_ACCESS_KEY")
 AWS_S3_BUCKET_NAME = S3_BUCKET_NAME = env("S3_BUCKET_NAME")
 AWS_S3_ADDRESSING_STYLE = "auto"
+AWS_S3_ENDPOINT_URL = env("AWS_S3_ENDPOINT_URL", default="")
 AWS_S3_KEY_PREFIX = "app-content"
 AWS_S3_ENCRYPT_KEY = True
 
+# Fax media is streamed into S3 in parts of this size (minimum 5 MiB)
+FAX_MEDIA_PART_SIZE = env.int("FAX_MEDIA_PART_SIZE", default=8 * 1024 * 1024)
+FAX_MEDIA_CHUNK_SIZE = env.int("FAX_MEDIA_CHUNK_SIZE", default=64 * 1024)
+
+# The New Fax form uploads documents straight to the bucket with a presigned
+# POST; the bucket's CORS rules must allow POST from the dashboard's origin
+FAX_UPLOAD_MAX_SIZE = env.int("FAX_UPLOAD_MAX_SIZE", default=50 * 1024 * 1024)
+FAX_UPLOAD_EXPIRES = 10 * 60
+
+# Bulk sends fan out one celery group per batch; progress is shown per batch
+FAX_BULK_BATCH_SIZE = env.int("FAX_BULK_BATCH_SIZE", default=50)
+FAX_BULK_MAX_RECIPIENTS = env.int("FAX_BULK_MAX_RECIPIENTS", default=1000)
+
+# Documents are stored once per SHA-256; blobs no fax points at are deleted
+# once they have been unreferenced for this long (seconds)
+FAX_MEDIA_BLOB_GRACE_PERIOD = env.int("FAX_MEDIA_BLOB_GRACE_PERIOD", default=24 * 60 * 60)
+
+CELERY_BEAT_SCHEDULE["purge-media-blobs"] = {
+    "task": "fax.tasks._purge_media_blobs",
+    "schedule": 60 * 60,
+}
+
+# Outbound sends go to one queue per priority, each with its own worker, so
+# urgent faxes never wait behind a bulk send. Faxes with a send time wait in a
+# redis sorted set that is checked every FAX_SCHEDULE_INTERVAL seconds
+FAX_SEND_QUEUES = {"high": "send-high", "normal": "send", "low": "send-low"}
+FAX_SCHEDULE_INTERVAL = env.float("FAX_SCHEDULE_INTERVAL", default=5.0)
+FAX_SCHEDULE_BATCH_SIZE = 500
+# faxes taken from the schedule but not published this long after, e.g. by a
+# worker that died, are taken again (seconds)
+FAX_SCHEDULE_RELEASE_TIMEOUT = 5 * 60
+
+CELERY_BEAT_SCHEDULE["release-scheduled-faxes"] = {
+    "task": "fax.tasks._release_scheduled_faxes",
+    "schedule": FAX_SCHEDULE_INTERVAL,
+}
+
+# Busy, unanswered and failed outbound faxes are dialled again, up to
+# FAX_REDIAL_MAX_ATTEMPTS tries in total, waiting BACKOFF * FACTOR ** (try - 1)
+# seconds (at most MAX_DELAY) between them. Redials due during the quiet hours,
+# (start, end) hours in FAX_REDIAL_TIME_ZONE, wait until they end
+FAX_REDIAL_MAX_ATTEMPTS = env.int("FAX_REDIAL_MAX_ATTEMPTS", default=3)
+FAX_REDIAL_BACKOFF = env.int("FAX_REDIAL_BACKOFF", default=5 * 60)
+FAX_REDIAL_BACKOFF_FACTOR = 2.0
+FAX_REDIAL_MAX_DELAY = 60 * 60
+FAX_REDIAL_QUIET_HOURS = (21, 8)
+FAX_REDIAL_TIME_ZONE = env("FAX_REDIAL_TIME_ZONE", default="America/New_York")
+FAX_REDIAL_STATUSES = ("busy", "no-answer", "failed")
+
+# Outbound sends: "celery" publishes one _send_fax task per fax, "async" marks
+# faxes queued and sends them in batches of concurrent twilio calls, from a
+# periodic task or the send_queued_faxes command, see fax.sender
+FAX_SEND_ENGINE = env("FAX_SEND_ENGINE", default="celery")
+FAX_SEND_BATCH_SIZE = env.int("FAX_SEND_BATCH_SIZE", default=200)
+FAX_SEND_CONCURRENCY = env.int("FAX_SEND_CONCURRENCY", default=50)
+FAX_SEND_INTERVAL = env.float("FAX_SEND_INTERVAL", default=2.0)
+FAX_SEND_TIMEOUT = 30
+# n.b. extended before every batch, so a batch must go out within it: at the
+# "fax-create" rate limit below, FAX_SEND_BATCH_SIZE creates take 200s
+FAX_SEND_LOCK_TIMEOUT = 10 * 60
+# faxes claimed for this long without a sid were left by an engine that died
+FAX_SEND_CLAIM_TIMEOUT = 30 * 60
+TWILIO_FAX_API_URL = "https://fax.twilio.com/v1"
+
+if FAX_SEND_ENGINE == "async":
+    CELERY_BEAT_SCHEDULE["send-queued-faxes"] = {
+        "task": "fax.tasks._send_queued_faxes",
+        "schedule": FAX_SEND_INTERVAL,
+    }
+
+# Outbound documents are re-rendered as G4 bilevel images at fax resolution
+# (dpi across, dpi down) before twilio fetches them, when that makes them
+# smaller, see fax.normalize. Greys darker than the first halftone bound print
+# black, lighter than the second white
+FAX_NORMALIZE_MEDIA = env.bool("FAX_NORMALIZE_MEDIA", default=True)
+FAX_RESOLUTION = (204, 196)
+FAX_HALFTONE_RANGE = (96, 200)
+
+# Outbound documents are parsed in a process pool when they are submitted and
+# rejected when twilio couldn't send them, see fax.preflight
+FAX_PREFLIGHT_PROCESSES = env.int("FAX_PREFLIGHT_PROCESSES", default=2)
+FAX_PREFLIGHT_TIMEOUT = env.int("FAX_PREFLIGHT_TIMEOUT", default=20)
+
+# Faxes per page of the dashboard list, see core.keyset
+DASHBOARD_PAGE_SIZE = env.int("DASHBOARD_PAGE_SIZE", default=50)
+
+# Open dashboard pages are sent status changes as server-sent events from
+# FAX_EVENTS_URL, served by accurate_replica.events rather than gunicorn
+FAX_EVENTS_URL = env("FAX_EVENTS_URL", default="/events/faxes")
+FAX_EVENTS_KEEP_ALIVE = env.float("FAX_EVENTS_KEEP_ALIVE", default=15.0)
+FAX_EVENTS_QUEUE_SIZE = 100
+FAX_EVENTS_MAX_FAXES = 200
+
+# Fax counts are kept per hour and per day, the days start at midnight in
+# FAX_STATS_TIME_ZONE, see fax.stats
+FAX_STATS_TIME_ZONE = env("FAX_STATS_TIME_ZONE", default="UTC")
+
+# Page previews are rendered in a process pool by the "media" worker
+FAX_THUMBNAIL_WIDTH = env.int("FAX_THUMBNAIL_WIDTH", default=240)
+FAX_THUMBNAIL_PROCESSES = env.int("FAX_THUMBNAIL_PROCESSES", default=os.cpu_count() or 1)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -1,6 +1,7 @@
-import requests
 from social_core.backends.oauth import BaseOAuth2
 
+from lazy_clients import LazyLoadedHTTPSession
+
 
 class Auth0(BaseOAuth2):
     """Auth0 OAuth authentication backend"""
@@ -25,7 +26,7 @@ class Auth0(BaseOAuth2):
     def get_user_details(self, response):
         url = "https://" + self.setting("DOMAIN") + "/userinfo"
         headers = {"authorization": "Bearer " + response["access_token"]}
-        resp = requests.get(url, headers=headers)
+        resp = LazyLoadedHTTPSession().get_session().get(url, headers=headers)
         userinfo = resp.json()
 
         return {
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from lazy_clients import LazyLoadedAuth0Client
+
+
+class Command(BaseCommand):
+    help = "Show how many Auth0 management tokens were fetched and how many were shared through redis"
+
+    def handle(self, *args, **options):
+        tokens = LazyLoadedAuth0Client().tokens
+        stats = tokens.stats()
+        self.stdout.write(f"fetched from auth0: {stats.get('fetches', 0)}")
+        self.stdout.write(f"shared via redis:   {stats.get('shared_hits', 0)}")
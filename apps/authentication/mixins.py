@@ -10,8 +10,6 @@ logger = logging.getLogger(__name__)
 
 class Auth0UserModelMixin:
     def create_auth0_user(self):
-        client = Auth0Client().get_client()
-
         if hasattr(self, 'agent') and self.agent:
             attributes = self.agent.attributes
             flex = dict(
@@ -37,20 +35,21 @@ class Auth0UserModelMixin:
             app_metadata=dict(flex=flex),
         )
 
-        client.users.create(payload)
+        Auth0Client().request(lambda client: client.users.create(payload))
         return user
 
     def get_auth0_user(self):
         user = None
         uid = self.auth0_user_id
         email = self.email
-        client = Auth0Client().get_client()
 
         if uid:
-            user = client.users.get(uid)
+            user = Auth0Client().request(lambda client: client.users.get(uid))
             logger.info(f"fetched auth0 user:{user} by uid")
         else:
-            user_queryset = client.users_by_email.search_users_by_email(email)
+            user_queryset = Auth0Client().request(
+                lambda client: client.users_by_email.search_users_by_email(email)
+            )
             if len(user_queryset) == 0:
                 logger.info("No user with given email.")
             elif len(user_queryset) > 1:
@@ -82,8 +81,6 @@ class Auth0UserModelMixin:
             self.image_url = user.get("picture", get_user_model().DEFAULT_IMAGE_URL)
             self.save()
 
-        client = Auth0Client().get_client()
-
         if hasattr(self, 'agent') and self.agent:
             attributes = self.agent.attributes
             app_metadata = dict(
@@ -97,6 +94,8 @@ class Auth0UserModelMixin:
         else:
             app_metadata = {}
 
-        client.users.update(self.auth0_user_id, dict(app_metadata=app_metadata))
+        Auth0Client().request(
+            lambda client: client.users.update(self.auth0_user_id, dict(app_metadata=app_metadata))
+        )
 
         return user
@@ -38,8 +38,7 @@ def get_or_create_user(strategy, details, backend, user=None, *args, **kwargs):
     email = details.get("email", "").strip().lower()
 
     if not email:
-        client = Auth0Client().get_client()
-        user = client.users.get(uid)
+        user = Auth0Client().request(lambda client: client.users.get(uid))
         email = user.get("email")
 
     user_queryset = User.objects.filter(email=email)
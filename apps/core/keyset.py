@@ -0,0 +1,82 @@
+"""
+Keyset (cursor) pagination for querysets ordered newest first.
+
+Offset pagination reads and throws away every row before the page, so deep
+pages get slower the more rows there are. A keyset page starts right after
+the last row shown instead: `WHERE (created_on, uuid) < (%s, %s) ORDER BY
+created_on DESC, uuid DESC LIMIT n` is a single range scan of a composite
+index on the same columns, however far back it is. The uuid breaks ties
+between rows created in the same microsecond.
+
+Cursors are the key of a page's first or last row, encoded for query strings.
+They carry no offsets or totals, so pages stay stable while rows are added.
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+
+
+# `next_cursor` and `previous_cursor` are None on the last and first page
+KeysetPage = namedtuple("KeysetPage", "items next_cursor previous_cursor")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, keys=("created_on", "uuid")):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = keys
+        self.fields = [queryset.model._meta.get_field(key) for key in keys]
+
+    def page(self, after=None, before=None):
+        """the page after cursor `after`, before cursor `before`, or the first page"""
+        if before:
+            rows = self.rows(">", self.decode(before), descending=False)
+            has_more = len(rows) > self.per_page
+            items = rows[: self.per_page][::-1]
+            next_cursor = self.encode(items[-1]) if items else None
+            previous_cursor = self.encode(items[0]) if items and has_more else None
+            return KeysetPage(items, next_cursor, previous_cursor)
+
+        rows = self.rows("<", self.decode(after), descending=True) if after else self.rows()
+        items = rows[: self.per_page]
+        next_cursor = self.encode(items[-1]) if len(rows) > self.per_page else None
+        previous_cursor = self.encode(items[0]) if after and items else None
+        return KeysetPage(items, next_cursor, previous_cursor)
+
+    def rows(self, operator=None, values=None, descending=True):
+        return list(self.query(operator, values, descending))
+
+    def query(self, operator=None, values=None, descending=True):
+        """one page and the first row of the next, keyed after `values` when given"""
+        queryset = self.queryset
+        if operator:
+            table = connection.ops.quote_name(queryset.model._meta.db_table)
+            columns = ", ".join(f"{table}.{connection.ops.quote_name(field.column)}" for field in self.fields)
+            placeholders = ", ".join("%s" for _ in self.fields)
+            # n.b. a row comparison, which the ORM can't express, is what lets
+            # postgres use the composite index as one range
+            queryset = queryset.extra(where=[f"({columns}) {operator} ({placeholders})"], params=values)
+        order = [f"-{key}" if descending else key for key in self.keys]
+        return queryset.order_by(*order)[: self.per_page + 1]
+
+    def encode(self, item):
+        # n.b. str keeps microseconds, DjangoJSONEncoder would round them to
+        # milliseconds and skip or repeat rows
+        values = [str(getattr(item, field.attname)) for field in self.fields]
+        return urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if len(values) != len(self.fields):
+                raise ValueError("wrong number of keys")
+            return [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (ValueError, TypeError, ValidationError) as e:
+            raise InvalidCursor(f"invalid cursor: {cursor}") from e
@@ -0,0 +1,419 @@
+"""
+In-process stand-ins for the external services we talk to.
+
+These are small threaded HTTP servers meant for benchmarks and local testing.
+They speak just enough of each protocol for our own code paths and keep all
+state in memory.
+"""
+from datetime import datetime, timedelta
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ipaddress import IPv4Address
+from tempfile import NamedTemporaryFile
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+import base64
+import hashlib
+import json
+import re
+import ssl
+import time
+
+import requests
+
+
+class LocalServer(ThreadingHTTPServer):
+    # n.b. the default backlog of 5 resets connections from concurrent clients
+    request_queue_size = 1024
+
+
+class TLSServer(LocalServer):
+    """https with a throwaway certificate, counting the handshakes it completes"""
+
+    def __init__(self, address, handler_class, certfile):
+        super().__init__(address, handler_class)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(certfile)
+        self.handshakes = 0
+        self.handshakes_lock = Lock()
+
+    def get_request(self):
+        sock, address = super().get_request()
+        sock = self.context.wrap_socket(sock, server_side=True)
+        with self.handshakes_lock:
+            self.handshakes += 1
+        return sock, address
+
+
+def self_signed_certificate():
+    """path to a pem holding a fresh key and certificate for 127.0.0.1"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(minutes=1))
+        .not_valid_after(now + timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(IPv4Address("127.0.0.1"))]), False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), True)
+        .sign(key, hashes.SHA256())
+    )
+    pem = NamedTemporaryFile(suffix=".pem", delete=False)
+    with pem:
+        pem.write(certificate.public_bytes(serialization.Encoding.PEM))
+        pem.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return pem.name
+
+
+class LocalService:
+    """
+    run a request handler on an ephemeral localhost port in a daemon thread
+
+    With `certfile` (see `self_signed_certificate`) the service speaks https
+    and counts TLS handshakes in `server.handshakes`.
+    """
+
+    handler_class = None
+
+    def __init__(self, certfile=None):
+        address = ("127.0.0.1", 0)
+        if certfile:
+            self.server = TLSServer(address, self.handler_class, certfile)
+        else:
+            self.server = LocalServer(address, self.handler_class)
+        self.scheme = "https" if certfile else "http"
+        self.server.daemon_threads = True
+        self.server.service = self
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"{self.scheme}://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class MediaHandler(QuietHandler):
+    def do_GET(self):
+        size = self.service.size
+        chunk = self.service.chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        sent = 0
+        while sent < size:
+            block = chunk[: size - sent]
+            self.wfile.write(block)
+            sent += len(block)
+
+
+class LocalMediaServer(LocalService):
+    """serves `size` bytes of pdf-ish filler for any GET, like a Twilio media url"""
+
+    handler_class = MediaHandler
+
+    def __init__(self, size, certfile=None):
+        super().__init__(certfile)
+        self.size = size
+        self.chunk = (b"%PDF-1.4\n" + b"0" * 65527)[:65536]
+
+
+class S3Handler(QuietHandler):
+    def parse(self):
+        parts = urlsplit(self.path)
+        bucket, _, key = parts.path.lstrip("/").partition("/")
+        query = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        return bucket, key, query
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            body = decode_aws_chunked(body)
+        return body
+
+    def do_HEAD(self):
+        bucket, key, _ = self.parse()
+        body = self.service.objects.get((bucket, key))
+        if body is None:
+            return self.respond(404)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag(body))
+        self.end_headers()
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+        if not key:
+            return self.list_objects(bucket, query.get("prefix", ""))
+
+        body = self.service.objects.get((bucket, key))
+        if body is None:
+            return self.respond(404, s3_error("NoSuchKey"), {"Content-Type": "application/xml"})
+        self.respond(200, body, {"ETag": etag(body), "Content-Type": "application/octet-stream"})
+
+    def list_objects(self, bucket, prefix):
+        keys = sorted(k for b, k in self.service.objects if b == bucket and k.startswith(prefix))
+        contents = "".join(
+            f"<Contents><Key>{key}</Key><Size>{len(self.service.objects[(bucket, key)])}</Size></Contents>"
+            for key in keys
+        )
+        result = (
+            "<ListBucketResult>"
+            f"<Name>{bucket}</Name><Prefix>{prefix}</Prefix><KeyCount>{len(keys)}</KeyCount>"
+            f"<IsTruncated>false</IsTruncated>{contents}"
+            "</ListBucketResult>"
+        )
+        self.respond(200, result.encode(), {"Content-Type": "application/xml"})
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        self.service.bytes_received += len(body)
+
+        if "uploadId" in query:
+            parts = self.service.uploads[query["uploadId"]]
+            parts[int(query["partNumber"])] = self.service.keep(body)
+            return self.respond(200, headers={"ETag": etag(body)})
+
+        source = self.headers.get("x-amz-copy-source")
+        if source:
+            source_bucket, _, source_key = source.lstrip("/").partition("/")
+            body = self.service.objects.get((source_bucket, source_key))
+            if body is None:
+                return self.respond(404, s3_error("NoSuchKey"), {"Content-Type": "application/xml"})
+            self.service.objects[(bucket, key)] = body
+            result = f"<CopyObjectResult><ETag>{etag(body)}</ETag></CopyObjectResult>"
+            return self.respond(200, result.encode(), {"Content-Type": "application/xml"})
+
+        self.service.objects[(bucket, key)] = self.service.keep(body)
+        self.respond(200, headers={"ETag": etag(body)})
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+
+        if self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+            return self.post_object(bucket, body)
+
+        if "uploads" in query:
+            upload_id = uuid4().hex
+            self.service.uploads[upload_id] = {}
+            result = (
+                "<InitiateMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>"
+                "</InitiateMultipartUploadResult>"
+            )
+            return self.respond(200, result.encode(), {"Content-Type": "application/xml"})
+
+        if "uploadId" in query:
+            parts = self.service.uploads.pop(query["uploadId"])
+            body = b"".join(parts[n] for n in sorted(parts))
+            self.service.objects[(bucket, key)] = body
+            result = (
+                "<CompleteMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>{etag(body)}</ETag>"
+                "</CompleteMultipartUploadResult>"
+            )
+            return self.respond(200, result.encode(), {"Content-Type": "application/xml"})
+
+        self.respond(400, s3_error("InvalidRequest"), {"Content-Type": "application/xml"})
+
+    def post_object(self, bucket, body):
+        """browser upload with a presigned POST; enforces the policy's size range"""
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        fields, filename = {}, ""
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            fields[name] = part.get_payload(decode=True)
+            if name == "file":
+                filename = part.get_filename() or ""
+
+        policy = json.loads(base64.b64decode(fields.get("policy", b"e30=")))
+        for condition in policy.get("conditions", []):
+            if isinstance(condition, list) and condition[0] == "content-length-range":
+                if not condition[1] <= len(fields["file"]) <= condition[2]:
+                    return self.respond(400, s3_error("EntityTooLarge"), {"Content-Type": "application/xml"})
+
+        key = fields["key"].decode().replace("${filename}", filename)
+        self.service.bytes_received += len(fields["file"])
+        self.service.objects[(bucket, key)] = self.service.keep(fields["file"])
+        self.respond(204, headers={"ETag": etag(fields["file"])})
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+        if "uploadId" in query:
+            self.service.uploads.pop(query["uploadId"], None)
+        else:
+            self.service.objects.pop((bucket, key), None)
+        self.respond(204)
+
+
+class LocalS3Server(LocalService):
+    """
+    path-style S3 stand-in supporting put, get, head, list, delete, copy,
+    multipart uploads and presigned POST uploads
+
+    With `keep_bodies=False` uploaded bytes are counted and discarded, which
+    keeps the server's own memory out of benchmark measurements.
+    """
+
+    handler_class = S3Handler
+
+    def __init__(self, keep_bodies=True):
+        super().__init__()
+        self.keep_bodies = keep_bodies
+        self.objects = {}
+        self.uploads = {}
+        self.bytes_received = 0
+
+    def keep(self, body):
+        return body if self.keep_bodies else b""
+
+
+class TwilioHandler(QuietHandler):
+    def do_POST(self):
+        if not urlsplit(self.path).path.endswith("/Faxes"):
+            return self.respond(404)
+        length = int(self.headers.get("Content-Length") or 0)
+        params = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        fax = self.service.create_fax(params)
+        self.respond(201, json.dumps(fax).encode(), {"Content-Type": "application/json"})
+
+    def do_GET(self):
+        sid = urlsplit(self.path).path.rstrip("/").rpartition("/")[2]
+        fax = self.service.faxes.get(sid)
+        if fax is None:
+            return self.respond(404, b'{"status": 404}', {"Content-Type": "application/json"})
+        self.respond(200, json.dumps(fax).encode(), {"Content-Type": "application/json"})
+
+
+class LocalTwilioServer(LocalService):
+    """
+    stand-in for twilio's fax api: POST .../Faxes and GET .../Faxes/<sid>
+
+    Creating a fax fetches its MediaUrl right away and "transmits" it: the
+    document is passed through `transcode` (standing in for twilio's own
+    conversion, identity when None) and `duration` is the time the coded bytes
+    take on the line at `bitrate`. Extra keys record the media size and the
+    fetch and transcode times. Every create takes at least `latency` seconds,
+    standing in for the api's own response time.
+    """
+
+    handler_class = TwilioHandler
+
+    def __init__(self, transcode=None, bitrate=14400, certfile=None, latency=0):
+        super().__init__(certfile)
+        self.transcode = transcode
+        self.bitrate = bitrate
+        self.latency = latency
+        self.faxes = {}
+
+    def create_fax(self, params):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        media = requests.get(params["MediaUrl"]).content
+        fetched = time.perf_counter()
+        coded = self.transcode(media) if self.transcode else media
+        transcoded = time.perf_counter()
+
+        sid = f"FX{uuid4().hex}"
+        pages = count_pdf_pages(media)
+        self.faxes[sid] = fax = {
+            "sid": sid,
+            "status": "delivered",
+            "direction": "outbound",
+            "from": params.get("From"),
+            "to": params.get("To"),
+            "media_url": params["MediaUrl"],
+            "num_pages": pages,
+            "duration": len(coded) * 8 / self.bitrate,
+            "media_size": len(media),
+            "wire_size": len(coded),
+            "fetch_seconds": fetched - start,
+            "transcode_seconds": transcoded - fetched,
+        }
+        return fax
+
+
+def count_pdf_pages(data):
+    """page objects in an uncompressed-xref pdf, good enough for a stand-in"""
+    return len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", data)) or 1
+
+
+def etag(body):
+    return f'"{hashlib.md5(body).hexdigest()}"'  # nosec: mirrors S3 etags
+
+
+def s3_error(code):
+    return f"<Error><Code>{code}</Code><Message>{code}</Message></Error>".encode()
+
+
+def decode_aws_chunked(body):
+    """strip the chunk framing botocore adds to streaming uploads"""
+    decoded = bytearray()
+    position = 0
+    while position < len(body):
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            break
+        start = line_end + 2
+        decoded += body[start : start + size]
+        position = start + size + 2
+    return bytes(decoded)
@@ -1,5 +1,16 @@
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta, timezone
+import json
+import os
+from uuid import uuid4
+
+import pytest
+
 from core.formatters import e164_format_phone_number, InvalidUSPhoneNumberException
 from core.formatters import pretty_print_phone_number
+from core.keyset import InvalidCursor, KeysetPaginator
+from fax.models import Fax
+from lazy_clients import LazyLoadedHTTPSession, Singleton, reset_clients
 
 
 def test_e164_formatter__should_pass():
@@ -51,3 +62,102 @@ def test_pretty_print_phone_number():
             pretty_print_phone_number(e164_format_phone_number(number))
             == "+1 (321) 555 0123"
         )
+
+
+class ListKeysetPaginator(KeysetPaginator):
+    """a paginator over `faxes` in memory, in place of the row comparison query"""
+
+    def __init__(self, faxes, per_page):
+        super().__init__(Fax.objects.all(), per_page)
+        self.faxes = faxes
+
+    def rows(self, operator=None, values=None, descending=True):
+        key = lambda fax: (fax.created_on, fax.uuid)  # noqa: E731
+        rows = sorted(self.faxes, key=key, reverse=descending)
+        if operator == "<":
+            rows = [fax for fax in rows if key(fax) < tuple(values)]
+        elif operator == ">":
+            rows = [fax for fax in rows if key(fax) > tuple(values)]
+        return rows[: self.per_page + 1]
+
+
+def keyset_faxes(count):
+    """`count` faxes, the newest first, two of each created in the same microsecond"""
+    start = datetime(2020, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)
+    faxes = [Fax(uuid=uuid4(), created_on=start + timedelta(seconds=n // 2)) for n in range(count)]
+    return sorted(faxes, key=lambda fax: (fax.created_on, fax.uuid), reverse=True)
+
+
+def test_keyset_cursor__round_trips():
+    paginator = KeysetPaginator(Fax.objects.all(), 10)
+    fax = keyset_faxes(1)[0]
+
+    assert paginator.decode(paginator.encode(fax)) == [fax.created_on, fax.uuid]
+
+
+def test_keyset_cursor__rejects_malformed_cursors():
+    paginator = KeysetPaginator(Fax.objects.all(), 10)
+    cursors = [
+        "not base64!",
+        urlsafe_b64encode(b"not json").decode(),
+        urlsafe_b64encode(json.dumps(["2020-01-01 12:00:00+00:00"]).encode()).decode(),
+        urlsafe_b64encode(json.dumps(["yesterday", str(uuid4())]).encode()).decode(),
+        urlsafe_b64encode(json.dumps(["2020-01-01 12:00:00+00:00", "not a uuid"]).encode()).decode(),
+    ]
+
+    for cursor in cursors:
+        with pytest.raises(InvalidCursor):
+            paginator.decode(cursor)
+
+
+def test_keyset_paginator__before_a_middle_page_has_both_cursors():
+    faxes = keyset_faxes(7)
+    paginator = ListKeysetPaginator(faxes, 2)
+
+    page = paginator.page(before=paginator.encode(faxes[4]))
+
+    assert page.items == faxes[2:4]
+    assert paginator.page(after=page.next_cursor).items == faxes[4:6]
+    assert paginator.page(before=page.previous_cursor).items == faxes[0:2]
+
+
+def test_keyset_paginator__before_the_second_page_is_the_first():
+    faxes = keyset_faxes(7)
+    paginator = ListKeysetPaginator(faxes, 2)
+
+    page = paginator.page(before=paginator.encode(faxes[2]))
+
+    assert page.items == faxes[0:2]
+    assert page.previous_cursor is None
+    assert paginator.page(after=page.next_cursor).items == faxes[2:4]
+
+
+def test_keyset_paginator__before_the_last_page_reaches_the_end():
+    faxes = keyset_faxes(7)
+    paginator = ListKeysetPaginator(faxes, 2)
+
+    page = paginator.page(before=paginator.encode(faxes[6]))
+
+    assert page.items == faxes[4:6]
+    last = paginator.page(after=page.next_cursor)
+    assert last.items == faxes[6:]
+    assert last.next_cursor is None
+    assert paginator.page(before=last.previous_cursor).items == faxes[4:6]
+
+
+def test_lazy_clients__are_shared_until_reset():
+    session = LazyLoadedHTTPSession().get_session()
+    assert LazyLoadedHTTPSession().get_session() is session
+
+    reset_clients()
+    assert LazyLoadedHTTPSession().get_session() is not session
+
+
+def test_lazy_clients__are_not_shared_with_a_forked_process(monkeypatch):
+    session = LazyLoadedHTTPSession().get_session()
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+
+    assert LazyLoadedHTTPSession().get_session() is not session
+    assert Singleton._pid == -1
+    monkeypatch.undo()
+    reset_clients()
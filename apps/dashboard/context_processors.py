@@ -4,3 +4,8 @@ from core.formatters import pretty_print_phone_number
 
 def fax_number(request):
     return {'TWILIO_NUMBER': pretty_print_phone_number(settings.TWILIO_NUMBER)}
+
+
+def fax_events_url(request):
+    """where pages listen for status changes, see accurate_replica.events"""
+    return {'FAX_EVENTS_URL': settings.FAX_EVENTS_URL}
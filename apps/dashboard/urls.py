@@ -1,14 +1,17 @@
 from django.urls import path
 from django.conf.urls import url
 
-from dashboard.views import Home, FaxDetail, NewFax
+from dashboard.views import BulkFax, BulkFaxDetail, FaxDetail, Home, NewFax, NewFaxUpload
 
 
 app_name = "dashboard"
 
 
 urlpatterns = [
+    path("fax/new/upload", NewFaxUpload.as_view(), name="new-fax-upload"),
     url("fax/new", NewFax.as_view(), name="new-fax"),
+    path("fax/bulk/<uuid:uuid>", BulkFaxDetail.as_view(), name="bulk-fax-detail"),
+    path("fax/bulk", BulkFax.as_view(), name="bulk-fax"),
     path("fax/<uuid:uuid>", FaxDetail.as_view(), name="fax-detail"),
     path("", Home.as_view(), name="home"),
 ]
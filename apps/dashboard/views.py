@@ -1,12 +1,48 @@
+from datetime import timedelta
 import logging
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect, render
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+import pytz
 
-from fax.models import Fax
-from fax.forms import OutboundFaxForm
+from core.keyset import InvalidCursor, KeysetPaginator
+from fax.coalesce import StatusCoalescer
+from fax.models import BulkSend, Fax, FaxStats
+from fax.forms import BulkFaxForm, FaxFilterForm, OutboundFaxForm, new_upload
+from fax.stats import DAY, HOUR, start_of_day
+from fax.uploads import S3StreamingUploadHandler
+
+
+def with_pending_statuses(faxes):
+    """show statuses that are still waiting to be flushed, see fax.coalesce"""
+    faxes = list(faxes)
+    if settings.FAX_STATUS_COALESCE_WINDOW:
+        StatusCoalescer().overlay(faxes)
+    return faxes
+
+
+def fax_stats():
+    """the stats panel, read from the rollups only, see fax.stats"""
+    tz = pytz.timezone(settings.FAX_STATS_TIME_ZONE)
+    now = timezone.now()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    today = start_of_day(now.astimezone(tz).date(), tz)
+    windows = [
+        ("Last 24 hours", HOUR, hour - timedelta(hours=23)),
+        ("Last 7 days", DAY, today - timedelta(days=6)),
+        ("Last 30 days", DAY, today - timedelta(days=29)),
+    ]
+    totals = FaxStats.objects.totals([(period, since) for _, period, since in windows])
+    return {
+        "windows": [(label, counts) for (label, _, _), counts in zip(windows, totals)],
+        "users": FaxStats.objects.by_user(DAY, today - timedelta(days=29))[:10],
+    }
 
 
 class DashboardHomeRedirectView(View):
@@ -18,27 +54,108 @@ class DashboardHomeRedirectView(View):
         return redirect("authentication:login")
 
 
+# what home.html shows, loaded with the creator in the same query
+LIST_FIELDS = [
+    "uuid", "created_on", "created_by__email", "direction", "_to", "_from", "sid", "status",
+    "fax_status", "status_rank", "error_message", "attempt", "priority", "send_at", "content",
+    "page_count",
+]
+
+
 class Home(LoginRequiredMixin, View):
     def get(self, request):
-        faxes = Fax.objects.all().order_by('-created_on')
-        return render(request, "home.html", context={'faxes': faxes})
+        # the filters without the cursor, for the page links
+        filters = request.GET.copy()
+        for key in ("after", "before"):
+            filters.pop(key, None)
+        form = FaxFilterForm(filters or None)
+        context = {'form': form, 'filters': filters.urlencode()}
+        if not request.GET:
+            context['stats'] = fax_stats()
+        if form.is_bound and not form.is_valid():
+            return render(request, "home.html", context={**context, 'faxes': []})
+
+        faxes = Fax.objects.select_related("created_by").only(*LIST_FIELDS)
+        if form.is_bound:
+            faxes = form.filter(faxes)
+        paginator = KeysetPaginator(faxes, settings.DASHBOARD_PAGE_SIZE)
+        try:
+            page = paginator.page(after=request.GET.get("after"), before=request.GET.get("before"))
+        except InvalidCursor:
+            return HttpResponse("", content_type="text/plain", status=400)
+        context.update(faxes=with_pending_statuses(page.items), page=page)
+        return render(request, "home.html", context=context)
 
 
 class FaxDetail(LoginRequiredMixin, View):
     def get(self, request, uuid):
-        fax = Fax.objects.get(uuid=uuid)
+        fax, = with_pending_statuses([Fax.objects.get(uuid=uuid)])
         return render(request, "fax-detail.html", context={'fax': fax})
 
 
-class NewFax(LoginRequiredMixin, View):
+@method_decorator(csrf_exempt, name="dispatch")
+class StreamedUploadView(LoginRequiredMixin, View):
+    """
+    posts whose document is streamed into S3 while the body is read, see
+    fax.uploads; subclasses implement `create`
+    """
+
+    def post(self, request):
+        # n.b. handlers must be swapped before anything reads the body, which is
+        # why the csrf check moves into `create`
+        handler = S3StreamingUploadHandler(request)
+        request.upload_handlers.insert(0, handler)
+        try:
+            response = csrf_protect(self.create)(request)
+        except Exception:
+            # n.b. nothing owns the stored file yet, e.g. form.save failed
+            handler.discard()
+            raise
+        if response.status_code != 302:
+            # rejected by the csrf check or the form, the stored file is unused
+            handler.discard()
+        return response
+
+
+class NewFax(StreamedUploadView):
     def get(self, request):
         form = OutboundFaxForm()
         return render(request, "new-fax.html", context={'form': form})
 
-    def post(self, request):
+    def create(self, request):
         form = OutboundFaxForm(request.POST, request.FILES, created_by=request.user)
         if form.is_valid():
             fax = form.save()
             return redirect('dashboard:fax-detail', uuid=str(fax.uuid))
         else:
             return render(request, 'new-fax.html', context={'form': form})
+
+
+class BulkFax(StreamedUploadView):
+    def get(self, request):
+        form = BulkFaxForm()
+        return render(request, "bulk-fax.html", context={'form': form})
+
+    def create(self, request):
+        form = BulkFaxForm(request.POST, request.FILES, created_by=request.user)
+        if form.is_valid():
+            bulk = form.save()
+            return redirect('dashboard:bulk-fax-detail', uuid=str(bulk.uuid))
+        else:
+            return render(request, 'bulk-fax.html', context={'form': form})
+
+
+class BulkFaxDetail(LoginRequiredMixin, View):
+    def get(self, request, uuid):
+        bulk = BulkSend.objects.select_related("blob", "created_by").get(uuid=uuid)
+        batches = list(bulk.progress())
+        done = sum(b["delivered"] + b["failed"] for b in batches)
+        context = {'bulk': bulk, 'batches': batches, 'done': done, 'finished': done >= bulk.total}
+        return render(request, "bulk-fax-detail.html", context=context)
+
+
+class NewFaxUpload(LoginRequiredMixin, View):
+    """presigned POST so the browser can upload the document straight to S3"""
+
+    def post(self, request):
+        return JsonResponse(new_upload(request.user))
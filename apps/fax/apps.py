@@ -8,5 +8,9 @@ class FaxConfig(AppConfig):
     name = "fax"
 
     def ready(self):
+        from fax import signals
         from fax import tasks
-        logger.warning(f'Fax Module Ready: loaded tasks - {id(tasks)}')
+        from fax.webhooks import get_request_validator
+
+        get_request_validator()
+        logger.warning(f'Fax Module Ready: loaded signals and tasks - {id(signals)}:{id(tasks)}')
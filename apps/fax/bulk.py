@@ -0,0 +1,47 @@
+"""
+One document to many recipients.
+
+Recipients come from pasted text or a CSV file and are validated in a single
+pass. The document is stored once as a MediaBlob, every Fax row is inserted
+with one `bulk_create`, and the sends are fanned out per batch as celery
+groups by fax.tasks._send_bulk_fax.
+"""
+import csv
+import io
+
+from core.formatters import InvalidUSPhoneNumberException, e164_format_phone_number
+
+
+def parse_recipients(text, column=None, exclude=()):
+    """
+    (numbers, invalid) from csv or pasted text
+
+    Every cell holding a digit is a number, unless `column` picks one cell per
+    row; cells without digits (headers, names) are skipped. Numbers come back
+    E.164 formatted, de-duplicated and in their original order. `invalid`
+    lists (line number, value) for everything that could not be formatted or
+    is in `exclude`.
+    """
+    numbers, invalid, seen = [], [], set()
+    for line, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        cells = row if column is None else row[column:column + 1]
+        for cell in cells:
+            cell = cell.strip()
+            if not any(c.isdigit() for c in cell):
+                continue
+            try:
+                number = e164_format_phone_number(cell)
+            except InvalidUSPhoneNumberException:
+                invalid.append((line, cell))
+                continue
+            if number in exclude:
+                invalid.append((line, cell))
+            elif number not in seen:
+                seen.add(number)
+                numbers.append(number)
+    return numbers, invalid
+
+
+def batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
@@ -0,0 +1,165 @@
+"""
+Coalescing of fax status callbacks.
+
+When FAX_STATUS_COALESCE_WINDOW is set, status callbacks are not written to the
+database one by one. Instead the highest-ranked status per fax is held in a
+redis hash and `fax.tasks._flush_status_updates` writes every pending change
+with a single `bulk_update` once per window. The rows are locked while they
+are compared and written, so a flush never moves a fax back to a lower rank.
+
+Readers that need the current status (the dashboard) overlay the pending
+values onto the faxes they loaded, see `StatusCoalescer.overlay`.
+
+Pending values carry the attempt they belong to, see fax.redial: a later
+attempt always replaces an earlier one, and a value for an attempt the fax has
+moved past is dropped.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from redis.exceptions import ResponseError
+import ujson as json
+
+from fax.status import status_rank
+from lazy_clients import LazyLoadedRedisClient
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = "fax:status:pending"
+FLUSHING = "fax:status:flushing"
+
+# keep the incoming status only if it outranks the one already pending for the
+# same attempt, or belongs to a later attempt
+RECORD_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current then
+    current = cjson.decode(current)
+    local attempt = tonumber(ARGV[4])
+    local current_attempt = current['attempt'] or 1
+    if current_attempt > attempt then
+        return 0
+    end
+    if current_attempt == attempt and current['rank'] >= tonumber(ARGV[2]) then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+return 1
+"""
+
+FIELDS = ["status", "fax_status", "error_message", "status_rank", "updated_on"]
+
+
+class StatusCoalescer:
+    def __init__(self):
+        self.client = LazyLoadedRedisClient().get_client()
+        self.record_script = self.client.register_script(RECORD_SCRIPT)
+
+    def record(self, uuid, status, fax_status, error_message=None, attempt=1):
+        rank = status_rank(status)
+        value = json.dumps(
+            dict(
+                status=status,
+                fax_status=fax_status,
+                error_message=error_message,
+                rank=rank,
+                attempt=attempt,
+            )
+        )
+        return self.record_script(keys=[PENDING], args=[str(uuid), rank, value, attempt])
+
+    def pending(self, uuids):
+        """pending status per uuid, including changes that are being flushed"""
+        uuids = [str(uuid) for uuid in uuids]
+        if not uuids:
+            return {}
+
+        pipeline = self.client.pipeline()
+        pipeline.hmget(FLUSHING, uuids)
+        pipeline.hmget(PENDING, uuids)
+        flushing, pending = pipeline.execute()
+
+        values = {}
+        for uuid, *candidates in zip(uuids, flushing, pending):
+            for candidate in candidates:
+                if candidate is None:
+                    continue
+                candidate = json.loads(candidate)
+                if uuid not in values or supersedes(candidate, values[uuid]):
+                    values[uuid] = candidate
+        return values
+
+    def overlay(self, faxes):
+        """apply pending statuses to already loaded faxes, in place"""
+        pending = self.pending(fax.uuid for fax in faxes)
+        for fax in faxes:
+            value = pending.get(str(fax.uuid))
+            if value and applies_to(value, fax):
+                apply(fax, value)
+        return faxes
+
+    def lock(self):
+        return self.client.lock(f"{FLUSHING}:lock", timeout=settings.FAX_STATUS_FLUSH_LOCK_TIMEOUT)
+
+    def flush(self, model):
+        """
+        write every pending status with one bulk_update; returns the changed
+        faxes. Run it in the transaction that counts them, see fax.stats.
+        """
+        # a flush that died before finishing leaves its snapshot behind
+        if not self.client.exists(FLUSHING):
+            try:
+                self.client.rename(PENDING, FLUSHING)
+            except ResponseError:
+                # n.b. RENAME fails when nothing is pending
+                return []
+
+        snapshot = {
+            uuid.decode(): json.loads(value)
+            for uuid, value in self.client.hgetall(FLUSHING).items()
+        }
+        with transaction.atomic():
+            # n.b. locked until written, so a status or attempt changed
+            # meanwhile is compared against rather than overwritten;
+            # direction, created_on and created_by are what fax.stats counts by
+            faxes = (
+                model.objects.select_for_update()
+                .filter(uuid__in=list(snapshot))
+                .only("uuid", "attempt", "direction", "created_on", "created_by", *FIELDS)
+                .order_by("uuid")
+            )
+
+            changed = []
+            for fax in faxes:
+                value = snapshot[str(fax.uuid)]
+                if applies_to(value, fax):
+                    apply(fax, value)
+                    changed.append(fax)
+
+            if changed:
+                model.objects.bulk_update(changed, FIELDS)
+            # n.b. a transaction that rolls back leaves the snapshot for the next flush
+            transaction.on_commit(lambda: self.client.delete(FLUSHING))
+
+        logger.info(f"flushed {len(changed)} of {len(snapshot)} pending fax statuses")
+        return changed
+
+
+def supersedes(value, other):
+    return (value.get("attempt", 1), value["rank"]) > (other.get("attempt", 1), other["rank"])
+
+
+def applies_to(value, fax):
+    return value.get("attempt", 1) == fax.attempt and value["rank"] > fax.status_rank
+
+
+def apply(fax, value):
+    fax.status = value["status"]
+    fax.fax_status = value["fax_status"]
+    fax.status_rank = value["rank"]
+    fax.updated_on = timezone.now()
+    if value["error_message"]:
+        fax.error_message = value["error_message"]
@@ -0,0 +1,44 @@
+"""
+Live fax events for the dashboard.
+
+Status callbacks and received faxes are published on a redis channel as they
+happen. accurate_replica.events relays them to the open dashboard pages as
+server-sent events, and the pages patch their status cells in place instead
+of being reloaded.
+
+Publishing is best effort: redis pub/sub keeps nothing for subscribers that
+aren't listening, and a failed publish is logged rather than failing the
+webhook or task that made the change. A page that misses an event shows the
+old status until it is reloaded.
+"""
+import logging
+
+from redis.exceptions import RedisError
+import ujson as json
+
+from lazy_clients import LazyLoadedRedisClient
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "fax:events"
+
+# the server-sent event names
+STATUS = "status"
+RECEIVED = "received"
+
+
+def publish(event, uuid, status, **fields):
+    """announce `event` for the fax `uuid`; returns the number of listening processes"""
+    data = json.dumps(dict(event=event, uuid=str(uuid), status=status, **fields))
+    try:
+        return LazyLoadedRedisClient().get_client().publish(CHANNEL, data)
+    except RedisError:
+        logger.exception(f"Failed to publish the {event} event of fax {uuid}.")
+        return 0
+
+
+def decode(data):
+    """(event name, fields) of a published message"""
+    fields = json.loads(data)
+    return fields.pop("event"), fields
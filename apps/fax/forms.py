@@ -1,19 +1,94 @@
+from datetime import datetime, time, timedelta
 import logging
+import re
+from uuid import uuid4
 
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
 from django import forms
+from django.db.models import Q
+from django.utils import timezone
 
 from core.formatters import e164_format_phone_number
-from fax.models import Fax
-from fax.tasks import _send_fax
+from fax.bulk import parse_recipients
+from fax.media import UPLOAD_PREFIX, presigned_upload, stored_object
+from fax.models import BulkSend, Fax, MediaBlob
+from fax.preflight import InvalidDocument, preflight
+from fax.scheduling import NORMAL, PRIORITY_CHOICES, from_browser_time
+from fax.status import STATUS_RANKS
+from fax.tasks import _prepare_fax_media, _send_bulk_fax
+from fax.uploads import StreamedUploadedFile
+from lazy_clients import LazyLoadedRedisClient
+
+
+UPLOAD_SALT = "fax.forms.upload"
+
+
+def blob_for(content):
+    """the MediaBlob for a posted file, streamed or not"""
+    if isinstance(content, StreamedUploadedFile):
+        return MediaBlob.objects.from_upload(content.upload)
+    return MediaBlob.objects.from_file(content)
+
+
+def inspect_upload(content):
+    """
+    DocumentInfo for a posted file, see fax.preflight; raises ValidationError
+    for documents twilio couldn't send. None for a file streamed to storage,
+    which is read on the media queue instead, see Fax.prepare_media and
+    BulkSend.prepare_media
+    """
+    if isinstance(content, StreamedUploadedFile):
+        # n.b. reading it back here would undo the streaming, see fax.uploads
+        return None
+    data = b''.join(content.chunks())
+    content.seek(0)
+    try:
+        return preflight(data)
+    except InvalidDocument as e:
+        raise forms.ValidationError(f'This document can\'t be faxed: {e}.')
+
+
+def new_upload(user):
+    """
+    presigned POST for one browser upload, plus the signed token that the
+    form later accepts in place of the file
+    """
+    name = f"{UPLOAD_PREFIX}/{uuid4()}.pdf"
+    upload = presigned_upload(
+        name,
+        "application/pdf",
+        max_size=settings.FAX_UPLOAD_MAX_SIZE,
+        expires=settings.FAX_UPLOAD_EXPIRES,
+    )
+    upload["token"] = signing.dumps(dict(name=name, user=str(user.pk)), salt=UPLOAD_SALT)
+    return upload
+
+
+def claim_upload(name):
+    """
+    whether this is the first fax for the uploaded object `name`; a token is
+    good for one fax, the object is gone once it has been adopted as a blob
+    """
+    client = LazyLoadedRedisClient().get_client()
+    # n.b. kept for as long as the token is accepted, see clean_upload
+    return bool(client.set(f"fax:upload:claimed:{name}", 1, nx=True, ex=settings.FAX_UPLOAD_EXPIRES * 2))
 
 
 class OutboundFaxForm(forms.Form):
     to = forms.CharField(max_length=17, label="to")
-    content = forms.FileField()
+    content = forms.FileField(required=False)
+    # set instead of `content` once the browser has uploaded the file itself
+    upload = forms.CharField(required=False, widget=forms.HiddenInput)
+    priority = forms.ChoiceField(choices=PRIORITY_CHOICES, initial=NORMAL, required=False)
+    send_at = forms.DateTimeField(required=False, input_formats=['%Y-%m-%dT%H:%M'])
+    # the browser's getTimezoneOffset() at `send_at`, in minutes; send_at is UTC without it
+    utc_offset = forms.IntegerField(required=False, min_value=-14 * 60, max_value=12 * 60, widget=forms.HiddenInput)
 
     def __init__(self, *args, **kwargs):
         self.created_by = kwargs.pop('created_by', None)
+        self.document = None
         super(OutboundFaxForm, self).__init__(*args, **kwargs)
 
     def clean_to(self):
@@ -25,20 +100,177 @@ class OutboundFaxForm(forms.Form):
 
     def clean_content(self):
         content = self.cleaned_data['content']
+        if content:
+            self.document = inspect_upload(content)
         return content
 
+    def clean_upload(self):
+        """the storage name behind a token from `new_upload`, once the object exists"""
+        token = self.cleaned_data.get('upload')
+        if not token:
+            return None
+        try:
+            value = signing.loads(token, salt=UPLOAD_SALT, max_age=settings.FAX_UPLOAD_EXPIRES * 2)
+        except signing.BadSignature:
+            raise forms.ValidationError('The upload has expired, please choose the file again.')
+        if self.created_by is None or value['user'] != str(self.created_by.pk):
+            raise forms.ValidationError('The upload belongs to someone else.')
+        if stored_object(value['name']) is None:
+            raise forms.ValidationError('The file was not uploaded, please try again.')
+        # n.b. read and checked on the media queue, see Fax.prepare_media
+        return value['name']
+
     def clean(self):
         super().clean()
         logging.warning(self.cleaned_data)
 
-        to = self.cleaned_data['to']
+        to = self.cleaned_data.get('to')
         if to == settings.TWILIO_NUMBER:
             raise forms.ValidationError('Sending fax to self is disallowed.')
+        if not self.errors and not (self.cleaned_data.get('content') or self.cleaned_data.get('upload')):
+            self.add_error('content', 'Please choose a file to send.')
+        if self.cleaned_data.get('content') and self.cleaned_data.get('upload'):
+            # n.b. one of the two would be left in storage unused
+            self.add_error('content', 'Please send either the uploaded file or a new one, not both.')
+
+        send_at = self.cleaned_data.get('send_at')
+        if send_at:
+            send_at = from_browser_time(send_at, self.cleaned_data.get('utc_offset'))
+            if send_at < timezone.now() - timedelta(minutes=1):
+                self.add_error('send_at', 'The send time is in the past.')
+            self.cleaned_data['send_at'] = send_at
+
+        # n.b. last, so a form sent back with other errors can reuse its token
+        upload = self.cleaned_data.get('upload')
+        if upload and not self.errors and not claim_upload(upload):
+            self.add_error('upload', 'This file has already been sent.')
         return self.cleaned_data
 
     def save(self):
         kwargs = self.cleaned_data
         kwargs['_to'] = kwargs.pop('to')  # N.B. update to match the model field
-        fax = Fax.objects.create(created_by=self.created_by, **kwargs)
-        _send_fax.delay(fax.uuid)
+        kwargs['priority'] = kwargs['priority'] or NORMAL
+        kwargs.pop('utc_offset')
+        upload = kwargs.pop('upload')
+        content = kwargs.pop('content')
+        if self.document:
+            kwargs.update(self.document._asdict())
+        if upload:
+            # n.b. hashed and adopted as a blob by _prepare_fax_media, off the web worker
+            fax = Fax.objects.create(created_by=self.created_by, content=upload, **kwargs)
+        else:
+            fax = Fax(created_by=self.created_by, **kwargs).attach_blob(blob_for(content))
+        _prepare_fax_media.delay(fax.uuid)
         return fax
+
+
+class BulkFaxForm(forms.Form):
+    recipients = forms.CharField(widget=forms.Textarea, required=False)
+    recipients_file = forms.FileField(required=False)
+    column = forms.IntegerField(required=False, min_value=1)
+    content = forms.FileField()
+
+    def __init__(self, *args, **kwargs):
+        self.created_by = kwargs.pop('created_by', None)
+        self.document = None
+        super(BulkFaxForm, self).__init__(*args, **kwargs)
+
+    def clean_content(self):
+        content = self.cleaned_data['content']
+        self.document = inspect_upload(content)
+        return content
+
+    def clean(self):
+        super().clean()
+        text = self.cleaned_data.get('recipients') or ''
+        upload = self.cleaned_data.get('recipients_file')
+        if upload:
+            try:
+                text = f"{text}\n{upload.read().decode('utf-8-sig')}"
+            except UnicodeDecodeError:
+                raise forms.ValidationError('The recipients file must be a utf-8 csv.')
+
+        column = self.cleaned_data.get('column')
+        numbers, invalid = parse_recipients(
+            text, None if column is None else column - 1, exclude=[settings.TWILIO_NUMBER]
+        )
+        if invalid:
+            shown = ', '.join(f'line {line}: "{value}"' for line, value in invalid[:20])
+            more = f' and {len(invalid) - 20} more' if len(invalid) > 20 else ''
+            raise forms.ValidationError(f'{len(invalid)} invalid numbers: {shown}{more}')
+        if not numbers:
+            raise forms.ValidationError('Please provide at least one fax number.')
+        if len(numbers) > settings.FAX_BULK_MAX_RECIPIENTS:
+            raise forms.ValidationError(
+                f'At most {settings.FAX_BULK_MAX_RECIPIENTS} recipients per bulk send.'
+            )
+        self.cleaned_data['numbers'] = numbers
+        return self.cleaned_data
+
+    def save(self):
+        blob = blob_for(self.cleaned_data['content'])
+        bulk = BulkSend.create(
+            blob, self.cleaned_data['numbers'], created_by=self.created_by, document=self.document
+        )
+        _send_bulk_fax.delay(bulk.uuid)
+        return bulk
+
+
+class FaxFilterForm(forms.Form):
+    """
+    the dashboard's search bar; every filter is served by an index on
+    (filter, created_on, uuid) or, for numbers, the trigram indexes on _to and
+    _from, see "Dashboard query plans" in the README
+    """
+
+    number = forms.CharField(required=False, max_length=17)
+    status = forms.ChoiceField(choices=[('', 'any status')] + [(s, s) for s in STATUS_RANKS], required=False)
+    direction = forms.ChoiceField(
+        choices=[('', 'any direction'), ('outbound', 'outbound'), ('inbound', 'inbound')], required=False
+    )
+    sender = forms.ModelChoiceField(
+        queryset=get_user_model().objects.order_by('email'), required=False, empty_label='anyone'
+    )
+    since = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    until = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def clean_number(self):
+        """the digits of a whole or partial number"""
+        digits = re.sub(r'\D', '', self.cleaned_data.get('number') or '')
+        if digits and len(digits) < 3:
+            # n.b. trigrams need three characters, anything shorter scans the table
+            raise forms.ValidationError('Please enter at least 3 digits.')
+        return digits
+
+    def clean(self):
+        super().clean()
+        since, until = self.cleaned_data.get('since'), self.cleaned_data.get('until')
+        if since and until and since > until:
+            self.add_error('until', 'The end date is before the start date.')
+        return self.cleaned_data
+
+    def filter(self, faxes):
+        data = self.cleaned_data
+        if data.get('number'):
+            faxes = faxes.filter(Q(_to__contains=data['number']) | Q(_from__contains=data['number']))
+        if data.get('status'):
+            faxes = faxes.filter(status=data['status'])
+        if data.get('direction'):
+            faxes = faxes.filter(direction=data['direction'])
+        if data.get('sender'):
+            faxes = faxes.filter(created_by=data['sender'])
+        # n.b. ranges on created_on itself, not __date, so the indexes apply;
+        # days are in the dashboard's time zone
+        if data.get('since'):
+            faxes = faxes.filter(created_on__gte=start_of_day(data['since']))
+        if data.get('until'):
+            faxes = faxes.filter(created_on__lt=start_of_day(data['until'] + timedelta(days=1)))
+        return faxes
+
+    @property
+    def is_filtered(self):
+        return self.is_bound and any(self.cleaned_data.get(name) for name in self.fields)
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
@@ -0,0 +1,114 @@
+"""
+Buffered ingest of inbound fax webhooks.
+
+In "buffered" mode `FaxReceivedView` appends each webhook body to a redis stream
+and acknowledges Twilio straight away. `fax.tasks._drain_inbound_faxes` later
+reads the stream in batches, bulk-inserts the Fax rows and fans out the
+receive tasks.
+
+Entries are acknowledged only once their faxes are stored and their tasks
+queued, so a crashed drain replays them. Replays are de-duplicated on the
+Twilio fax sid. An entry that is still unacknowledged after
+FAX_INGEST_MAX_DELIVERIES deliveries is moved to the `<stream>:dead` stream,
+so one bad webhook can't hold up the ones behind it.
+"""
+import logging
+
+from django.conf import settings
+from redis.exceptions import ResponseError
+import ujson as json
+
+from lazy_clients import LazyLoadedRedisClient
+
+
+logger = logging.getLogger(__name__)
+
+GROUP = "fax-ingest"
+CONSUMER = "drain"
+
+
+class InboundFaxBuffer:
+    def __init__(self, stream=None, client=None, max_deliveries=None):
+        self.stream = stream or settings.FAX_INGEST_STREAM
+        self.client = client or LazyLoadedRedisClient().get_client()
+        self.max_deliveries = max_deliveries or settings.FAX_INGEST_MAX_DELIVERIES
+
+    def append(self, body):
+        return self.client.xadd(self.stream, {"body": json.dumps(body)})
+
+    def lock(self):
+        """held while draining so only one worker reads the stream at a time"""
+        return self.client.lock(f"{self.stream}:lock", timeout=settings.FAX_INGEST_LOCK_TIMEOUT)
+
+    def ensure_group(self):
+        try:
+            self.client.xgroup_create(self.stream, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def batches(self, batch_size):
+        """
+        yield lists of (entry id, body) tuples
+
+        Entries delivered to a previous drain but never acknowledged are
+        replayed before new entries are read, and dead-lettered once they have
+        been delivered `max_deliveries` times.
+        """
+        self.ensure_group()
+        start = "0"
+        while True:
+            response = self.client.xreadgroup(GROUP, CONSUMER, {self.stream: start}, count=batch_size)
+            entries = response[0][1] if response else []
+
+            if not entries:
+                if start == ">":
+                    return
+                start = ">"
+                continue
+
+            given_up = set()
+            if start != ">":
+                # n.b. an entry left unacknowledged again must not be read again in this drain
+                start = entries[-1][0]
+                given_up = self.given_up(entries[0][0], entries[-1][0], len(entries))
+
+            batch, dead = [], []
+            for entry_id, fields in entries:
+                if not fields:
+                    # trimmed from the stream while pending; nothing to replay
+                    self.ack([entry_id])
+                elif entry_id in given_up:
+                    dead.append((entry_id, fields))
+                else:
+                    batch.append((entry_id, json.loads(fields[b"body"])))
+            self.dead_letter(dead)
+            if batch:
+                yield batch
+
+    def given_up(self, first, last, count):
+        """ids of the pending entries from `first` to `last` delivered `max_deliveries` times"""
+        pending = self.client.xpending_range(self.stream, GROUP, first, last, count)
+        return {
+            entry["message_id"] for entry in pending if entry["times_delivered"] > self.max_deliveries
+        }
+
+    def dead_letter(self, entries):
+        """move (entry id, fields) entries to the dead letter stream for a closer look"""
+        if not entries:
+            return
+        for entry_id, fields in entries:
+            logger.error(f"Giving up on inbound fax webhook {entry_id.decode()}: {fields[b'body']}")
+        pipeline = self.client.pipeline()
+        for entry_id, fields in entries:
+            pipeline.xadd(f"{self.stream}:dead", {"id": entry_id, **fields})
+        pipeline.execute()
+        self.ack([entry_id for entry_id, _ in entries])
+
+    def ack(self, entry_ids):
+        if not entry_ids:
+            return
+        pipeline = self.client.pipeline()
+        pipeline.xack(self.stream, GROUP, *entry_ids)
+        pipeline.xdel(self.stream, *entry_ids)
+        pipeline.execute()
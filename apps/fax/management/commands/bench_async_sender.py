@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.local_services import LocalS3Server, LocalTwilioServer
+from fax import sender
+from fax.models import Fax
+from fax.status import status_rank
+from lazy_clients import LazyLoadedTwilioClient, reset_clients
+
+
+BENCH_NUMBER = "+15555550199"
+DOCUMENT = b"%PDF-1.4\n1 0 obj << /Type /Page >> endobj\n%%EOF\n"
+
+
+def send_one(fax):
+    """what _send_fax does for a single fax: one blocking create, then save"""
+    client = LazyLoadedTwilioClient().get_client()
+    response = client.request("POST", f"{settings.TWILIO_FAX_API_URL}/Faxes", data=sender.create_params(fax))
+    body = json.loads(response.text)
+    fax.sid, fax.status = body["sid"], body["status"]
+    fax.status_rank = status_rank(fax.status)
+    fax.save()
+    fax.attempts.update_or_create(number=fax.attempt, defaults=dict(sid=fax.sid, status=fax.status))
+
+
+def send_slice(faxes):
+    """one celery worker process working through its share of the tasks"""
+    try:
+        for fax in faxes:
+            send_one(fax)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Compare per-fax sends with the async send engine against a local twilio stand-in"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--faxes", type=int, default=500)
+        parser.add_argument("--latency", type=float, default=0.2, help="stand-in api response time in seconds")
+        parser.add_argument("--workers", type=int, default=4, help="celery concurrency for per-fax sends")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 100])
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        count = options["faxes"]
+        with LocalS3Server() as s3, LocalTwilioServer(latency=options["latency"]) as twilio:
+            overrides = dict(
+                AWS_S3_ENDPOINT_URL=s3.url,
+                AWS_S3_BUCKET_NAME="bench",
+                AWS_S3_ADDRESSING_STYLE="path",
+                AWS_ACCESS_KEY_ID="bench",
+                AWS_SECRET_ACCESS_KEY="bench",
+                TWILIO_FAX_API_URL=f"{twilio.url}/v1",
+                # n.b. measure the sender, not the shared rate limit
+                TWILIO_RATE_LIMITS={"default": (1_000_000, 1_000_000)},
+            )
+            with override_settings(**overrides):
+                reset_clients()
+                name = default_storage.save("fax-media/bench-async-sender.pdf", ContentFile(DOCUMENT))
+                self.stdout.write(f"{'mode':>14} {'faxes':>6} {'seconds':>8} {'faxes/s':>8}")
+                try:
+                    workers = options["workers"]
+                    self.run(f"per-fax x{workers}", count, name, lambda: self.per_fax(workers))
+                    for concurrency in options["concurrency"]:
+                        self.run(
+                            f"async x{concurrency}",
+                            count,
+                            name,
+                            lambda: sender.send_queued_faxes(options["batch_size"], concurrency),
+                        )
+                finally:
+                    Fax.objects.filter(_to=BENCH_NUMBER).delete()
+                    default_storage.delete(name)
+                    reset_clients()
+
+    def run(self, label, count, name, send):
+        Fax.objects.filter(_to=BENCH_NUMBER).delete()
+        Fax.objects.bulk_create(
+            Fax(_to=BENCH_NUMBER, content=name, queued_on=timezone.now()) for _ in range(count)
+        )
+        start = time.perf_counter()
+        send()
+        elapsed = time.perf_counter() - start
+
+        sent = Fax.objects.filter(_to=BENCH_NUMBER, sid__isnull=False).count()
+        self.stdout.write(f"{label:>14} {sent:>6} {elapsed:>8.2f} {sent / elapsed:>8.1f}")
+
+    def per_fax(self, workers):
+        faxes = list(Fax.objects.filter(_to=BENCH_NUMBER, sid__isnull=True).select_related("blob"))
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(send_slice, [faxes[number::workers] for number in range(workers)]))
@@ -0,0 +1,136 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.shortcuts import render
+from django.test import RequestFactory
+
+from core.keyset import KeysetPaginator
+from dashboard.views import LIST_FIELDS, Home
+from fax.models import Fax
+
+
+BENCH_NUMBER = "+15555550197"
+BENCH_EMAIL = "bench-dashboard-{}@example.com"
+BENCH_PHONE = "+1555556{:04d}"
+
+
+class QueryTimer:
+    """execute wrapper counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+
+def legacy_home(request):
+    """dashboard.views.Home before keyset pages: every fax, one query per creator"""
+    faxes = Fax.objects.all().order_by("-created_on")
+    return render(request, "home.html", context={"faxes": faxes})
+
+
+def offset_home(request, offset):
+    """an OFFSET page at the same depth, for comparison"""
+    faxes = Fax.objects.select_related("created_by").only(*LIST_FIELDS).order_by("-created_on", "-uuid")
+    per_page = settings.DASHBOARD_PAGE_SIZE
+    return render(request, "home.html", context={"faxes": list(faxes[offset : offset + per_page])})
+
+
+class Command(BaseCommand):
+    help = "Queries and latency of the dashboard list at growing table sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--users", type=int, default=20, help="distinct creators")
+        parser.add_argument("--runs", type=int, default=3, help="the median is reported")
+        parser.add_argument(
+            "--legacy-max", type=int, default=10_000, help="skip the unpaginated page above this many rows"
+        )
+
+    def handle(self, *args, **options):
+        self.runs = options["runs"]
+        self.factory = RequestFactory()
+        self.users = []
+        # the dashboard's own view, so the rows are loaded the way it loads them
+        home = Home.as_view()
+        keyset_paginator = KeysetPaginator(Fax.objects.all(), 1)
+
+        self.stdout.write(f"{'rows':>9} {'page':>14} {'queries':>8} {'db ms':>9} {'total ms':>9}")
+        try:
+            for number in range(options["users"]):
+                self.users.append(
+                    get_user_model().objects.create(
+                        email=BENCH_EMAIL.format(number), phone_number=BENCH_PHONE.format(number)
+                    )
+                )
+
+            inserted = 0
+            for rows in sorted(options["rows"]):
+                self.insert(rows - inserted)
+                inserted = rows
+
+                self.report(rows, "keyset first", self.measure(home, "/dashboard/"))
+
+                depth = rows // 2
+                middle = Fax.objects.order_by("-created_on", "-uuid").only("created_on", "uuid")[depth]
+                cursor = keyset_paginator.encode(middle)
+                self.report(rows, "keyset middle", self.measure(home, f"/dashboard/?after={cursor}"))
+                self.report(rows, "offset middle", self.measure(offset_home, "/dashboard/", depth))
+                if rows <= options["legacy_max"]:
+                    self.report(rows, "unpaginated", self.measure(legacy_home, "/dashboard/", runs=1))
+        finally:
+            with connection.cursor() as cursor:
+                # n.b. the bench rows have nothing that cascades; skip the ORM's collector
+                cursor.execute("DELETE FROM fax_fax WHERE _to = %s", [BENCH_NUMBER])
+            get_user_model().objects.filter(uuid__in=[user.uuid for user in self.users]).delete()
+
+    def insert(self, count):
+        """`count` more rows, one per second back in time, copied from a template fax"""
+        template = Fax.objects.create(_to=BENCH_NUMBER, content="fax-media/bench.pdf", created_by=self.users[0])
+        keys = ("uuid", "created_on", "created_by_id")
+        fields = [field.column for field in Fax._meta.concrete_fields if field.column not in keys]
+        columns = ", ".join(f'"{column}"' for column in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO fax_fax (uuid, created_on, created_by_id, {columns})
+                SELECT gen_random_uuid(),
+                       now() - (SELECT count(*) FROM fax_fax WHERE _to = %s) * interval '1 second'
+                             - number * interval '1 second',
+                       (%s::uuid[])[1 + number %% %s],
+                       {columns}
+                FROM fax_fax, generate_series(1, %s) AS number
+                WHERE uuid = %s
+                """,
+                [BENCH_NUMBER, [str(user.uuid) for user in self.users], len(self.users), count - 1, template.uuid],
+            )
+            cursor.execute("ANALYZE fax_fax")
+
+    def measure(self, view, path, *args, runs=None):
+        """(queries, median milliseconds in the database, median milliseconds in total) to render the page"""
+        timings, db_timings = [], []
+        for _ in range(runs or self.runs):
+            request = self.factory.get(path)
+            request.user = self.users[0]
+            timer = QueryTimer()
+            with connection.execute_wrapper(timer):
+                start = time.perf_counter()
+                view(request, *args)
+                timings.append(time.perf_counter() - start)
+            db_timings.append(timer.seconds)
+        return timer.queries, statistics.median(db_timings) * 1000, statistics.median(timings) * 1000
+
+    def report(self, rows, label, measured):
+        queries, db_ms, ms = measured
+        self.stdout.write(f"{rows:>9} {label:>14} {queries:>8} {db_ms:>9.1f} {ms:>9.1f}")
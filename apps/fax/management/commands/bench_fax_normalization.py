@@ -0,0 +1,79 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+import pymupdf
+import requests
+
+from core.local_services import LocalS3Server, LocalTwilioServer
+from fax.management.commands.bench_thumbnails import sample_document
+from fax.media import MultipartUpload
+from fax.normalize import normalize_document
+
+
+KB = 1024
+
+
+def scanned_document(pages, dpi=300):
+    """colour page images at scanner resolution, like a phone or office scan"""
+    letter = pymupdf.open(stream=sample_document(pages), filetype="pdf")
+    document = pymupdf.open()
+    for source in letter:
+        source.draw_rect(pymupdf.Rect(72, 400, 540, 600), color=(0.8, 0.1, 0.1), fill=(0.9, 0.85, 0.6))
+        source.draw_circle((306, 500), 80, color=(0.1, 0.2, 0.7), fill=(0.5, 0.7, 0.9))
+        pixmap = source.get_pixmap(dpi=dpi, alpha=False)
+        page = document.new_page(width=source.rect.width, height=source.rect.height)
+        page.insert_image(page.rect, stream=pixmap.tobytes("jpeg"))
+    data = document.tobytes()
+    document.close()
+    letter.close()
+    return data
+
+
+class Command(BaseCommand):
+    help = "Benchmark fax normalization on media size and transmission time against a local Twilio stand-in"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=5)
+        parser.add_argument("--bitrate", type=int, default=14400, help="line rate in bit/s (V.17)")
+
+    def handle(self, *args, **options):
+        pages = options["pages"]
+        documents = [("text", sample_document(pages)), ("scan", scanned_document(pages))]
+
+        # twilio's own conversion is modelled with the same renderer, so the
+        # line time compares what the receiving machine gets in both cases
+        twilio = LocalTwilioServer(transcode=normalize_document, bitrate=options["bitrate"])
+        with LocalS3Server() as s3, twilio:
+            overrides = dict(
+                AWS_S3_ENDPOINT_URL=s3.url,
+                AWS_S3_BUCKET_NAME="bench",
+                AWS_S3_ADDRESSING_STYLE="path",
+                AWS_ACCESS_KEY_ID="bench",
+                AWS_SECRET_ACCESS_KEY="bench",
+            )
+            with override_settings(**overrides):
+                self.stdout.write(
+                    f"{'document':>8} {'mode':>10} {'media KB':>9} {'prepare s':>9} "
+                    f"{'fetch s':>8} {'convert s':>9} {'line s/page':>11}"
+                )
+                for label, data in documents:
+                    start = time.perf_counter()
+                    normalized = normalize_document(data)
+                    prepare = time.perf_counter() - start
+
+                    for mode, media, seconds in [("original", data, 0), ("normalized", normalized, prepare)]:
+                        name = f"fax-media/bench-{label}-{mode}.pdf"
+                        with MultipartUpload(name) as upload:
+                            upload.write(media)
+                        response = requests.post(
+                            f"{twilio.url}/v1/Faxes",
+                            data={"To": "+15555550111", "From": "+15555550100", "MediaUrl": default_storage.url(name)},
+                        )
+                        fax = response.json()
+                        self.stdout.write(
+                            f"{label:>8} {mode:>10} {fax['media_size'] / KB:>9.1f} {seconds:>9.2f} "
+                            f"{fax['fetch_seconds']:>8.3f} {fax['transcode_seconds']:>9.2f} "
+                            f"{fax['duration'] / fax['num_pages']:>11.1f}"
+                        )
@@ -0,0 +1,91 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from core.local_services import (
+    LocalMediaServer,
+    LocalS3Server,
+    LocalTwilioServer,
+    self_signed_certificate,
+)
+from fax.media import fetch_to_storage
+from lazy_clients import LazyLoadedTwilioClient, reset_clients
+
+
+def send_fax(twilio_url, media_url):
+    """what Fax.send_fax and Fax.resource ask of twilio: create, then fetch"""
+    client = LazyLoadedTwilioClient().get_client()
+    response = client.request(
+        "POST",
+        f"{twilio_url}/v1/Faxes",
+        data={"From": "+15555550100", "To": "+15555550123", "MediaUrl": media_url},
+    )
+    sid = json.loads(response.text)["sid"]
+    client.request("GET", f"{twilio_url}/v1/Faxes/{sid}")
+
+
+def receive_fax(media_url, name):
+    """what Fax.receive_fax does with twilio's media url"""
+    fetch_to_storage(media_url, name)
+
+
+class Command(BaseCommand):
+    help = "Count TLS handshakes per fax with fresh clients per call and with the process-wide pools"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--faxes", type=int, default=50, help="faxes sent and received per mode")
+        parser.add_argument("--size", type=int, default=64, help="document size in KB")
+
+    def handle(self, *args, **options):
+        certfile = self_signed_certificate()
+        previous_bundle = os.environ.get("REQUESTS_CA_BUNDLE")
+        os.environ["REQUESTS_CA_BUNDLE"] = certfile
+        count = options["faxes"]
+        size = options["size"] * 1024
+
+        try:
+            with LocalS3Server(keep_bodies=False) as s3, \
+                    LocalTwilioServer(certfile=certfile) as twilio, \
+                    LocalMediaServer(size, certfile=certfile) as inbound, \
+                    LocalMediaServer(size) as outbound:
+                overrides = dict(
+                    AWS_S3_ENDPOINT_URL=s3.url,
+                    AWS_S3_BUCKET_NAME="bench",
+                    AWS_S3_ADDRESSING_STYLE="path",
+                    AWS_ACCESS_KEY_ID="bench",
+                    AWS_SECRET_ACCESS_KEY="bench",
+                    # n.b. measure connections, not the shared rate limit
+                    TWILIO_RATE_LIMITS={"default": (1_000_000, 1_000_000)},
+                )
+                with override_settings(**overrides):
+                    self.stdout.write(
+                        f"{'clients':>8} {'faxes':>6} {'twilio':>8} {'media':>8} {'per fax':>8} {'ms/fax':>8}"
+                    )
+                    # before lazy_clients' registry worked every call built its own client
+                    for label, fresh in [("fresh", True), ("pooled", False)]:
+                        reset_clients()
+                        twilio.server.handshakes = inbound.server.handshakes = 0
+                        start = time.perf_counter()
+                        for number in range(count):
+                            if fresh:
+                                reset_clients()
+                            send_fax(twilio.url, outbound.url)
+                            receive_fax(inbound.url, f"fax-media/bench-{label}-{number}.pdf")
+                        elapsed = time.perf_counter() - start
+
+                        handshakes = twilio.server.handshakes + inbound.server.handshakes
+                        self.stdout.write(
+                            f"{label:>8} {count:>6} {twilio.server.handshakes:>8} "
+                            f"{inbound.server.handshakes:>8} {handshakes / count:>8.2f} "
+                            f"{elapsed * 1000 / count:>8.1f}"
+                        )
+        finally:
+            reset_clients()
+            os.unlink(certfile)
+            if previous_bundle is None:
+                os.environ.pop("REQUESTS_CA_BUNDLE")
+            else:
+                os.environ["REQUESTS_CA_BUNDLE"] = previous_bundle
@@ -0,0 +1,85 @@
+from multiprocessing import get_context
+from tempfile import NamedTemporaryFile
+import resource
+import time
+import tracemalloc
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+import requests
+
+from core.local_services import LocalMediaServer, LocalS3Server
+from fax.media import fetch_to_storage
+
+
+MB = 1024 * 1024
+
+
+def buffered_transfer(url, name):
+    """the pre-streaming implementation of Fax.receive_fax"""
+    req = requests.get(url)
+    with NamedTemporaryFile() as fp:
+        fp.write(req.content)
+        fp.seek(0)
+        default_storage.save(name, File(fp))
+
+
+def streaming_transfer(url, name):
+    fetch_to_storage(url, name)
+
+
+def measure(connection, transfer, url, name):
+    """runs in a fresh process so peak RSS belongs to a single transfer"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    transfer(url, name)
+    elapsed = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    connection.send((elapsed, traced_peak, (peak - baseline) * 1024))
+    connection.close()
+
+
+class Command(BaseCommand):
+    help = "Benchmark inbound media transfer against local HTTP and S3 stand-ins"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[5, 40, 120], help="document sizes in MB")
+        parser.add_argument("--part-size", type=int, default=8, help="multipart part size in MB")
+
+    def handle(self, *args, **options):
+        context = get_context("fork")
+        transfers = [("buffered", buffered_transfer), ("streaming", streaming_transfer)]
+
+        with LocalS3Server(keep_bodies=False) as s3:
+            overrides = dict(
+                AWS_S3_ENDPOINT_URL=s3.url,
+                AWS_S3_BUCKET_NAME="bench",
+                AWS_S3_ADDRESSING_STYLE="path",
+                AWS_ACCESS_KEY_ID="bench",
+                AWS_SECRET_ACCESS_KEY="bench",
+                FAX_MEDIA_PART_SIZE=options["part_size"] * MB,
+            )
+            with override_settings(**overrides):
+                self.stdout.write(f"{'size':>8} {'mode':>10} {'MB/s':>8} {'py peak':>10} {'rss delta':>10}")
+                for size in options["sizes"]:
+                    with LocalMediaServer(size * MB) as media:
+                        for label, transfer in transfers:
+                            receiver, sender = context.Pipe(duplex=False)
+                            name = f"fax-media/bench-{label}-{size}.pdf"
+                            process = context.Process(
+                                target=measure, args=(sender, transfer, media.url, name)
+                            )
+                            process.start()
+                            process.join()
+                            if process.exitcode != 0:
+                                raise CommandError(f"{label} transfer of {size}MB failed")
+                            elapsed, traced_peak, rss_delta = receiver.recv()
+                            self.stdout.write(
+                                f"{size:>6}MB {label:>10} {size / elapsed:>8.1f} "
+                                f"{traced_peak / MB:>8.1f}MB {rss_delta / MB:>8.1f}MB"
+                            )
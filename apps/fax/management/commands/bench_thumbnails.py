@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+import pymupdf
+
+from fax.thumbnails import render_thumbnails
+
+
+def sample_document(pages):
+    """a text-heavy letter-size pdf, roughly what we send and receive"""
+    document = pymupdf.open()
+    line = "The quick brown fox jumps over the lazy dog. 0123456789 " * 2
+    for number in range(pages):
+        page = document.new_page(width=612, height=792)
+        page.insert_text((72, 72), f"Page {number + 1}", fontsize=18)
+        page.insert_textbox(pymupdf.Rect(72, 100, 540, 720), (line + "\n") * 40, fontsize=9)
+        page.draw_rect(pymupdf.Rect(72, 730, 540, 760), width=1)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+class Command(BaseCommand):
+    help = "Benchmark thumbnail rendering throughput for different pool sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=40)
+        parser.add_argument("--processes", nargs="+", type=int, default=[1, 2, 4])
+        parser.add_argument("--width", type=int, default=240)
+
+    def handle(self, *args, **options):
+        pages = options["pages"]
+        data = sample_document(pages)
+        self.stdout.write(f"{pages} pages, {len(data) / 1024:.0f}KB pdf")
+        self.stdout.write(f"{'processes':>10} {'seconds':>8} {'pages/s':>8} {'KB/page':>8}")
+        for processes in options["processes"]:
+            # warm the pool so process start-up is not counted
+            render_thumbnails(data, width=options["width"], processes=processes)
+            start = time.perf_counter()
+            images = render_thumbnails(data, width=options["width"], processes=processes)
+            elapsed = time.perf_counter() - start
+            size = sum(len(image) for image in images) / len(images) / 1024
+            self.stdout.write(f"{processes:>10} {elapsed:>8.2f} {pages / elapsed:>8.1f} {size:>8.1f}")
@@ -0,0 +1,62 @@
+from urllib.parse import urlencode
+import timeit
+import urllib.parse
+
+from django.core.management.base import BaseCommand
+
+from fax.webhooks import FaxStatusPayload, ReceivedFaxPayload
+
+
+def legacy_request_body(body):
+    """the hand-rolled parser formerly used by GetRequestBody"""
+    query_params = body.decode().split("&")
+    return {
+        k.strip(): urllib.parse.unquote(v.strip())
+        for k, v in [t.split("=") for t in query_params]
+    }
+
+
+COMMON = {
+    "AccountSid": "AC" + "0" * 32,
+    "ApiVersion": "v1",
+    "FaxSid": "FX" + "1" * 32,
+    "From": "+13125550100",
+    "To": "+13125550199",
+    "RemoteStationId": "ACME FAX 01",
+    "NumPages": "12",
+    "MediaUrl": "https://media.twiliocdn.com/fax/FX111/abcdef0123456789",
+    "OriginalMediaUrl": "https://example.com/documents/report-2019.pdf",
+}
+
+BODIES = {
+    "status callback": urlencode(dict(COMMON, Status="delivered", FaxStatus="delivered")).encode(),
+    "status callback w/ error": urlencode(
+        dict(COMMON, Status="failed", FaxStatus="failed", ErrorCode="10001", ErrorMessage="Line busy")
+    ).encode(),
+    "fax received": urlencode(dict(COMMON, Status="received", FaxStatus="received")).encode(),
+}
+
+DECODERS = {
+    "status callback": FaxStatusPayload,
+    "status callback w/ error": FaxStatusPayload,
+    "fax received": ReceivedFaxPayload,
+}
+
+
+class Command(BaseCommand):
+    help = "Compare the webhook decoders against the legacy GetRequestBody parser"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=100000)
+
+    def handle(self, *args, **options):
+        number = options["number"]
+        self.stdout.write(f"{'payload':>26} {'legacy us':>10} {'decoder us':>11} {'speedup':>8}")
+        for label, body in BODIES.items():
+            decoder = DECODERS[label]
+            legacy = min(timeit.repeat(lambda: legacy_request_body(body), number=number, repeat=3))
+            typed = min(timeit.repeat(lambda: decoder.decode(body), number=number, repeat=3))
+            self.stdout.write(
+                f"{label:>26} {legacy / number * 1e6:>10.2f} {typed / number * 1e6:>11.2f} "
+                f"{legacy / typed:>7.1f}x"
+            )
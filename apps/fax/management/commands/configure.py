@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 
 from lazy_clients import LazyLoadedTwilioClient
+from rate_limits import blocking
 
 from django.conf import settings
 from django.urls import reverse
@@ -16,7 +17,8 @@ class Command(BaseCommand):
         self.stdout.write(self.style.WARNING(f'               voice url: {voice_url}'))
 
         client = LazyLoadedTwilioClient().get_client()
-        number = client.incoming_phone_numbers.get(settings.TWILIO_NUMBER_SID)
-        number.update(voice_url=voice_url)
+        with blocking():
+            number = client.incoming_phone_numbers.get(settings.TWILIO_NUMBER_SID)
+            number.update(voice_url=voice_url)
 
         self.stdout.write(self.style.SUCCESS('Phone Number Successfully Configured!'))
@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from core.keyset import KeysetPaginator
+from dashboard.views import LIST_FIELDS
+from fax.forms import FaxFilterForm
+from fax.models import Fax
+
+
+SEED_NUMBER = "+1555557"
+SEED_EMAIL = "explain-fax-filters-{}@example.com"
+SEED_PHONE = "+1555558{:04d}"
+STATUSES = ["delivered"] * 6 + ["failed", "busy", "no-answer", "received"]
+
+
+class Command(BaseCommand):
+    help = "Print the query plans behind each of the dashboard's filter combinations"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="add this many synthetic faxes first, removed after")
+        parser.add_argument("--users", type=int, default=20, help="creators of the synthetic faxes")
+        parser.add_argument("--analyze", action="store_true", help="run the queries, EXPLAIN ANALYZE")
+
+    def handle(self, *args, **options):
+        self.users = []
+        try:
+            if options["seed"]:
+                self.seed(options["seed"], options["users"])
+            for name, data in self.combinations():
+                self.explain(name, data, options["analyze"])
+        finally:
+            if options["seed"]:
+                with connection.cursor() as cursor:
+                    cursor.execute("DELETE FROM fax_fax WHERE _to LIKE %s", [f"{SEED_NUMBER}%"])
+                get_user_model().objects.filter(uuid__in=[user.uuid for user in self.users]).delete()
+
+    def combinations(self):
+        """every filter alone, and the pairs people use together"""
+        outbound = Fax.objects.filter(direction="outbound").order_by("-created_on").only("_to").first()
+        sender = (
+            Fax.objects.exclude(created_by=None)
+            .values_list("created_by", flat=True)
+            .annotate(faxes=Count("uuid"))
+            .order_by("-faxes")
+            .first()
+        )
+        if outbound is None or sender is None:
+            raise CommandError("No outbound faxes to filter, try --seed.")
+        number = outbound._to[-4:]
+        today = timezone.localdate()
+        week = dict(since=today - timedelta(days=7), until=today)
+        return [
+            ("no filters", {}),
+            ("status", dict(status="failed")),
+            ("direction", dict(direction="inbound")),
+            ("sender", dict(sender=sender)),
+            ("date range", week),
+            ("number", dict(number=number)),
+            ("status + direction", dict(status="failed", direction="outbound")),
+            ("status + date range", dict(status="failed", **week)),
+            ("sender + date range", dict(sender=sender, **week)),
+            ("number + status", dict(number=number, status="delivered")),
+            ("everything", dict(number=number, status="delivered", direction="outbound", sender=sender, **week)),
+        ]
+
+    def explain(self, name, data, analyze):
+        form = FaxFilterForm(data)
+        if not form.is_valid():
+            raise CommandError(f"{name}: {form.errors.as_text()}")
+        faxes = form.filter(Fax.objects.select_related("created_by").only(*LIST_FIELDS))
+        paginator = KeysetPaginator(faxes, settings.DASHBOARD_PAGE_SIZE)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: {data or ''}"))
+        self.stdout.write(paginator.query().explain(analyze=analyze))
+        # a later page adds the keyset condition, see core.keyset
+        last = paginator.query()[settings.DASHBOARD_PAGE_SIZE - 1 : settings.DASHBOARD_PAGE_SIZE].first()
+        if last is not None:
+            values = paginator.decode(paginator.encode(last))
+            self.stdout.write(self.style.MIGRATE_LABEL("next page"))
+            self.stdout.write(paginator.query("<", values).explain(analyze=analyze))
+        self.stdout.write("")
+
+    def seed(self, count, user_count):
+        """synthetic faxes with spread out statuses, directions, numbers, creators and dates"""
+        for number in range(user_count):
+            self.users.append(
+                get_user_model().objects.create(
+                    email=SEED_EMAIL.format(number), phone_number=SEED_PHONE.format(number)
+                )
+            )
+        template = Fax.objects.create(_to=f"{SEED_NUMBER}0000", content="fax-media/explain.pdf")
+        keys = ("uuid", "created_on", "created_by_id", "direction", "status", "_to", "_from")
+        columns = ", ".join(f'"{field.column}"' for field in Fax._meta.concrete_fields if field.column not in keys)
+        with connection.cursor() as cursor:
+            # n.b. one fax in five is inbound, with no creator and a varying sender
+            cursor.execute(
+                f"""
+                INSERT INTO fax_fax (uuid, created_on, created_by_id, direction, status, _to, _from, {columns})
+                SELECT gen_random_uuid(),
+                       now() - number * interval '30 seconds',
+                       CASE WHEN number %% 5 = 0 THEN NULL ELSE (%s::uuid[])[1 + number %% %s] END,
+                       CASE WHEN number %% 5 = 0 THEN 'inbound' ELSE 'outbound' END,
+                       (%s::text[])[1 + number %% %s],
+                       %s || lpad((number * 7919 %% 10000)::text, 4, '0'),
+                       '+1' || lpad((number * 104729 %% 10000000000)::text, 10, '0'),
+                       {columns}
+                FROM fax_fax, generate_series(1::bigint, %s) AS number
+                WHERE uuid = %s
+                """,
+                [
+                    [str(user.uuid) for user in self.users],
+                    len(self.users),
+                    STATUSES,
+                    len(STATUSES),
+                    SEED_NUMBER,
+                    count,
+                    template.uuid,
+                ],
+            )
+            cursor.execute("ANALYZE fax_fax")
+        template.delete()
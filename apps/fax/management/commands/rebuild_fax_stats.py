@@ -0,0 +1,83 @@
+from argparse import ArgumentTypeError
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Trunc
+import pytz
+
+from fax.models import Fax, FaxStats
+from fax.stats import DAY, DELIVERED, FAILED_STATUSES, HOUR, start_of_day
+
+
+COUNTS = dict(
+    sent=Count("uuid", filter=Q(direction="outbound")),
+    received=Count("uuid", filter=~Q(direction="outbound")),
+    delivered=Count("uuid", filter=Q(direction="outbound", status=DELIVERED)),
+    failed=Count("uuid", filter=Q(direction="outbound", status__in=FAILED_STATUSES)),
+)
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ArgumentTypeError(f"not a YYYY-MM-DD date: {value}")
+
+
+class Command(BaseCommand):
+    help = "Rebuild the fax statistics rollups from the faxes, a few days at a time, see fax.stats"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since", type=parse_date, help="first day, YYYY-MM-DD; the oldest fax's by default"
+        )
+        parser.add_argument("--until", type=parse_date, help="last day, YYYY-MM-DD; today by default")
+        parser.add_argument("--batch-days", type=int, default=7, help="days rebuilt per transaction")
+
+    def handle(self, *args, **options):
+        tz = pytz.timezone(settings.FAX_STATS_TIME_ZONE)
+        oldest = Fax.objects.order_by("created_on").values_list("created_on", flat=True).first()
+        if oldest is None:
+            self.stdout.write("No faxes to count.")
+            return
+
+        day = options["since"] or oldest.astimezone(tz).date()
+        last = options["until"] or datetime.now(tz).date()
+        if not options["since"]:
+            # counts of faxes that have since been deleted
+            FaxStats.objects.filter(start__lt=start_of_day(day, tz)).delete()
+        while day <= last:
+            end = min(day + timedelta(days=options["batch_days"]), last + timedelta(days=1))
+            faxes, rows = self.rebuild(start_of_day(day, tz), start_of_day(end, tz), tz)
+            self.stdout.write(f"{day} to {end - timedelta(days=1)}: {faxes} faxes, {rows} rows")
+            day = end
+
+    def rebuild(self, start, end, tz):
+        """replace the rollups of the days from `start` to `end` with counts from fax_fax"""
+        faxes = Fax.objects.filter(created_on__gte=start, created_on__lt=end)
+        with transaction.atomic():
+            # n.b. holds back the upserts of faxes changing meanwhile until the
+            # batch is done; they change the fax in the same transaction, so
+            # each change is either counted here or added on top, never both
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {FaxStats._meta.db_table} IN SHARE ROW EXCLUSIVE MODE")
+            FaxStats.objects.filter(start__gte=start, start__lt=end).delete()
+
+            rows = []
+            buckets = [
+                (HOUR, Trunc("created_on", "hour", tzinfo=pytz.utc)),
+                (DAY, Trunc("created_on", "day", tzinfo=tz)),
+            ]
+            for period, truncated in buckets:
+                grouped = (
+                    faxes.annotate(start=truncated).values("start", "created_by").annotate(**COUNTS).order_by()
+                )
+                rows += [
+                    FaxStats(period=period, start=row.pop("start"), user_id=row.pop("created_by"), **row)
+                    for row in grouped
+                ]
+            FaxStats.objects.bulk_create(rows, batch_size=1000)
+        return sum(row.sent + row.received for row in rows if row.period == DAY), len(rows)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from fax.models import Fax
+from fax.scheduling import SendSchedule
+
+
+class Command(BaseCommand):
+    help = "Put every unsent fax with a future send time back on the redis schedule"
+
+    def handle(self, *args, **options):
+        # n.b. served by the partial index on send_at; faxes already due were
+        # released before and may still be queued, so they are left alone
+        faxes = Fax.objects.filter(
+            send_at__isnull=False, sid__isnull=True, send_at__gt=timezone.now()
+        ).only("uuid", "send_at")
+        scheduled = SendSchedule().add(faxes)
+        self.stdout.write(self.style.SUCCESS(f"{scheduled} faxes scheduled."))
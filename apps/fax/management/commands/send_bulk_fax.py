@@ -0,0 +1,66 @@
+import sys
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.models import User
+from fax.bulk import parse_recipients
+from fax.models import BulkSend, MediaBlob
+from fax.preflight import InvalidDocument, preflight
+from fax.tasks import _send_bulk_fax
+
+
+class Command(BaseCommand):
+    help = "Send one document to every fax number in a csv or text file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("document", help="pdf to send")
+        parser.add_argument("recipients", help="csv or text file of fax numbers, - for stdin")
+        parser.add_argument("--column", type=int, help="1-based csv column holding the numbers")
+        parser.add_argument("--user", help="email of the user sending the faxes")
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument("--skip-invalid", action="store_true", help="send to the valid numbers anyway")
+
+    def handle(self, *args, **options):
+        if options["recipients"] == "-":
+            text = sys.stdin.read()
+        else:
+            with open(options["recipients"], encoding="utf-8-sig") as fp:
+                text = fp.read()
+
+        column = options["column"]
+        numbers, invalid = parse_recipients(
+            text, None if column is None else column - 1, exclude=[settings.TWILIO_NUMBER]
+        )
+        for line, value in invalid:
+            self.stderr.write(self.style.WARNING(f"line {line}: invalid number {value!r}"))
+        if invalid and not options["skip_invalid"]:
+            raise CommandError(f"{len(invalid)} invalid numbers, fix them or pass --skip-invalid")
+        if not numbers:
+            raise CommandError("No fax numbers to send to.")
+
+        created_by = None
+        if options["user"]:
+            try:
+                created_by = User.objects.get(email=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['user']}")
+
+        with open(options["document"], "rb") as fp:
+            try:
+                document = preflight(fp.read())
+            except InvalidDocument as e:
+                raise CommandError(f"{options['document']} can't be faxed: {e}")
+            fp.seek(0)
+            blob = MediaBlob.objects.from_file(File(fp, name=options["document"]))
+
+        bulk = BulkSend.create(
+            blob, numbers, created_by=created_by, batch_size=options["batch_size"], document=document
+        )
+        _send_bulk_fax.delay(bulk.uuid)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Queued {bulk.total} faxes in batches of {bulk.batch_size}: {bulk.detail_url}"
+            )
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fax import sender
+
+
+class Command(BaseCommand):
+    help = "Send the faxes queued for the async send engine, see fax.sender"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help="defaults to FAX_SEND_BATCH_SIZE")
+        parser.add_argument("--concurrency", type=int, help="defaults to FAX_SEND_CONCURRENCY")
+        parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+
+    def handle(self, *args, **options):
+        lock = sender.lock()
+        if not lock.acquire(blocking=False):
+            raise CommandError("Queued faxes are already being sent.")
+
+        try:
+            submitted = sender.send_queued_faxes(
+                options["batch_size"], options["concurrency"], options["max_batches"]
+            )
+        finally:
+            sender.release(lock)
+        self.stdout.write(self.style.SUCCESS(f"{len(submitted)} faxes sent."))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rate_limits import TokenBucket
+
+
+class Command(BaseCommand):
+    help = "Show the shared Twilio rate limits and how often callers waited for them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="clear the counters afterwards")
+
+    def handle(self, *args, **options):
+        bucket = TokenBucket()
+        stats = bucket.stats()
+
+        self.stdout.write(f"{'endpoint':<12} {'limit':>12} {'acquired':>10} {'throttled':>10} {'waited':>10}")
+        for endpoint in sorted(set(settings.TWILIO_RATE_LIMITS) | set(stats)):
+            rate, burst = bucket.limit(endpoint)
+            counters = stats.get(endpoint, {})
+            self.stdout.write(
+                f"{endpoint:<12} {f'{rate:g}/s x{burst}':>12} {counters.get('acquired', 0):>10} "
+                f"{counters.get('throttled', 0):>10} {counters.get('wait_seconds', 0):>9.2f}s"
+            )
+
+        if options["reset"]:
+            bucket.reset_stats()
+            self.stdout.write(self.style.SUCCESS("Counters cleared."))
@@ -0,0 +1,220 @@
+"""
+Streaming transfer of fax documents into S3.
+
+Documents are moved in fixed-size parts so a worker never holds more than one
+part of a document in memory, no matter how many pages the fax has.
+"""
+from hashlib import sha256
+import logging
+import mimetypes
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from lazy_clients import LazyLoadedHTTPSession
+
+
+logger = logging.getLogger(__name__)
+
+# S3 rejects any part but the last one when it is smaller than 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+BLOB_PREFIX = "fax-media/blobs"
+UPLOAD_PREFIX = "fax-media/uploads"
+
+
+def blob_name(digest, content_type="application/pdf", key=None):
+    """
+    hash-sharded storage name for a blob, e.g. fax-media/blobs/ab/cd/abcd...pdf,
+    or .../ab/cd/<key>.pdf for the blob row `key`
+
+    n.b. a keyed name leaves out the digest, Fax.content holds at most 100
+    characters
+    """
+    extension = ".pdf" if content_type == "application/pdf" else mimetypes.guess_extension(content_type)
+    return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{key or digest}{extension or ''}"
+
+
+def hash_chunks(chunks):
+    digest = sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MultipartUpload:
+    """
+    Write-only file-like object backed by an S3 multipart upload.
+
+    Bytes are buffered until a full part is available and then sent to S3, so
+    memory use is bounded by `part_size` plus one incoming chunk. Documents that
+    never fill a part are sent with a single `put_object` on close. A SHA-256
+    digest of everything written is kept in `digest`.
+
+    Usable as a context manager: the upload is completed on a clean exit and
+    aborted when an exception escapes the block.
+    """
+
+    def __init__(self, name, content_type="application/pdf", part_size=None, storage=None):
+        self.storage = storage or default_storage
+        self.name = name
+        self.part_size = max(part_size or settings.FAX_MEDIA_PART_SIZE, MIN_PART_SIZE)
+
+        # n.b. reuse the storage's own parameters so prefix, ACL and encryption
+        # match what `FieldFile.save` would have produced
+        self.params = self.storage._object_put_params(name)
+        self.params["ContentType"] = content_type
+
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+        self.size = 0
+        self.digest = sha256()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+            return
+        self.close()
+
+    @property
+    def client(self):
+        return self.storage.s3_connection
+
+    @property
+    def key(self):
+        return self.params["Key"]
+
+    @property
+    def sha256(self):
+        return self.digest.hexdigest()
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        self.digest.update(data)
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def close(self):
+        """send whatever is buffered and complete the upload"""
+        if self.upload_id is None:
+            self.client.put_object(Body=bytes(self.buffer), **self.params)
+        else:
+            if self.buffer:
+                self._upload_part()
+            self.client.complete_multipart_upload(
+                Bucket=self.params["Bucket"],
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},
+            )
+        self.buffer = bytearray()
+        logger.info(f"stored {self.size} bytes at {self.key} in {len(self.parts) or 1} part(s)")
+        return self.name
+
+    def abort(self):
+        self.buffer = bytearray()
+        if self.upload_id is None:
+            return
+        logger.warning(f"aborting multipart upload for {self.key}")
+        self.client.abort_multipart_upload(
+            Bucket=self.params["Bucket"], Key=self.key, UploadId=self.upload_id
+        )
+        self.upload_id = None
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            upload = self.client.create_multipart_upload(**self.params)
+            self.upload_id = upload["UploadId"]
+
+        number = len(self.parts) + 1
+        part = self.client.upload_part(
+            Body=self.buffer,
+            Bucket=self.params["Bucket"],
+            Key=self.key,
+            PartNumber=number,
+            UploadId=self.upload_id,
+        )
+        self.parts.append({"ETag": part["ETag"], "PartNumber": number})
+        self.buffer = bytearray()
+
+
+def stream_to_storage(chunks, name, content_type="application/pdf"):
+    """copy an iterable of byte chunks into storage under `name`"""
+    with MultipartUpload(name, content_type=content_type) as upload:
+        for chunk in chunks:
+            upload.write(chunk)
+    return upload
+
+
+def fetch_to_storage(url, name):
+    """
+    stream the document at `url` into storage under `name`
+
+    returns the finished MultipartUpload, or None when the document could not
+    be fetched
+    """
+    session = LazyLoadedHTTPSession().get_session()
+    with session.get(url, stream=True) as response:
+        if response.status_code not in [200]:
+            logger.error(f"Failed to fetch media url: {response.status_code}")
+            return
+
+        content_type = response.headers.get("Content-Type", "application/pdf")
+        chunks = response.iter_content(chunk_size=settings.FAX_MEDIA_CHUNK_SIZE)
+        return stream_to_storage(chunks, name, content_type=content_type)
+
+
+def copy_in_storage(source, destination, content_type, storage=None):
+    """server-side copy, the bytes never pass through this process"""
+    storage = storage or default_storage
+    params = storage._object_put_params(destination)
+    params["ContentType"] = content_type
+    storage.s3_connection.copy_object(
+        CopySource=storage._object_params(source), MetadataDirective="REPLACE", **params
+    )
+    return destination
+
+
+def iter_stored(name, storage=None):
+    """yield a stored object's bytes in chunks, never holding all of it"""
+    storage = storage or default_storage
+    response = storage.s3_connection.get_object(**storage._object_params(name))
+    yield from response["Body"].iter_chunks(settings.FAX_MEDIA_CHUNK_SIZE)
+
+
+def stored_object(name, storage=None):
+    """(size, content type) of a stored object, or None when it doesn't exist"""
+    storage = storage or default_storage
+    try:
+        response = storage.s3_connection.head_object(**storage._object_params(name))
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    return response["ContentLength"], response.get("ContentType") or "application/pdf"
+
+
+def presigned_upload(name, content_type, max_size, expires, storage=None):
+    """
+    url and form fields that let a browser POST a document straight to `name`
+
+    The policy pins the key, content type, ACL and encryption to what the
+    storage would have used and caps the size at `max_size` bytes.
+    """
+    storage = storage or default_storage
+    params = storage._object_put_params(name)
+    fields = {"acl": params["ACL"], "Content-Type": content_type}
+    if "ServerSideEncryption" in params:
+        fields["x-amz-server-side-encryption"] = params["ServerSideEncryption"]
+    conditions = [{key: value} for key, value in fields.items()]
+    conditions.append(["content-length-range", 1, max_size])
+    return storage.s3_connection.generate_presigned_post(
+        params["Bucket"], params["Key"], Fields=fields, Conditions=conditions, ExpiresIn=expires
+    )
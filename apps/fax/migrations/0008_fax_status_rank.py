@@ -0,0 +1,43 @@
+from django.db import migrations, models
+from django.db.models import Case, IntegerField, Value, When
+
+
+STATUS_RANKS = {
+    "queued": 0,
+    "processing": 1,
+    "sending": 2,
+    "receiving": 2,
+    "delivered": 3,
+    "received": 3,
+    "no-answer": 3,
+    "busy": 3,
+    "failed": 3,
+    "canceled": 3,
+}
+
+
+def rank_existing_faxes(apps, schema_editor):
+    Fax = apps.get_model("fax", "Fax")
+    Fax.objects.update(
+        status_rank=Case(
+            *[When(status=status, then=Value(rank)) for status, rank in STATUS_RANKS.items()],
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fax', '0007_auto_20190514_0154'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fax',
+            name='status_rank',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(rank_existing_faxes, migrations.RunPython.noop),
+    ]
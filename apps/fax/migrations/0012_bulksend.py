@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fax', '0011_mediablob_fax_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkSend',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('batch_size', models.PositiveIntegerField(default=50)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bulk_sends', to='fax.MediaBlob')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='fax',
+            name='batch',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fax',
+            name='bulk_send',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='faxes', to='fax.BulkSend'),
+        ),
+    ]
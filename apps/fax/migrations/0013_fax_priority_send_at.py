@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fax', '0012_bulksend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fax',
+            name='priority',
+            field=models.CharField(choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='normal', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='fax',
+            name='send_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='fax',
+            index=models.Index(condition=models.Q(('send_at__isnull', False), ('sid__isnull', True)), fields=['send_at'], name='fax_unsent_send_at_idx'),
+        ),
+    ]
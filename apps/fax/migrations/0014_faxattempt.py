@@ -0,0 +1,39 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fax', '0013_fax_priority_send_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fax',
+            name='attempt',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='FaxAttempt',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('number', models.PositiveSmallIntegerField()),
+                ('sid', models.CharField(blank=True, max_length=34, null=True)),
+                ('status', models.CharField(default='queued', max_length=16)),
+                ('error_message', models.CharField(blank=True, max_length=64, null=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('fax', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempts', to='fax.Fax')),
+            ],
+            options={
+                'ordering': ['number'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='faxattempt',
+            constraint=models.UniqueConstraint(fields=('fax', 'number'), name='unique_fax_attempt'),
+        ),
+    ]
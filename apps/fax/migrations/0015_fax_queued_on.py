@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fax', '0014_faxattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fax',
+            name='queued_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='fax',
+            index=models.Index(condition=models.Q(('queued_on__isnull', False), ('sid__isnull', True)), fields=['queued_on'], name='fax_unsent_queued_on_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fax', '0015_fax_queued_on'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fax',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fax',
+            name='page_width',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fax',
+            name='page_height',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fax',
+            name='encrypted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
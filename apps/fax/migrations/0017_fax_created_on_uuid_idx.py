@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # n.b. built without locking out writes on a big table
+    atomic = False
+
+    dependencies = [
+        ('fax', '0016_fax_document_info'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='fax',
+            index=models.Index(fields=['created_on', 'uuid'], name='fax_created_on_uuid_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # n.b. built without locking out writes on a big table
+    atomic = False
+
+    dependencies = [
+        ('fax', '0017_fax_created_on_uuid_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='fax',
+            index=models.Index(fields=['status', 'created_on', 'uuid'], name='fax_status_created_on_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fax',
+            index=models.Index(fields=['direction', 'created_on', 'uuid'], name='fax_direction_created_on_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fax',
+            index=models.Index(fields=['created_by', 'created_on', 'uuid'], name='fax_created_by_created_on_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fax',
+            index=GinIndex(fields=['_to'], name='fax_to_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='fax',
+            index=GinIndex(fields=['_from'], name='fax_from_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
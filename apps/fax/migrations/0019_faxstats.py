@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fax', '0018_fax_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaxStats',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=8)),
+                ('start', models.DateTimeField()),
+                ('sent', models.IntegerField(default=0)),
+                ('received', models.IntegerField(default=0)),
+                ('delivered', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fax_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'fax stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='faxstats',
+            index=models.Index(fields=['period', 'start'], name='fax_stats_period_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='faxstats',
+            constraint=models.UniqueConstraint(condition=models.Q(user__isnull=False), fields=('period', 'start', 'user'), name='unique_fax_stats_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='faxstats',
+            constraint=models.UniqueConstraint(condition=models.Q(user__isnull=True), fields=('period', 'start'), name='unique_fax_stats_no_user'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fax', '0019_faxstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fax',
+            name='sending_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='fax',
+            index=models.Index(condition=models.Q(sending_since__isnull=False), fields=['sending_since'], name='fax_sending_since_idx'),
+        ),
+    ]
@@ -1,23 +1,354 @@
+from functools import reduce
 import logging
-from tempfile import NamedTemporaryFile
+from operator import or_
+import os
+from uuid import uuid4
 
 from django.conf import settings
-from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import JSONField
-from django.core.files import File
-from django.core.mail import send_mail
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.core.files.storage import default_storage
+from django.db import connection, models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
 from django.urls import reverse
-import requests
+from django.utils import timezone
+import pytz
 
 from core.mixins import BaseModelMixin
 from core.formatters import pretty_print_phone_number
+from fax.media import (
+    MultipartUpload,
+    UPLOAD_PREFIX,
+    blob_name,
+    copy_in_storage,
+    fetch_to_storage,
+    hash_chunks,
+    iter_stored,
+    stored_object,
+    stream_to_storage,
+)
+from fax.normalize import normalize_document
+from fax.preflight import InvalidDocument, preflight
+from fax.resources import ResourceCache
+from fax.scheduling import LOW, NORMAL, PRIORITY_CHOICES
+from fax.stats import COUNTERS, PERIOD_CHOICES, deltas
+from fax.status import QUEUED, TERMINAL_RANK, status_rank
+from fax.thumbnails import render_thumbnails
 from lazy_clients import LazyLoadedTwilioClient
 
 
 logger = logging.getLogger(__name__)
 
 
+class MediaBlobManager(models.Manager):
+    """
+    The lookups return the blob with one reference already taken for the
+    caller, who hands it to a fax, see Fax.attach_blob and BulkSend.create.
+    """
+
+    def from_upload(self, upload):
+        """
+        adopt a finished MultipartUpload that was streamed to a temporary name
+
+        The digest is only known once the bytes have gone by, so new content is
+        copied to its blob name server-side; content we already hold is simply
+        dropped. Either way the temporary object is removed.
+        """
+        return self._adopt(upload.name, upload.sha256, upload.size, upload.params["ContentType"])
+
+    def from_storage(self, name):
+        """
+        adopt an object uploaded to a temporary name by someone else, e.g. a
+        browser; None when there is no such object
+        """
+        stored = stored_object(name)
+        if stored is None:
+            return None
+        size, content_type = stored
+        return self._adopt(name, hash_chunks(iter_stored(name)), size, content_type)
+
+    def _adopt(self, name, digest, size, content_type):
+        blob = self._referenced(digest)
+        if blob is None:
+            key = uuid4()
+            stored = copy_in_storage(name, blob_name(digest, content_type, key), content_type)
+            blob = self._create(digest, uuid=key, name=stored, size=size, content_type=content_type)
+        default_storage.delete(name)
+        return blob
+
+    def from_file(self, file):
+        """blob for an uploaded file, uploading it only when the content is new"""
+        content_type = getattr(file, "content_type", None) or "application/pdf"
+        digest = hash_chunks(file.chunks())
+        blob = self._referenced(digest)
+        if blob is not None:
+            return blob
+
+        file.seek(0)
+        key = uuid4()
+        name = blob_name(digest, content_type, key)
+        stream_to_storage(file.chunks(), name, content_type=content_type)
+        return self._create(digest, uuid=key, name=name, size=file.size, content_type=content_type)
+
+    def _referenced(self, digest):
+        """
+        the blob holding `digest` with a reference taken, or None; the row is
+        locked meanwhile, so a concurrent `purge` either deletes it first or
+        finds it referenced
+        """
+        with transaction.atomic():
+            blob = self.select_for_update().filter(sha256=digest).first()
+            if blob is not None:
+                blob.add_references()
+                blob.ref_count += 1
+        return blob
+
+    def _create(self, digest, **fields):
+        """
+        the row for content just stored under `fields["name"]`
+
+        n.b. every row stores its content under a name of its own, so a purge
+        of an older row with the same digest, still deleting its media, can
+        never remove this one's. A lookup that lost the race to insert the row
+        removes what it stored and takes a reference on the winner instead.
+        """
+        blob, created = self.get_or_create(sha256=digest, defaults=dict(ref_count=1, **fields))
+        if created:
+            return blob
+        default_storage.delete(fields["name"])
+        return self._referenced(digest)
+
+    def purgeable(self, cutoff):
+        """blobs unreferenced and untouched since `cutoff` that no bulk send points at"""
+        return self.filter(ref_count=0, updated_on__lt=cutoff, bulk_sends__isnull=True)
+
+    def purge(self, blob, cutoff):
+        """
+        delete the row of `blob` if it is still `purgeable`; returns whether it
+        was deleted
+
+        n.b. one conditional DELETE, so a reference taken meanwhile, see
+        `_referenced`, keeps the blob. Bulk sends hold no reference but
+        protect their blob, hence the NOT EXISTS.
+        """
+        bulk_sends = BulkSend._meta
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.model._meta.db_table}"
+                " WHERE uuid = %s AND ref_count = 0 AND updated_on < %s"
+                f" AND NOT EXISTS (SELECT 1 FROM {bulk_sends.db_table}"
+                f" WHERE {bulk_sends.get_field('blob').column} = %s)"
+                " RETURNING uuid",
+                [blob.pk, cutoff, blob.pk],
+            )
+            return cursor.fetchone() is not None
+
+
+class MediaBlob(BaseModelMixin):
+    """
+    a fax document stored once under the SHA-256 of its content
+
+    `ref_count` is the number of faxes pointing at the blob, and of lookups
+    about to point one at it. Unreferenced blobs are removed by
+    fax.tasks._purge_media_blobs after a grace period.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    content_type = models.CharField(max_length=64, default="application/pdf")
+    ref_count = models.PositiveIntegerField(default=0)
+
+    # the fax-native rendering sent to twilio, see fax.normalize, or `name`
+    # when the rendering came out no smaller
+    fax_name = models.CharField(max_length=255, blank=True, default="")
+    fax_size = models.BigIntegerField(default=0)
+
+    objects = MediaBlobManager()
+
+    def __str__(self):
+        return f"Blob {self.sha256[:12]} ({self.ref_count} refs)"
+
+    @property
+    def thumbnail_prefix(self):
+        base, _ = os.path.splitext(self.name)
+        return f"{base}-thumbs"
+
+    def fax_name_for(self, resolution):
+        base, _ = os.path.splitext(self.name)
+        return f"{base}-fax-{resolution[0]}x{resolution[1]}.pdf"
+
+    def normalize(self):
+        """
+        store the fax-native rendering once per blob and resolution, unless it
+        is no smaller than the original; scans shrink, but a text-only pdf
+        grows once every page is an image
+
+        Returns the storage name of what twilio is sent, the rendering or the
+        original.
+        """
+        name = self.fax_name_for(settings.FAX_RESOLUTION)
+        if self.fax_name in (name, self.name):
+            return self.fax_name
+
+        with default_storage.open(self.name, "rb") as fp:
+            data = normalize_document(fp.read())
+        if len(data) < self.size:
+            with MultipartUpload(name) as upload:
+                upload.write(data)
+            size = len(data)
+        else:
+            # n.b. remembered, so the rendering isn't tried again for every fax
+            name, size = self.name, self.size
+
+        self.fax_name, self.fax_size = name, size
+        MediaBlob.objects.filter(pk=self.pk).update(fax_name=name, fax_size=size)
+        logger.info(f"normalized {self.sha256[:12]}: {self.size} -> {len(data)} bytes, sending {name}")
+        return name
+
+    def add_references(self, count=1):
+        return MediaBlob.objects.filter(pk=self.pk).update(
+            ref_count=F("ref_count") + count, updated_on=timezone.now()
+        )
+
+    def remove_references(self, count=1):
+        return MediaBlob.objects.filter(pk=self.pk, ref_count__gte=count).update(
+            ref_count=F("ref_count") - count, updated_on=timezone.now()
+        )
+
+    def delete_media(self):
+        """remove the stored document and any thumbnails rendered from it"""
+        storage = default_storage
+        _, thumbnails = storage.listdir(self.thumbnail_prefix)
+        for name in thumbnails:
+            storage.delete(f"{self.thumbnail_prefix}/{name}")
+        if self.fax_name and self.fax_name != self.name:
+            storage.delete(self.fax_name)
+        storage.delete(self.name)
+
+
+class BulkSend(BaseModelMixin):
+    """one document sent to many recipients, see fax.bulk"""
+
+    created_by = models.ForeignKey(
+        "authentication.User", on_delete=models.PROTECT, blank=True, null=True
+    )
+    blob = models.ForeignKey(MediaBlob, on_delete=models.PROTECT, related_name="bulk_sends")
+    total = models.PositiveIntegerField(default=0)
+    batch_size = models.PositiveIntegerField(default=50)
+
+    def __str__(self):
+        return f"Bulk Send: {self.total} faxes"
+
+    @property
+    def short_id(self):
+        return str(self.uuid)[-8:]
+
+    @property
+    def detail_url(self):
+        return reverse("dashboard:bulk-fax-detail", kwargs={"uuid": str(self.uuid)})
+
+    @classmethod
+    def create(cls, blob, numbers, created_by=None, batch_size=None, priority=LOW, document=None):
+        """
+        insert the bulk send and one Fax per number with a single bulk_create
+
+        The faxes share `blob`, so the document is neither uploaded nor stored
+        again; the first fax takes over the reference its lookup took and the
+        count goes up by one for each of the others. They are sent at low
+        priority unless told otherwise, see fax.scheduling. `document` is the
+        blob's fax.preflight.DocumentInfo, when known.
+        """
+        batch_size = batch_size or settings.FAX_BULK_BATCH_SIZE
+        try:
+            with transaction.atomic():
+                bulk = cls.objects.create(
+                    created_by=created_by, blob=blob, total=len(numbers), batch_size=batch_size
+                )
+                faxes = [
+                    Fax(
+                        created_by=created_by,
+                        _to=number,
+                        content=blob.name,
+                        blob=blob,
+                        bulk_send=bulk,
+                        batch=index // batch_size,
+                        priority=priority,
+                        **(document._asdict() if document else {}),
+                    )
+                    for index, number in enumerate(numbers)
+                ]
+                Fax.objects.bulk_create(faxes, batch_size=1000)
+                blob.add_references(len(faxes) - 1)
+        except Exception:
+            blob.remove_references()
+            raise
+        return bulk
+
+    def prepare_media(self):
+        """
+        check the shared document on the media queue when the form couldn't,
+        see fax.forms.inspect_upload; returns whether the faxes can be sent
+        """
+        unsent = self.faxes.filter(sid__isnull=True).exclude(status_rank=TERMINAL_RANK)
+        if not unsent.filter(page_count__isnull=True).exists():
+            return True
+        with default_storage.open(self.blob.name, "rb") as fp:
+            data = fp.read()
+        try:
+            document = preflight(data)
+        except InvalidDocument as e:
+            self.fail_unsent(f"Can't be faxed: {e}")
+            return False
+        unsent.update(**document._asdict(), updated_on=timezone.now())
+        return True
+
+    def fail_unsent(self, error_message):
+        """mark every fax of the bulk send that is still unsent as failed, without a redial"""
+        logger.error(f"Bulk send {self.uuid} can't be sent: {error_message}")
+        with transaction.atomic():
+            faxes = list(
+                self.faxes.select_for_update()
+                .filter(sid__isnull=True)
+                .exclude(status_rank=TERMINAL_RANK)
+                .only("uuid", "created_on", "created_by", "direction", "status")
+            )
+            Fax.objects.filter(uuid__in=[fax.uuid for fax in faxes]).update(
+                status="failed",
+                fax_status="failed",
+                status_rank=TERMINAL_RANK,
+                error_message=error_message[:64],
+                updated_on=timezone.now(),
+            )
+            FaxStats.objects.record([(fax, fax.status, "failed") for fax in faxes])
+        return len(faxes)
+
+    def progress(self):
+        """counts per batch, computed in one grouped query"""
+        return (
+            self.faxes.values("batch")
+            .annotate(
+                total=Count("uuid"),
+                submitted=Count("uuid", filter=Q(sid__isnull=False)),
+                delivered=Count("uuid", filter=Q(status="delivered")),
+                failed=Count(
+                    "uuid", filter=Q(status_rank=TERMINAL_RANK) & ~Q(status="delivered")
+                ),
+            )
+            .order_by("batch")
+        )
+
+
+class FaxManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        """bulk_create sends no signals and skips save, so the new faxes are counted here"""
+        with transaction.atomic():
+            faxes = super().bulk_create(objs, *args, **kwargs)
+            FaxStats.objects.record([(fax, None, fax.status) for fax in faxes])
+        return faxes
+
+
 class Fax(BaseModelMixin):
     created_by = models.ForeignKey(
         "authentication.User", on_delete=models.PROTECT, blank=True, null=True
@@ -28,25 +359,126 @@ class Fax(BaseModelMixin):
     sid = models.CharField(max_length=34, blank=True, null=True)
     status = models.CharField(max_length=16, default="queued")
     fax_status = models.CharField(max_length=16, default="queued")
+    status_rank = models.PositiveSmallIntegerField(default=0)
     error_message = models.CharField(max_length=64, blank=True, null=True)
     _to = models.CharField(max_length=16)
     twilio_metadata = JSONField(default=list, blank=True, null=True)
 
     content = models.FileField(upload_to="fax-media/")
+    blob = models.ForeignKey(
+        MediaBlob, on_delete=models.PROTECT, blank=True, null=True, related_name="faxes"
+    )
+    thumbnails = JSONField(default=list, blank=True)
+    # read from the document at submit time, or on the media queue for documents
+    # already in storage, see fax.preflight; the size is the first page's, in points
+    page_count = models.PositiveIntegerField(blank=True, null=True)
+    page_width = models.FloatField(blank=True, null=True)
+    page_height = models.FloatField(blank=True, null=True)
+    encrypted = models.BooleanField(default=False)
+
+    bulk_send = models.ForeignKey(
+        BulkSend, on_delete=models.SET_NULL, blank=True, null=True, related_name="faxes"
+    )
+    batch = models.PositiveIntegerField(blank=True, null=True)
+
+    # outbound only, see fax.scheduling
+    priority = models.CharField(max_length=8, choices=PRIORITY_CHOICES, default=NORMAL)
+    send_at = models.DateTimeField(blank=True, null=True)
+    # the current try, see fax.redial
+    attempt = models.PositiveSmallIntegerField(default=1)
+    # waiting for the async sender since, see fax.sender
+    queued_on = models.DateTimeField(blank=True, null=True)
+    # claimed by the async sender and in flight to twilio since
+    sending_since = models.DateTimeField(blank=True, null=True)
+
+    objects = FaxManager()
 
     # meta fields
     class Meta:
         verbose_name_plural = "faxes"
+        indexes = [
+            # the dashboard's newest-first keyset pages, see core.keyset, and
+            # its filters, see fax.forms.FaxFilterForm
+            models.Index(fields=["created_on", "uuid"], name="fax_created_on_uuid_idx"),
+            models.Index(fields=["status", "created_on", "uuid"], name="fax_status_created_on_idx"),
+            models.Index(fields=["direction", "created_on", "uuid"], name="fax_direction_created_on_idx"),
+            models.Index(fields=["created_by", "created_on", "uuid"], name="fax_created_by_created_on_idx"),
+            GinIndex(fields=["_to"], name="fax_to_trgm_idx", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["_from"], name="fax_from_trgm_idx", opclasses=["gin_trgm_ops"]),
+            # faxes still waiting for their send time, used to rebuild the schedule
+            models.Index(
+                fields=["send_at"],
+                name="fax_unsent_send_at_idx",
+                condition=Q(send_at__isnull=False, sid__isnull=True),
+            ),
+            models.Index(
+                fields=["queued_on"],
+                name="fax_unsent_queued_on_idx",
+                condition=Q(queued_on__isnull=False, sid__isnull=True),
+            ),
+            models.Index(
+                fields=["sending_since"],
+                name="fax_sending_since_idx",
+                condition=Q(sending_since__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.direction} Fax: {self.sid}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # n.b. counted in the same transaction, see fax.stats
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            FaxStats.objects.record([(self, None, self.status)])
+
+    @classmethod
+    def from_inbound_webhook(cls, payload):
+        """unsaved Fax for a decoded fax.webhooks.ReceivedFaxPayload"""
+        return cls(
+            status=payload.status,
+            sid=payload.fax_sid,
+            fax_status=payload.fax_status,
+            _from=payload.from_,
+            _to=payload.to,
+            direction="inbound",
+            twilio_metadata=[payload.as_dict()],
+            status_rank=status_rank(payload.status),
+        )
+
+    @classmethod
+    def update_status(cls, uuid, status, fax_status, error_message=None, attempt=1):
+        """
+        move a fax forward to `status` in a single conditional UPDATE
+
+        Returns the number of rows changed: 0 when the fax does not exist, has
+        moved on to another attempt or already has a status of equal or higher
+        rank. The move to a terminal status is counted by the caller, see
+        fax.tasks.attempts_ended.
+        """
+        rank = status_rank(status)
+        fields = dict(
+            status=status, fax_status=fax_status, status_rank=rank, updated_on=timezone.now()
+        )
+        if error_message:
+            fields["error_message"] = error_message
+        return cls.objects.filter(uuid=uuid, attempt=attempt, status_rank__lt=rank).update(**fields)
+
     @property
     def logger(self):
         return logging.getLogger(f"FAX:{self.sid}")
 
     @property
     def resource(self):
+        """twilio's view of this fax as a fax.resources.FaxSnapshot, fetched at most once per ttl"""
+        snapshot = getattr(self, "_resource", None)
+        if snapshot is None or snapshot.sid != self.sid:
+            snapshot = self._resource = ResourceCache().get(self.sid, self.fetch_resource)
+        return snapshot
+
+    def fetch_resource(self):
         client = LazyLoadedTwilioClient().get_client()
         resource = client.fax.faxes.get(self.sid)
         fax = resource.fetch()
@@ -64,31 +496,134 @@ class Fax(BaseModelMixin):
     def from_number(self):
         return pretty_print_phone_number(self._from)
 
+    @property
+    def is_scheduled(self):
+        """waiting for a send time that hasn't come yet"""
+        return bool(self.send_at and not self.sid and self.send_at > timezone.now())
+
     @property
     def content_url(self):
         if self.content:
             return self.content.url
         return
 
+    @property
+    def media_url(self):
+        """what twilio fetches: the fax-native rendering when there is one"""
+        if self.blob_id and self.blob.fax_name:
+            return self.content.storage.url(self.blob.fax_name)
+        return self.content_url
+
+    def prepare_media(self):
+        """
+        render the document for fax before sending; the original is the
+        fallback. Returns whether the fax can be sent.
+        """
+        if not self.blob_id and self.content.name.startswith(f"{UPLOAD_PREFIX}/"):
+            # uploaded straight to the bucket by the browser, see fax.forms
+            blob = MediaBlob.objects.from_storage(self.content.name)
+            if blob is None:
+                self.fail_unsent("The uploaded document is missing.")
+                return False
+            self.attach_blob(blob)
+        # n.b. uploaded or streamed documents are checked here rather than by
+        # the form, off the web worker, see fax.forms.inspect_upload
+        if self.page_count is None and not self.inspect_document():
+            return False
+
+        if not (settings.FAX_NORMALIZE_MEDIA and self.blob_id):
+            return True
+        try:
+            self.blob.normalize()
+        except Exception:
+            self.logger.exception("Failed to normalize media, sending the original.")
+        return True
+
+    def inspect_document(self):
+        """store what fax.preflight reads from the document; False when it can't be faxed"""
+        with default_storage.open(self.content.name, "rb") as fp:
+            data = fp.read()
+        try:
+            document = preflight(data)
+        except InvalidDocument as e:
+            self.fail_unsent(f"Can't be faxed: {e}")
+            return False
+        for field, value in document._asdict().items():
+            setattr(self, field, value)
+        self.save(update_fields=[*document._fields, "updated_on"])
+        return True
+
+    def fail_unsent(self, error_message):
+        """mark a fax that can't be sent as failed, without an attempt to redial"""
+        self.logger.error(f"Fax {self.uuid} can't be sent: {error_message}")
+        before = self.status
+        self.status = self.fax_status = "failed"
+        self.status_rank = TERMINAL_RANK
+        self.error_message = error_message[:64]
+        with transaction.atomic():
+            self.save(update_fields=["status", "fax_status", "status_rank", "error_message", "updated_on"])
+            FaxStats.objects.record([(self, before, self.status)])
+
+    @property
+    def status_callback_url(self):
+        return f'{settings.URL}{reverse("fax:status-callback", kwargs=dict(uuid=str(self.uuid)))}?attempt={self.attempt}'
+
     def send_fax(self):
         if self.sid:
             self.logger.warning("Fax has already been sent. Nothing to do.")
             # return
 
-        status_callback = f'{settings.URL}{reverse("fax:status-callback", kwargs=dict(uuid=str(self.uuid)))}'
+        status_callback = self.status_callback_url
         self.logger.warning(status_callback)
         client = LazyLoadedTwilioClient().get_client()
         fax = client.fax.faxes.create(
             from_=self._from,
             to=self._to,
-            media_url=self.content.url,
+            media_url=self.media_url,
             status_callback=status_callback,
         )
         self.sid = fax.sid
         self.status = fax.status
+        self.status_rank = status_rank(fax.status)
         self.save()
+        self.attempts.update_or_create(
+            number=self.attempt, defaults=dict(sid=fax.sid, status=fax.status)
+        )
         return fax
 
+    def finish_attempt(self, policy):
+        """
+        record the current attempt once it reached a terminal status and, when
+        `policy` (a fax.redial.RedialPolicy) allows, reset the fax for the next
+        one; returns the next attempt's send time or None
+        """
+        now = timezone.now()
+        self.attempts.update_or_create(
+            number=self.attempt,
+            defaults=dict(
+                sid=self.sid, status=self.status, error_message=self.error_message, finished_on=now
+            ),
+        )
+        if self.direction != "outbound" or not policy.should_redial(self.status, self.attempt):
+            return None
+
+        self.send_at = policy.next_attempt_at(self.attempt, now)
+        self.logger.info(f"Attempt {self.attempt} ended {self.status}, redialing at {self.send_at}.")
+        # the failure no longer counts, see fax.stats
+        FaxStats.objects.record([(self, self.status, QUEUED)])
+        self.attempt += 1
+        self.sid = None
+        self.status = self.fax_status = QUEUED
+        self.status_rank = status_rank(QUEUED)
+        self.error_message = None
+        self.save(
+            update_fields=[
+                "send_at", "attempt", "sid", "status", "fax_status", "status_rank",
+                "error_message", "updated_on",
+            ]
+        )
+        return self.send_at
+
     def receive_fax(self):
         """
         Invoke in post_create
@@ -97,33 +632,215 @@ class Fax(BaseModelMixin):
             self.logger.info("Fax is outbound. Nothing to do.")
             return
 
-        # 1. take the files from twilio and move them to S3
+        # 1. stream the files from twilio into S3, hashing them on the way
         resource = self.resource
         media_url = resource.media_url
-        req = requests.get(media_url)
+        name = self.content.field.generate_filename(self, f"incoming/{self.uuid}-content.pdf")
 
-        if req.status_code not in [200]:
+        upload = fetch_to_storage(media_url, name)
+        if not upload:
             self.logger.error("Failed to fetch media url.")
             return
 
-        name = f"{self.uuid}-content.pdf"
-        with NamedTemporaryFile() as fp:
-            fp.write(req.content)
-            fp.seek(0)
-            self.content.save(name, File(fp))
+        self.attach_blob(MediaBlob.objects.from_upload(upload))
 
         # 2. remove the files from twilio
 
         return self.content.url
 
-    def send_notification_email(self):
-        users = get_user_model().objects.all()
-        fax_uri = settings.URL + reverse(
+    def attach_blob(self, blob):
+        """point this fax at a blob, taking over the reference its lookup took"""
+        self.blob = blob
+        self.content.name = blob.name
+        try:
+            if self._state.adding:
+                self.save()
+            else:
+                self.save(update_fields=["blob", "content", "updated_on"])
+        except Exception:
+            blob.remove_references()
+            raise
+        return self
+
+    def render_thumbnails(self):
+        """store a png preview of every page next to the content"""
+        if not self.content:
+            return
+
+        if self.blob_id:
+            # the same document may already have been previewed for another fax
+            rendered = (
+                Fax.objects.filter(blob_id=self.blob_id)
+                .exclude(thumbnails=[])
+                .values_list("thumbnails", flat=True)
+                .first()
+            )
+            if rendered:
+                self.thumbnails = rendered
+                self.save(update_fields=["thumbnails", "updated_on"])
+                return rendered
+
+        with self.content.open("rb") as fp:
+            data = fp.read()
+
+        base, _ = os.path.splitext(self.content.name)
+        names = []
+        for number, image in enumerate(render_thumbnails(data), start=1):
+            name = f"{base}-thumbs/page-{number:03d}.png"
+            with MultipartUpload(name, content_type="image/png") as upload:
+                upload.write(image)
+            names.append(name)
+
+        self.thumbnails = names
+        self.save(update_fields=["thumbnails", "updated_on"])
+        return names
+
+    @property
+    def thumbnail_urls(self):
+        return [self.content.storage.url(name) for name in self.thumbnails]
+
+    @property
+    def detail_url(self):
+        return settings.URL + reverse(
             "dashboard:fax-detail", kwargs={"uuid": str(self.uuid)}
         )
-        send_mail(
+
+    def notification_email(self):
+        """subject and body of the "new fax" email, sent by fax.tasks"""
+        return (
             f"New Fax - {self.short_id}",
-            f"Hello,\nYou have received a fax.\n{fax_uri}\nBest,\nFax Bot",
-            f"no-reply@{settings.HOSTNAME}",
-            [u.email for u in users],
+            f"Hello,\nYou have received a fax.\n{self.detail_url}\nBest,\nFax Bot",
+        )
+
+
+class FaxAttempt(BaseModelMixin):
+    """one dial of an outbound fax; redialed faxes have several, see fax.redial"""
+
+    fax = models.ForeignKey(Fax, on_delete=models.CASCADE, related_name="attempts")
+    number = models.PositiveSmallIntegerField()
+    sid = models.CharField(max_length=34, blank=True, null=True)
+    status = models.CharField(max_length=16, default="queued")
+    error_message = models.CharField(max_length=64, blank=True, null=True)
+    finished_on = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["number"]
+        constraints = [
+            models.UniqueConstraint(fields=["fax", "number"], name="unique_fax_attempt"),
+        ]
+
+    def __str__(self):
+        return f"Attempt {self.number}: {self.status}"
+
+
+class FaxStatsManager(models.Manager):
+    def record(self, changes):
+        """add (fax, status before, status after) changes to the rollups, see fax.stats"""
+        rows = deltas(changes, pytz.timezone(settings.FAX_STATS_TIME_ZONE))
+        # n.b. sorted, so concurrent upserts lock their rows in the same order
+        ordered = sorted(rows.items(), key=lambda row: (row[0][0], row[0][1], str(row[0][2])))
+        for has_user in (True, False):
+            batch = [(key, counts) for key, counts in ordered if (key[2] is not None) == has_user]
+            if batch:
+                self._upsert(batch, has_user)
+        return len(rows)
+
+    def _upsert(self, rows, has_user):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ["uuid", "created_on", "updated_on", "period", "start", "user_id", *COUNTERS]
+        # one conflict target per partial unique constraint, see FaxStats.Meta
+        target = '"period", "start", "user_id"' if has_user else '"period", "start"'
+        condition = '"user_id" IS NOT NULL' if has_user else '"user_id" IS NULL'
+        increments = ", ".join(f'"{name}" = {table}."{name}" + EXCLUDED."{name}"' for name in COUNTERS)
+        names = ", ".join(f'"{column}"' for column in columns)
+        row = "({})".format(", ".join("%s" for _ in columns))
+        values = ", ".join(row for _ in rows)
+
+        now = timezone.now()
+        params = []
+        for (period, start, user), counts in rows:
+            params += [uuid4(), now, now, period, start, user, *(counts[name] for name in COUNTERS)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} ({names})
+                VALUES {values}
+                ON CONFLICT ({target}) WHERE {condition}
+                DO UPDATE SET {increments}, "updated_on" = EXCLUDED."updated_on"
+                """,
+                params,
+            )
+
+    def totals(self, windows, **filters):
+        """
+        counts for each of `windows`, (period, since) pairs, summed in a single
+        query; returns one {counter: count} dict per window
+        """
+        conditions = [Q(period=period, start__gte=since) for period, since in windows]
+        aggregates = {
+            f"{name}_{index}": Coalesce(Sum(name, filter=condition), 0)
+            for index, condition in enumerate(conditions)
+            for name in COUNTERS
+        }
+        # n.b. the WHERE keeps the scan to the windows' rows
+        summed = self.filter(reduce(or_, conditions), **filters).aggregate(**aggregates)
+        return [
+            {name: summed[f"{name}_{index}"] for name in COUNTERS} for index in range(len(windows))
+        ]
+
+    def by_user(self, period, since):
+        """counts per user since `since`, busiest first; inbound faxes have no user"""
+        return (
+            self.filter(period=period, start__gte=since)
+            .values("user", "user__email")
+            .annotate(**{name: Sum(name) for name in COUNTERS})
+            .order_by("-sent", "-received", "user__email")
         )
+
+
+class FaxStats(BaseModelMixin):
+    """
+    fax counts per hour or day and user, kept up to date by upserts, see fax.stats
+
+    `user` is the faxes' creator, None for inbound faxes.
+    """
+
+    period = models.CharField(max_length=8, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    user = models.ForeignKey(
+        "authentication.User",
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name="fax_stats",
+    )
+    sent = models.IntegerField(default=0)
+    received = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+
+    objects = FaxStatsManager()
+
+    class Meta:
+        verbose_name_plural = "fax stats"
+        indexes = [
+            # the dashboard's windows, over the rows with and without a user
+            models.Index(fields=["period", "start"], name="fax_stats_period_start_idx"),
+        ]
+        constraints = [
+            # n.b. NULLs never conflict in a unique index, so rows without a
+            # user get a constraint of their own
+            models.UniqueConstraint(
+                fields=["period", "start", "user"],
+                condition=Q(user__isnull=False),
+                name="unique_fax_stats_user",
+            ),
+            models.UniqueConstraint(
+                fields=["period", "start"],
+                condition=Q(user__isnull=True),
+                name="unique_fax_stats_no_user",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Fax Stats: {self.period} of {self.start}"
@@ -0,0 +1,118 @@
+"""
+Email notifications for inbound faxes.
+
+Recipients are streamed from the database as bare email addresses and sent in
+batches of NOTIFICATION_BATCH_SIZE over a single mail connection.
+
+With FAX_NOTIFICATION_DIGEST_WINDOW set, inbound faxes are collected in a redis
+set instead and `fax.tasks._send_notification_digest` sends one summary per
+window.
+"""
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+
+from lazy_clients import LazyLoadedRedisClient
+
+
+logger = logging.getLogger(__name__)
+
+
+def from_email():
+    return f"no-reply@{settings.HOSTNAME}"
+
+
+def recipient_batches(batch_size=None):
+    """yield lists of active users' email addresses"""
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    emails = (
+        get_user_model()
+        .objects.filter(is_active=True, email__isnull=False)
+        .exclude(email="")
+        .order_by()
+        .values_list("email", flat=True)
+        .iterator(chunk_size=batch_size)
+    )
+
+    batch = []
+    for email in emails:
+        batch.append(email)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def send_batch(subject, body, recipients, connection=None):
+    message = EmailMessage(subject, body, from_email(), recipients, connection=connection)
+    return message.send()
+
+
+def send_to_all(subject, body):
+    """
+    send to every active user, one batch at a time
+
+    returns the batches that failed so the caller can retry them on their own
+    """
+    connection = get_connection()
+    failed = []
+    with connection:
+        for recipients in recipient_batches():
+            try:
+                send_batch(subject, body, recipients, connection=connection)
+            except Exception as e:
+                logger.exception(e)
+                failed.append(recipients)
+    return failed
+
+
+class PendingNotifications:
+    """inbound faxes waiting for the next digest"""
+
+    key = "fax:notifications:pending"
+    sending = "fax:notifications:sending"
+
+    def __init__(self):
+        self.client = LazyLoadedRedisClient().get_client()
+
+    def lock(self):
+        """held while a digest is sent, so two digests never take the same faxes"""
+        return self.client.lock(f"{self.sending}:lock", timeout=settings.FAX_NOTIFICATION_DIGEST_LOCK_TIMEOUT)
+
+    def add(self, uuid):
+        self.client.sadd(self.key, str(uuid))
+
+    def take(self):
+        """
+        move the pending uuids aside and return them
+
+        A digest that died before `done` was called leaves its uuids aside;
+        they are returned again, together with anything new.
+        """
+        pipeline = self.client.pipeline()
+        pipeline.sunionstore(self.sending, [self.sending, self.key])
+        pipeline.delete(self.key)
+        pipeline.smembers(self.sending)
+        _, _, uuids = pipeline.execute()
+        return [uuid.decode() for uuid in uuids]
+
+    def done(self):
+        self.client.delete(self.sending)
+
+
+def digest_email(faxes, tz):
+    """subject and body of a summary email listing `faxes`, their times in the pytz zone `tz`"""
+    if len(faxes) == 1:
+        return faxes[0].notification_email()
+
+    lines = "\n".join(
+        f"{fax.created_on.astimezone(tz):%Y-%m-%d %H:%M %Z} from {fax.from_number}: {fax.detail_url}"
+        for fax in faxes
+    )
+    return (
+        f"{len(faxes)} New Faxes",
+        f"Hello,\nYou have received {len(faxes)} faxes.\n{lines}\nBest,\nFax Bot",
+    )
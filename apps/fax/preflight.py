@@ -0,0 +1,99 @@
+"""
+Pre-flight checks for outbound documents.
+
+Corrupt and password-protected PDFs used to be found out by twilio, minutes
+after `_send_fax` had spent an API call on them. Every document is now parsed
+before anything is queued: the forms reject the ones twilio could not send.
+Documents already in storage, uploaded by the browser itself or streamed
+there while the form was posted, are read on the media queue instead, where
+Fax.prepare_media and BulkSend.prepare_media fail the faxes. What the parse
+learns, the page count, the size of the first page and whether the file is
+encrypted, is stored on the Fax row.
+
+The parse runs in a process pool so a hostile or broken file can neither hold
+the web worker's GIL nor take the worker down with it, and is given up on
+after FAX_PREFLIGHT_TIMEOUT seconds.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import os
+
+from django.conf import settings
+import pymupdf
+
+
+logger = logging.getLogger(__name__)
+
+# page_width and page_height are the first page's, in points (1/72")
+DocumentInfo = namedtuple("DocumentInfo", "page_count page_width page_height encrypted")
+
+_pool = None
+_pool_pid = None
+
+
+class InvalidDocument(Exception):
+    pass
+
+
+def get_pool():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(max_workers=settings.FAX_PREFLIGHT_PROCESSES)
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def inspect_document(data):
+    """
+    runs in the pool: DocumentInfo for the pdf in `data`, or the reason it
+    can't be faxed as a string
+    """
+    try:
+        document = pymupdf.open(stream=data, filetype="pdf")
+    except Exception as e:
+        return f"not a readable pdf ({e})"
+
+    with document:
+        if document.needs_pass:
+            return "password protected"
+        if not document.page_count:
+            return "empty"
+        try:
+            # n.b. mupdf repairs truncated files quietly, listing pages whose
+            # objects are gone; reading every page and content stream finds them
+            rect = document[0].rect
+            for page in document:
+                document.xref_object(page.xref)
+                for xref in page.get_contents():
+                    document.xref_stream(xref)
+        except Exception as e:
+            return f"damaged ({e})"
+        # owner-password files open and render, they only restrict editing
+        encrypted = bool(document.metadata.get("encryption"))
+        return DocumentInfo(document.page_count, round(rect.width, 1), round(rect.height, 1), encrypted)
+
+
+def preflight(data):
+    """DocumentInfo for the pdf in `data`; raises InvalidDocument when it can't be sent"""
+    global _pool
+    try:
+        result = get_pool().submit(inspect_document, data).result(timeout=settings.FAX_PREFLIGHT_TIMEOUT)
+    except TimeoutError:
+        # n.b. the stuck worker would keep its slot forever, so the pool goes
+        # and its processes with it
+        pool, _pool = _pool, None
+        for process in list(pool._processes.values()):
+            process.terminate()
+        pool.shutdown(wait=False)
+        raise InvalidDocument("took too long to read")
+    except BrokenProcessPool:
+        # the parser crashed the worker; start over with a fresh pool next time
+        logger.exception("The pre-flight pool broke while reading a document.")
+        _pool = None
+        raise InvalidDocument("not a readable pdf")
+
+    if isinstance(result, str):
+        raise InvalidDocument(result)
+    return result
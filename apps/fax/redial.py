@@ -0,0 +1,83 @@
+"""
+Redial policy for outbound faxes that end busy, unanswered or failed.
+
+A fax is dialled at most `max_attempts` times. After a failed attempt the
+next one waits `backoff * factor ** (attempt - 1)` seconds, capped at
+`max_delay`; an attempt that would fall inside the quiet hours is moved to
+the moment they end. The retry reuses the Fax row and its stored media: the
+row is reset to "queued" with `send_at` set to the next attempt time and goes
+through the send schedule, see fax.scheduling. Every try is kept as a
+FaxAttempt.
+
+Callbacks carry the attempt number in their url, so a late callback for an
+earlier attempt can never change the status of the current one.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+import pytz
+
+
+class RedialPolicy:
+    def __init__(
+        self,
+        max_attempts=3,
+        backoff=5 * 60,
+        factor=2.0,
+        max_delay=60 * 60,
+        quiet_hours=None,
+        tz="UTC",
+        statuses=("busy", "no-answer", "failed"),
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.max_delay = max_delay
+        self.quiet_hours = quiet_hours
+        self.tz = pytz.timezone(tz)
+        self.statuses = frozenset(statuses)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_attempts=settings.FAX_REDIAL_MAX_ATTEMPTS,
+            backoff=settings.FAX_REDIAL_BACKOFF,
+            factor=settings.FAX_REDIAL_BACKOFF_FACTOR,
+            max_delay=settings.FAX_REDIAL_MAX_DELAY,
+            quiet_hours=settings.FAX_REDIAL_QUIET_HOURS,
+            tz=settings.FAX_REDIAL_TIME_ZONE,
+            statuses=settings.FAX_REDIAL_STATUSES,
+        )
+
+    def should_redial(self, status, attempt):
+        return status in self.statuses and attempt < self.max_attempts
+
+    def delay(self, attempt):
+        """seconds to wait after failed attempt number `attempt` (1-based)"""
+        return min(self.backoff * self.factor ** (attempt - 1), self.max_delay)
+
+    def next_attempt_at(self, attempt, now):
+        """when to dial again after `attempt` failed at `now`, an aware datetime"""
+        return self.outside_quiet_hours(now + timedelta(seconds=self.delay(attempt)))
+
+    def outside_quiet_hours(self, moment):
+        """`moment`, or the end of the quiet hours it falls into"""
+        if not self.quiet_hours:
+            return moment
+        start, end = (time(hour) for hour in self.quiet_hours)
+
+        local = moment.astimezone(self.tz)
+        clock = local.time()
+        if start <= end:
+            quiet = start <= clock < end
+        else:
+            # wraps past midnight, e.g. 21:00 to 08:00
+            quiet = clock >= start or clock < end
+        if not quiet:
+            return moment
+
+        day = local.date()
+        if start > end and clock >= start:
+            day += timedelta(days=1)
+        resume = self.tz.localize(datetime.combine(day, end))
+        return resume.astimezone(moment.tzinfo)
@@ -0,0 +1,96 @@
+"""
+Cached snapshots of Twilio's fax resources.
+
+`Fax.resource` used to call the API on every access. Fetched faxes are now
+kept in redis as a compact `FaxSnapshot`, keyed by sid. A snapshot of a fax in
+a terminal status is kept for FAX_RESOURCE_TERMINAL_TTL: nothing about it will
+change, so it is effectively never fetched again. Any other snapshot lives
+for FAX_RESOURCE_TTL. Status callbacks drop the snapshot of their fax, so the
+next read sees the new status.
+"""
+from datetime import datetime
+import logging
+
+from django.conf import settings
+import ujson as json
+
+from fax.status import is_terminal
+from lazy_clients import LazyLoadedRedisClient
+
+
+logger = logging.getLogger(__name__)
+
+
+class FaxSnapshot:
+    """the fields we read from twilio's FaxInstance, under the same names"""
+
+    __slots__ = (
+        "sid",
+        "account_sid",
+        "status",
+        "direction",
+        "from_",
+        "to",
+        "quality",
+        "media_sid",
+        "media_url",
+        "num_pages",
+        "duration",
+        "price",
+        "price_unit",
+        "date_created",
+        "date_updated",
+    )
+    dates = ("date_created", "date_updated")
+
+    def __init__(self, **attributes):
+        for attribute in self.__slots__:
+            setattr(self, attribute, attributes.get(attribute))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.sid}: {self.status})"
+
+    @classmethod
+    def from_instance(cls, instance):
+        return cls(**{attribute: getattr(instance, attribute, None) for attribute in cls.__slots__})
+
+    @classmethod
+    def loads(cls, value):
+        attributes = json.loads(value)
+        for attribute in cls.dates:
+            if attributes.get(attribute):
+                attributes[attribute] = datetime.fromisoformat(attributes[attribute])
+        return cls(**attributes)
+
+    def dumps(self):
+        attributes = {attribute: getattr(self, attribute) for attribute in self.__slots__}
+        for attribute in self.dates:
+            if attributes[attribute] is not None:
+                attributes[attribute] = attributes[attribute].isoformat()
+        return json.dumps(attributes)
+
+    @property
+    def is_terminal(self):
+        return is_terminal(self.status)
+
+
+class ResourceCache:
+    def __init__(self):
+        self.client = LazyLoadedRedisClient().get_client()
+
+    def key(self, sid):
+        return f"fax:resource:{sid}"
+
+    def get(self, sid, fetch):
+        """the snapshot for `sid`, calling `fetch()` for the instance on a miss"""
+        value = self.client.get(self.key(sid))
+        if value is not None:
+            return FaxSnapshot.loads(value)
+
+        snapshot = FaxSnapshot.from_instance(fetch())
+        ttl = settings.FAX_RESOURCE_TERMINAL_TTL if snapshot.is_terminal else settings.FAX_RESOURCE_TTL
+        self.client.set(self.key(sid), snapshot.dumps(), ex=ttl)
+        return snapshot
+
+    def invalidate(self, sid):
+        return self.client.delete(self.key(sid))
@@ -0,0 +1,108 @@
+"""
+Priority queues and scheduled sends for outbound faxes.
+
+Every outbound fax carries a priority, and `_send_fax` is published to that
+priority's queue (settings.FAX_SEND_QUEUES) so an urgent fax never waits
+behind a bulk send. A fax with a future `send_at` is not published at all:
+its uuid waits in a redis sorted set scored by the send time, and
+`fax.tasks._release_scheduled_faxes` takes whatever is due once per
+FAX_SCHEDULE_INTERVAL. Finding due faxes therefore never touches the fax
+table. Taken faxes wait in a second set until they have been published, and
+are taken again if the releaser dies first, see SendSchedule.take_due.
+"""
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from lazy_clients import LazyLoadedRedisClient
+
+
+logger = logging.getLogger(__name__)
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+PRIORITY_CHOICES = [(HIGH, "High"), (NORMAL, "Normal"), (LOW, "Low")]
+
+SCHEDULED = "fax:send:scheduled"
+# taken from the schedule and not yet published, scored by when they were taken
+RELEASING = "fax:send:releasing"
+
+# move up to ARGV[2] members scored at or before ARGV[1] to the releasing set,
+# atomically, so two releasers can never publish the same fax. Members taken
+# at or before ARGV[3] by a releaser that never finished come first
+TAKE_DUE_SCRIPT = """
+local limit = tonumber(ARGV[2])
+local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[3], 'LIMIT', 0, limit)
+if #due < limit then
+    local scheduled = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, limit - #due)
+    if #scheduled > 0 then
+        redis.call('ZREM', KEYS[1], unpack(scheduled))
+    end
+    for _, uuid in ipairs(scheduled) do
+        table.insert(due, uuid)
+    end
+end
+for _, uuid in ipairs(due) do
+    redis.call('ZADD', KEYS[2], ARGV[1], uuid)
+end
+return due
+"""
+
+
+def queue_for(priority):
+    queues = settings.FAX_SEND_QUEUES
+    return queues.get(priority, queues[NORMAL])
+
+
+def from_browser_time(send_at, utc_offset):
+    """
+    the send time for `send_at`, a time picked in the browser and parsed as
+    UTC, and the browser's getTimezoneOffset() at that time in minutes
+    """
+    return send_at + timedelta(minutes=utc_offset or 0)
+
+
+class SendSchedule:
+    def __init__(self, client=None, release_timeout=None):
+        self.client = client or LazyLoadedRedisClient().get_client()
+        if release_timeout is None:
+            release_timeout = settings.FAX_SCHEDULE_RELEASE_TIMEOUT
+        self.release_timeout = release_timeout
+        self.take_due_script = self.client.register_script(TAKE_DUE_SCRIPT)
+
+    def add(self, faxes):
+        """hold faxes until their send_at; adding a fax again moves it"""
+        scores = {str(fax.uuid): fax.send_at.timestamp() for fax in faxes}
+        if scores:
+            self.client.zadd(SCHEDULED, scores)
+        return len(scores)
+
+    def remove(self, uuid):
+        return self.client.zrem(SCHEDULED, str(uuid))
+
+    def take_due(self, limit, now=None):
+        """
+        uuids whose send time has come, moved from the schedule to the
+        releasing set; call `released` once they have been published. Faxes a
+        releaser took `release_timeout` seconds ago are taken again.
+        """
+        now = now or timezone.now()
+        stale = now.timestamp() - self.release_timeout
+        due = self.take_due_script(keys=[SCHEDULED, RELEASING], args=[now.timestamp(), limit, stale])
+        return [uuid.decode() for uuid in due]
+
+    def released(self, uuids):
+        """forget faxes taken by `take_due` once they have been published or put back"""
+        return self.client.zrem(RELEASING, *uuids) if uuids else 0
+
+    def next_due(self):
+        """the earliest scheduled send time as a timestamp, or None"""
+        first = self.client.zrange(SCHEDULED, 0, 0, withscores=True)
+        return first[0][1] if first else None
+
+    def __len__(self):
+        return self.client.zcard(SCHEDULED)
@@ -0,0 +1,261 @@
+"""
+Asyncio send engine for high-volume outbound faxes.
+
+With FAX_SEND_ENGINE = "async", faxes that are ready to go are not published
+as one `_send_fax` task each. `fax.tasks.queue_send` stamps `queued_on`
+instead, and `send_queued_faxes` pulls those rows in batches (high priority
+first) and submits each batch to Twilio as concurrent create calls over a
+single httpx.AsyncClient, at most FAX_SEND_CONCURRENCY in flight. The sids and
+statuses are written back with one `bulk_update` per batch.
+
+A batch is claimed before it is sent: its rows are locked with SKIP LOCKED and
+moved from `queued_on` to `sending_since` in one transaction, so a second
+engine, e.g. one started after the first outlived its lock, never picks up a
+fax that is already in flight.
+
+The ORM is only used between batches, outside the event loop. Every create
+still takes a token from the shared rate limiter, see rate_limits.py, and
+waits for it asynchronously. Faxes whose create never reached Twilio (no
+connection, or no free one in the pool) or was throttled are queued again and
+go out with a later batch. Faxes Twilio rejected are marked failed, and so are
+faxes whose request failed after it was sent, e.g. a read timeout: Twilio may
+have created them, and sending them again could deliver them twice. A claim
+left behind by an engine that died mid-batch is failed the same way after
+FAX_SEND_CLAIM_TIMEOUT. None of these are redialled.
+"""
+import asyncio
+from collections import namedtuple
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import timezone
+import httpx
+from redis.exceptions import LockNotOwnedError
+
+from fax.models import Fax, FaxAttempt
+from fax.scheduling import PRIORITY_CHOICES
+from fax.status import TERMINAL_RANK, status_rank
+from lazy_clients import LazyLoadedRedisClient
+from rate_limits import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+# uuid and what twilio said: sid and status on success, error otherwise;
+# `retry` marks errors worth another try
+Result = namedtuple("Result", "uuid sid status error retry")
+
+# n.b. only failures before the request went out; after that the outcome is unknown
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+PRIORITY_ORDER = Case(
+    *[When(priority=value, then=Value(order)) for order, (value, _) in enumerate(PRIORITY_CHOICES)],
+    output_field=IntegerField(),
+)
+
+
+# what a batch writes back
+SENT_FIELDS = [
+    "sid",
+    "status",
+    "fax_status",
+    "status_rank",
+    "error_message",
+    "queued_on",
+    "sending_since",
+    "updated_on",
+]
+
+
+def claim_batch(batch_size, exclude=()):
+    """
+    take the next batch waiting for the sender off the queue, served by
+    fax_unsent_queued_on_idx; rows another engine is claiming are skipped
+    """
+    with transaction.atomic():
+        faxes = list(
+            Fax.objects.select_for_update(skip_locked=True, of=("self",))
+            .exclude(uuid__in=exclude)
+            .filter(queued_on__isnull=False, sid__isnull=True)
+            .select_related("blob")
+            .order_by(PRIORITY_ORDER, "queued_on")[:batch_size]
+        )
+        now = timezone.now()
+        Fax.objects.filter(uuid__in=[fax.uuid for fax in faxes]).update(queued_on=None, sending_since=now)
+    # n.b. the in-memory queued_on is kept, a fax queued again keeps its place
+    for fax in faxes:
+        fax.sending_since = now
+    return faxes
+
+
+def abandoned_faxes():
+    """faxes claimed by an engine that never wrote back, served by fax_sending_since_idx"""
+    since = timezone.now() - timedelta(seconds=settings.FAX_SEND_CLAIM_TIMEOUT)
+    return list(Fax.objects.filter(sending_since__lt=since, sid__isnull=True))
+
+
+def create_params(fax):
+    return {
+        "From": fax._from,
+        "To": fax._to,
+        "MediaUrl": fax.media_url,
+        "StatusCallback": fax.status_callback_url,
+    }
+
+
+async def create_faxes(requests, concurrency, url, auth, bucket=None):
+    """
+    POST every (uuid, params) in `requests` to twilio's Faxes endpoint, at most
+    `concurrency` at a time; returns a Result per request
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(auth=auth, limits=limits, timeout=settings.FAX_SEND_TIMEOUT) as client:
+
+        async def create(uuid, params):
+            async with semaphore:
+                if bucket is not None:
+                    # n.b. one short redis call; waiting for the token doesn't block the loop
+                    while True:
+                        wait = bucket.try_acquire("fax-create")
+                        if not wait:
+                            break
+                        await asyncio.sleep(wait)
+                try:
+                    response = await client.post(url, data=params)
+                except RETRYABLE_ERRORS as e:
+                    return Result(uuid, None, None, f"{e.__class__.__name__}: {e}", True)
+                except httpx.HTTPError as e:
+                    return Result(uuid, None, None, f"outcome unknown, {e.__class__.__name__}", False)
+
+            if response.status_code in (200, 201):
+                body = response.json()
+                return Result(uuid, body["sid"], body["status"], None, False)
+            if response.status_code == 429 or response.status_code >= 500:
+                return Result(uuid, None, None, f"twilio returned {response.status_code}", True)
+            try:
+                message = response.json().get("message")
+            except ValueError:
+                message = None
+            return Result(uuid, None, None, message or f"twilio returned {response.status_code}", False)
+
+        return await asyncio.gather(*(create(uuid, params) for uuid, params in requests))
+
+
+def send_batch(faxes, concurrency):
+    """submit one batch of loaded faxes and write the outcome back; returns the Results"""
+    requests = [(fax.uuid, create_params(fax)) for fax in faxes]
+    url = f"{settings.TWILIO_FAX_API_URL}/Faxes"
+    auth = (settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+    results = asyncio.run(create_faxes(requests, concurrency, url, auth, TokenBucket()))
+    write_results(faxes, results)
+    return results
+
+
+def write_results(faxes, results):
+    """write the Result of each claimed fax back and record the attempt"""
+    by_uuid = {fax.uuid: fax for fax in faxes}
+    changed, attempts = [], []
+    now = timezone.now()
+    for result in results:
+        fax = by_uuid[result.uuid]
+        fax.sending_since = None
+        fax.updated_on = now
+        if result.retry:
+            logger.warning(f"Fax {fax.uuid} is queued again: {result.error}")
+            changed.append(fax)
+            continue
+        fax.queued_on = None
+        if result.sid:
+            fax.sid, fax.status = result.sid, result.status
+            fax.status_rank = status_rank(result.status)
+        else:
+            logger.error(f"Failed to send fax {fax.uuid}: {result.error}")
+            fax.status = fax.fax_status = "failed"
+            fax.status_rank = TERMINAL_RANK
+            fax.error_message = result.error[:64]
+        changed.append(fax)
+        attempts.append(
+            FaxAttempt(
+                fax=fax,
+                number=fax.attempt,
+                sid=fax.sid,
+                status=fax.status,
+                error_message=fax.error_message,
+                finished_on=None if fax.sid else now,
+            )
+        )
+
+    # n.b. imported here, fax.tasks imports this module
+    from fax.tasks import attempts_ended
+
+    with transaction.atomic():
+        Fax.objects.bulk_update(changed, SENT_FIELDS)
+        FaxAttempt.objects.bulk_create(attempts, ignore_conflicts=True)
+        # n.b. never redialled: twilio rejected them, or they may have been
+        # sent already and a redial could deliver them twice
+        attempts_ended((fax for fax in changed if fax.status == "failed"), redial=False)
+
+
+def fail_abandoned_faxes():
+    faxes = abandoned_faxes()
+    if faxes:
+        error = "outcome unknown, send interrupted"
+        write_results(faxes, [Result(fax.uuid, None, None, error, False) for fax in faxes])
+    return len(faxes)
+
+
+def send_queued_faxes(batch_size=None, concurrency=None, max_batches=None, lock=None):
+    """
+    send batches until nothing is ready or `max_batches` were sent; returns the
+    faxes submitted to twilio
+
+    Faxes queued again after a failure are skipped for the rest of this run, so
+    an unreachable twilio can't keep the loop spinning. The `lock` held for the
+    run, if any, is extended before every batch, and the run stops once it has
+    been lost.
+    """
+    batch_size = batch_size or settings.FAX_SEND_BATCH_SIZE
+    concurrency = concurrency or settings.FAX_SEND_CONCURRENCY
+    abandoned = fail_abandoned_faxes()
+    if abandoned:
+        logger.error(f"Failed {abandoned} faxes left mid-send by an engine that stopped.")
+
+    submitted, retry, batches = [], set(), 0
+    while max_batches is None or batches < max_batches:
+        if lock is not None:
+            try:
+                lock.reacquire()
+            except LockNotOwnedError:
+                logger.warning("Lost the send engine lock, stopping until the next run.")
+                break
+        faxes = claim_batch(batch_size, exclude=retry)
+        if not faxes:
+            break
+        results = send_batch(faxes, concurrency)
+        submitted += [result.uuid for result in results if result.sid]
+        retry.update(result.uuid for result in results if result.retry)
+        batches += 1
+        logger.info(f"Sent batch {batches}: {len(faxes)} faxes, {len(retry)} left for a later run.")
+    return submitted
+
+
+def lock():
+    """
+    held while sending so only one engine pulls from the queue at a time;
+    `send_queued_faxes` extends it batch by batch
+    """
+    client = LazyLoadedRedisClient().get_client()
+    return client.lock("fax:send:engine:lock", timeout=settings.FAX_SEND_LOCK_TIMEOUT)
+
+
+def release(lock):
+    """release the engine lock, unless it expired and another engine took it meanwhile"""
+    try:
+        lock.release()
+    except LockNotOwnedError:
+        logger.warning("The send engine lock expired before the run ended.")
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from fax.models import Fax, FaxStats
+
+
+@receiver(post_delete, sender=Fax)
+def release_media_blob(sender, instance, **kwargs):
+    """drop the deleted fax's reference, see fax.tasks._purge_media_blobs"""
+    if instance.blob_id:
+        instance.blob.remove_references()
+
+
+@receiver(post_delete, sender=Fax)
+def uncount_fax(sender, instance, **kwargs):
+    """take the deleted fax out of the rollups, see fax.stats"""
+    FaxStats.objects.record([(instance, instance.status, None)])
@@ -0,0 +1,70 @@
+"""
+Fax statistics rollups.
+
+Counting sent, received, delivered and failed faxes with GROUP BY over fax_fax
+gets slower every month, so FaxStats keeps the counts instead: one row per
+hour and one per day for every user. The rows are kept up to date as faxes
+change. A new fax, a status change or a deleted fax adds to or takes away from
+the rows of the hour and day the fax was created in, with one upsert per
+unique constraint.
+
+Counts belong to the hour a fax was created in, so a fax delivered the next
+morning still counts for the day it was sent, and rebuilding the rows from
+fax_fax (`manage.py rebuild_fax_stats`) gives the same numbers.
+
+Outbound faxes count as sent and, once an attempt ends, as delivered or as
+failed for any other terminal status. A redial takes the failure back, see
+fax.redial. Inbound faxes count as received.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time
+
+import pytz
+
+from fax.status import TERMINAL_STATUSES, is_terminal
+
+
+HOUR = "hour"
+DAY = "day"
+PERIOD_CHOICES = [(HOUR, "Hour"), (DAY, "Day")]
+
+COUNTERS = ("sent", "received", "delivered", "failed")
+DELIVERED = "delivered"
+FAILED_STATUSES = sorted(TERMINAL_STATUSES - {DELIVERED})
+
+
+def counted(direction, status):
+    """the counters a fax adds to; none for a `status` of None, a fax that doesn't exist"""
+    if status is None:
+        return ()
+    if direction != "outbound":
+        return ("received",)
+    if not is_terminal(status):
+        return ("sent",)
+    return ("sent", "delivered" if status == DELIVERED else "failed")
+
+
+def buckets(created_on, tz):
+    """(period, start) of the hour and the day `created_on` falls in, the day's in `tz`"""
+    hour = created_on.astimezone(pytz.utc).replace(minute=0, second=0, microsecond=0)
+    return [(HOUR, hour), (DAY, start_of_day(created_on.astimezone(tz).date(), tz))]
+
+
+def start_of_day(day, tz):
+    return tz.localize(datetime.combine(day, time()))
+
+
+def deltas(changes, tz):
+    """
+    {(period, start, user uuid): Counter} for `changes`, (fax, before, after)
+    tuples of a fax and its status before and after the change
+    """
+    rows = defaultdict(Counter)
+    for fax, before, after in changes:
+        delta = Counter(counted(fax.direction, after))
+        delta.subtract(counted(fax.direction, before))
+        if not any(delta.values()):
+            continue
+        for period, start in buckets(fax.created_on, tz):
+            rows[period, start, fax.created_by_id].update(delta)
+    return {key: counts for key, counts in rows.items() if any(counts.values())}
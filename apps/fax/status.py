@@ -0,0 +1,34 @@
+"""
+Fax status state machine.
+
+Twilio delivers status callbacks out of order, so every status carries a rank
+and a fax only ever moves to a status of higher rank. All terminal statuses
+share the top rank, which means the first terminal callback wins.
+"""
+
+QUEUED = "queued"
+
+STATUS_RANKS = {
+    "queued": 0,
+    "processing": 1,
+    "sending": 2,
+    "receiving": 2,
+    "delivered": 3,
+    "received": 3,
+    "no-answer": 3,
+    "busy": 3,
+    "failed": 3,
+    "canceled": 3,
+}
+
+TERMINAL_RANK = max(STATUS_RANKS.values())
+TERMINAL_STATUSES = frozenset(s for s, rank in STATUS_RANKS.items() if rank == TERMINAL_RANK)
+
+
+def status_rank(status):
+    """rank of a twilio fax status; unknown statuses sit just above queued"""
+    return STATUS_RANKS.get(status, STATUS_RANKS["processing"])
+
+
+def is_terminal(status):
+    return status in TERMINAL_STATUSES
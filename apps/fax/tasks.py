@@ -1,18 +1,326 @@
 import logging
 
-from celery import shared_task
+from datetime import timedelta
 
-from fax.models import Fax
+from celery import group, shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import pytz
+
+from fax import events
+from fax.coalesce import StatusCoalescer
+from fax.ingest import InboundFaxBuffer
+from fax.bulk import batches
+from fax.models import BulkSend, Fax, FaxStats, MediaBlob
+from fax.notifications import PendingNotifications, digest_email, send_batch, send_to_all
+from fax.redial import RedialPolicy
+from fax.scheduling import SendSchedule, queue_for
+from fax import sender
+from fax.status import QUEUED, is_terminal
+from fax.webhooks import ReceivedFaxPayload
+from rate_limits import RateLimited
+
+
+logger = logging.getLogger(__name__)
+
+
+def queue_send(fax):
+    """publish _send_fax on the fax's priority queue, or hold it until send_at"""
+    if fax.is_scheduled:
+        SendSchedule().add([fax])
+        logger.info(f"Fax {fax.uuid} scheduled for {fax.send_at}.")
+        return
+    if settings.FAX_SEND_ENGINE == "async":
+        mark_queued([fax.uuid])
+        return
+    _send_fax.apply_async((fax.uuid,), queue=queue_for(fax.priority))
+
+
+def mark_queued(uuids):
+    """hand faxes to the async send engine, see fax.sender"""
+    return Fax.objects.filter(uuid__in=uuids, sid__isnull=True).update(queued_on=timezone.now())
+
+
+def attempts_ended(faxes, publish=True, redial=True):
+    """
+    count the outbound attempts that just reached a terminal status and queue
+    their follow-up: the status event and `_finish_fax_attempt`
+
+    Call it in the transaction that changed the faxes, which need `uuid`,
+    `attempt`, `status`, `error_message` and what fax.stats buckets by. The
+    counts commit with the change and the rest is sent once it has. Without
+    `redial` the faxes are only counted and announced; the caller records
+    their attempts and they are never dialled again.
+    """
+    faxes = list(faxes)
+    if not faxes:
+        return
+    # n.b. a terminal status always outranks the stored one, so these faxes
+    # were not finished before, see fax.stats
+    FaxStats.objects.record([(fax, QUEUED, fax.status) for fax in faxes])
+
+    def follow_up():
+        if publish:
+            for fax in faxes:
+                events.publish(
+                    events.STATUS, fax.uuid, fax.status, attempt=fax.attempt, error_message=fax.error_message
+                )
+        if redial:
+            group(_finish_fax_attempt.s(fax.uuid, fax.attempt) for fax in faxes).apply_async()
+
+    transaction.on_commit(follow_up)
+
+
+@shared_task(bind=True, max_retries=settings.TWILIO_RATE_LIMIT_MAX_RETRIES)
+def _receive_fax(self, uuid):
+    fax = Fax.objects.get(uuid=uuid)
+    try:
+        fax.receive_fax()
+    except RateLimited as e:
+        raise self.retry(exc=e, countdown=e.countdown())
+    events.publish(events.RECEIVED, uuid, fax.status, from_number=fax.from_number)
+    _render_thumbnails.delay(uuid)
+    if settings.FAX_NOTIFICATION_DIGEST_WINDOW:
+        PendingNotifications().add(uuid)
+    else:
+        _notify_inbound_fax.delay(uuid)
 
 
 @shared_task
-def _receive_fax(uuid):
+def _notify_inbound_fax(uuid):
     fax = Fax.objects.get(uuid=uuid)
-    fax.receive_fax()
-    fax.send_notification_email()
+    subject, body = fax.notification_email()
+    for recipients in send_to_all(subject, body):
+        _send_notification_batch.delay(subject, body, recipients)
+
+
+@shared_task
+def _send_notification_digest():
+    """one summary email for every fax received since the last digest"""
+    pending = PendingNotifications()
+    lock = pending.lock()
+    if not lock.acquire(blocking=False):
+        logger.info("A notification digest is already being sent.")
+        return 0
+
+    try:
+        uuids = pending.take()
+        if uuids:
+            faxes = list(Fax.objects.filter(uuid__in=uuids).order_by("created_on"))
+            if faxes:
+                tz = pytz.timezone(settings.FAX_NOTIFICATION_TIME_ZONE)
+                subject, body = digest_email(faxes, tz)
+                for recipients in send_to_all(subject, body):
+                    _send_notification_batch.delay(subject, body, recipients)
+        pending.done()
+    finally:
+        lock.release()
+    return len(uuids)
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
+def _send_notification_batch(subject, body, recipients):
+    """retry a single batch that failed inside _notify_inbound_fax"""
+    send_batch(subject, body, recipients)
+
+
+@shared_task
+def _prepare_fax_media(uuid):
+    """render the document for fax on the media queue, then send it"""
+    fax = Fax.objects.select_related("blob").get(uuid=uuid)
+    if fax.prepare_media():
+        queue_send(fax)
+    else:
+        events.publish(events.STATUS, uuid, fax.status, attempt=fax.attempt, error_message=fax.error_message)
 
 
 @shared_task
-def _send_fax(uuid):
+def _send_bulk_fax(uuid):
+    """check and render the shared document once, then send each batch as a group"""
+    bulk = BulkSend.objects.select_related("blob").get(uuid=uuid)
+    if not bulk.prepare_media():
+        return 0
+    if settings.FAX_NORMALIZE_MEDIA:
+        try:
+            bulk.blob.normalize()
+        except Exception:
+            logger.exception(f"Failed to normalize media for bulk send {uuid}, sending the original.")
+
+    if settings.FAX_SEND_ENGINE == "async":
+        return bulk.faxes.filter(sid__isnull=True).update(queued_on=timezone.now())
+
+    faxes = list(bulk.faxes.order_by("batch", "created_on").only("uuid", "priority"))
+    for batch in batches(faxes, bulk.batch_size):
+        group(_send_fax.si(fax.uuid).set(queue=queue_for(fax.priority)) for fax in batch).apply_async()
+    return len(faxes)
+
+
+@shared_task(bind=True, max_retries=settings.TWILIO_RATE_LIMIT_MAX_RETRIES)
+def _send_fax(self, uuid):
+    fax = Fax.objects.select_related("blob").get(uuid=uuid)
+    try:
+        fax.send_fax()
+    except RateLimited as e:
+        # n.b. rescheduled rather than waiting, the worker moves on to other work
+        raise self.retry(exc=e, countdown=e.countdown())
+    _render_thumbnails.delay(uuid)
+
+
+@shared_task
+def _finish_fax_attempt(uuid, attempt):
+    """record a finished attempt and redial busy, unanswered or failed faxes"""
+    with transaction.atomic():
+        fax = Fax.objects.select_for_update().get(uuid=uuid)
+        # n.b. callbacks are delivered more than once; only the first one counts
+        if fax.attempt != attempt or not is_terminal(fax.status):
+            return None
+        retry_at = fax.finish_attempt(RedialPolicy.from_settings())
+
+    if retry_at:
+        queue_send(fax)
+    return retry_at
+
+
+@shared_task
+def _release_scheduled_faxes():
+    """publish the scheduled faxes whose send time has come, see fax.scheduling"""
+    schedule = SendSchedule()
+    released = 0
+    while True:
+        uuids = schedule.take_due(settings.FAX_SCHEDULE_BATCH_SIZE)
+        if not uuids:
+            break
+
+        faxes = Fax.objects.filter(uuid__in=uuids, sid__isnull=True).only("uuid", "priority", "send_at", "sid")
+        due = []
+        for fax in faxes:
+            # moved to a later time since it was scheduled
+            if fax.is_scheduled:
+                schedule.add([fax])
+                continue
+            due.append(fax)
+
+        if settings.FAX_SEND_ENGINE == "async":
+            mark_queued([fax.uuid for fax in due])
+        else:
+            for fax in due:
+                _send_fax.apply_async((fax.uuid,), queue=queue_for(fax.priority))
+        schedule.released(uuids)
+        released += len(due)
+
+    if released:
+        logger.info(f"Released {released} scheduled faxes.")
+    return released
+
+
+@shared_task
+def _send_queued_faxes():
+    """send the faxes queued for the async engine, see fax.sender"""
+    lock = sender.lock()
+    if not lock.acquire(blocking=False):
+        logger.info("Queued faxes are already being sent.")
+        return 0
+
+    try:
+        submitted = sender.send_queued_faxes(lock=lock)
+    finally:
+        sender.release(lock)
+
+    if submitted:
+        group(_render_thumbnails.s(uuid) for uuid in submitted).apply_async()
+    return len(submitted)
+
+
+@shared_task
+def _render_thumbnails(uuid):
     fax = Fax.objects.get(uuid=uuid)
-    fax.send_fax()
+    fax.render_thumbnails()
+
+
+def _ingest(batch):
+    """store the faxes of buffered (entry id, body) webhooks and queue their receive tasks"""
+    payloads = [ReceivedFaxPayload.from_dict(body) for _, body in batch]
+    sids = [payload.fax_sid for payload in payloads]
+    existing = set(Fax.objects.filter(sid__in=sids).values_list("sid", flat=True))
+
+    faxes = []
+    for payload in payloads:
+        # twilio retries webhooks, so a sid may appear more than once
+        if payload.fax_sid in existing:
+            continue
+        existing.add(payload.fax_sid)
+        faxes.append(Fax.from_inbound_webhook(payload))
+
+    Fax.objects.bulk_create(faxes)
+    if faxes:
+        group(_receive_fax.s(fax.uuid) for fax in faxes).apply_async()
+    return len(faxes)
+
+
+@shared_task
+def _drain_inbound_faxes():
+    """bulk-insert buffered inbound webhooks and fan out their receive tasks"""
+    buffer = InboundFaxBuffer()
+    lock = buffer.lock()
+    if not lock.acquire(blocking=False):
+        logger.info("Inbound fax buffer is already being drained.")
+        return 0
+
+    total = 0
+    try:
+        for batch in buffer.batches(settings.FAX_INGEST_BATCH_SIZE):
+            try:
+                total += _ingest(batch)
+            except Exception:
+                logger.exception(f"Failed to ingest {len(batch)} inbound faxes, retrying them one by one.")
+            else:
+                buffer.ack([entry_id for entry_id, _ in batch])
+                continue
+
+            # n.b. entries that fail alone stay pending, see fax.ingest
+            for entry in batch:
+                try:
+                    total += _ingest([entry])
+                except Exception:
+                    logger.exception(f"Failed to ingest inbound fax webhook {entry[0].decode()}.")
+                else:
+                    buffer.ack([entry[0]])
+    finally:
+        lock.release()
+
+    if total:
+        logger.info(f"Ingested {total} buffered inbound faxes.")
+    return total
+
+
+@shared_task
+def _flush_status_updates():
+    """write coalesced status callbacks, see fax.coalesce"""
+    coalescer = StatusCoalescer()
+    lock = coalescer.lock()
+    if not lock.acquire(blocking=False):
+        logger.info("Fax statuses are already being flushed.")
+        return 0
+
+    try:
+        with transaction.atomic():
+            changed = coalescer.flush(Fax)
+            # n.b. the events went out when the callbacks were recorded, see FaxStatusCallback
+            attempts_ended((fax for fax in changed if is_terminal(fax.status)), publish=False)
+    finally:
+        lock.release()
+    return len(changed)
+
+
+@shared_task
+def _purge_media_blobs():
+    """delete blobs that no fax has referenced for a whole grace period, unless a bulk send uses them"""
+    cutoff = timezone.now() - timedelta(seconds=settings.FAX_MEDIA_BLOB_GRACE_PERIOD)
+    purged = 0
+    for blob in MediaBlob.objects.purgeable(cutoff):
+        if MediaBlob.objects.purge(blob, cutoff):
+            blob.delete_media()
+            purged += 1
+    logger.info(f"purged {purged} unreferenced media blobs")
+    return purged
@@ -1,3 +1,563 @@
-from django.test import TestCase
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import os
+from smtplib import SMTPException
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs
 
-# Create your tests here.
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.core.mail.backends import locmem
+from django.db.models import Q
+from django.test import RequestFactory
+from django.test.utils import override_settings
+import pymupdf
+import pytest
+import pytz
+import redis
+import requests
+
+from accurate_replica.events import Broadcaster, Stream
+from core.local_services import LocalMediaServer, LocalS3Server, LocalService, QuietHandler
+from dashboard.views import StreamedUploadView
+from fax.events import RECEIVED, STATUS
+from fax.forms import FaxFilterForm, OutboundFaxForm, inspect_upload, new_upload
+from fax.ingest import InboundFaxBuffer
+from fax.media import (
+    MultipartUpload,
+    blob_name,
+    fetch_to_storage,
+    hash_chunks,
+    iter_stored,
+    presigned_upload,
+    stored_object,
+)
+from fax.models import Fax
+from fax.bulk import parse_recipients
+from fax.normalize import levels_table
+from fax import notifications
+from fax.notifications import digest_email
+from fax.preflight import DocumentInfo, inspect_document
+from fax.redial import RedialPolicy
+from fax.resources import FaxSnapshot
+from fax.scheduling import RELEASING, SCHEDULED, SendSchedule, from_browser_time
+from fax.sender import create_faxes
+from fax.stats import DAY, HOUR, deltas
+from fax.status import is_terminal, status_rank
+from fax.uploads import S3StreamingUploadHandler, StreamedUploadedFile
+from fax.webhooks import FaxStatusPayload, InvalidWebhookPayload, ReceivedFaxPayload
+from lazy_clients import reset_clients
+from rate_limits import endpoint_class
+
+
+MB = 1024 * 1024
+REDIS_TEST_URL = os.environ.get("REDIS_TEST_URL", "redis://localhost:6379/15")
+
+
+def test_webhook_decoder__decodes_form_encoding():
+    body = b"FaxSid=FX123&Status=failed&FaxStatus=failed&ErrorMessage=Line+busy%3A+a%3Db&NumPages=2"
+    payload = FaxStatusPayload.decode(body)
+
+    assert payload.fax_sid == "FX123"
+    assert payload.status == "failed"
+    assert payload.error_message == "Line busy: a=b"
+    assert payload.as_dict() == {
+        "FaxSid": "FX123",
+        "Status": "failed",
+        "FaxStatus": "failed",
+        "ErrorMessage": "Line busy: a=b",
+    }
+
+
+def test_webhook_decoder__tolerates_unencoded_equals_and_empty_values():
+    payload = FaxStatusPayload.decode(b"Status=queued&FaxStatus=queued&MediaUrl=https://x/?a=b&ErrorMessage=")
+
+    assert payload.status == "queued"
+    assert payload.error_message == ""
+
+
+def test_webhook_decoder__rejects_missing_fields():
+    with pytest.raises(InvalidWebhookPayload):
+        ReceivedFaxPayload.decode(b"FaxSid=FX123&Status=received")
+
+
+def test_webhook_decoder__round_trips_through_dict():
+    body = b"FaxSid=FX1&Status=received&FaxStatus=received&From=%2B13125550100&To=%2B13125550199"
+    payload = ReceivedFaxPayload.decode(body)
+
+    assert payload.from_ == "+13125550100"
+    assert ReceivedFaxPayload.from_dict(payload.as_dict()).as_dict() == payload.as_dict()
+
+
+def test_status_rank__never_moves_backwards():
+    assert status_rank("queued") < status_rank("processing") < status_rank("sending")
+    assert status_rank("sending") < status_rank("delivered")
+    assert status_rank("delivered") == status_rank("failed") == status_rank("busy")
+    assert is_terminal("no-answer") and not is_terminal("sending")
+
+
+def test_blob_name__is_sharded_by_digest():
+    digest = hash_chunks([b"%PDF-1.4 ", b"same document"])
+
+    assert digest == hash_chunks([b"%PDF-1.4 same document"])
+    assert blob_name(digest) == f"fax-media/blobs/{digest[:2]}/{digest[2:4]}/{digest}.pdf"
+    assert blob_name(digest, "image/png").endswith(f"{digest}.png")
+    key = "872d1fc4-f981-4628-8c5b-5aa7ce3e55bf"
+    assert blob_name(digest, key=key) == f"fax-media/blobs/{digest[:2]}/{digest[2:4]}/{key}.pdf"
+
+
+def test_levels_table__clips_paper_and_ink():
+    table = levels_table(96, 200)
+
+    assert len(table) == 256
+    assert table[0] == table[96] == 0
+    assert table[200] == table[255] == 255
+    assert 0 < table[148] < 255
+    assert list(table) == sorted(table)
+
+
+def test_parse_recipients__validates_in_one_pass():
+    text = "name,fax\nAda,(321) 555-0123\nBob,321.555.0124\nCy,12345\nAda,+1 321 555 0123\n"
+
+    numbers, invalid = parse_recipients(text, exclude=["+13215550124"])
+
+    assert numbers == ["+13215550123"]
+    assert invalid == [(3, "321.555.0124"), (4, "12345")]
+    assert parse_recipients("3215550123, 3215550125\n3215550126")[0] == [
+        "+13215550123",
+        "+13215550125",
+        "+13215550126",
+    ]
+    assert parse_recipients("id,fax\n7,3215550123", column=1) == (["+13215550123"], [])
+
+
+def test_endpoint_class__separates_fax_create_from_fetch():
+    base = "https://fax.twilio.com/v1/Faxes"
+    assert endpoint_class("POST", base) == "fax-create"
+    assert endpoint_class("get", f"{base}/FX123") == "fax-fetch"
+    assert endpoint_class("POST", f"{base}/FX123") == "default"
+    assert endpoint_class("POST", "https://api.twilio.com/2010-04-01/Accounts/AC1/IncomingPhoneNumbers/PN1.json") == "numbers"
+
+
+def test_redial_policy__backs_off_and_waits_out_quiet_hours():
+    policy = RedialPolicy(max_attempts=3, backoff=60, factor=2, max_delay=300, quiet_hours=(21, 8))
+    noon = datetime(2020, 1, 6, 12, 0, tzinfo=timezone.utc)
+
+    assert [policy.delay(attempt) for attempt in (1, 2, 3, 4)] == [60, 120, 240, 300]
+    assert policy.next_attempt_at(2, noon) == datetime(2020, 1, 6, 12, 2, tzinfo=timezone.utc)
+    assert policy.next_attempt_at(1, noon.replace(hour=20, minute=59, second=30)) == datetime(
+        2020, 1, 7, 8, 0, tzinfo=timezone.utc
+    )
+    assert policy.next_attempt_at(1, noon.replace(hour=3)) == noon.replace(hour=8)
+    assert policy.should_redial("busy", 2)
+    assert not policy.should_redial("busy", 3)
+    assert not policy.should_redial("canceled", 1)
+
+
+def test_fax_snapshot__round_trips_the_fields_we_read():
+    created = datetime(2020, 1, 6, 12, 0, tzinfo=timezone.utc)
+    instance = SimpleNamespace(
+        sid="FX123", status="delivered", from_="+15555550100", num_pages=2, date_created=created, links={}
+    )
+    snapshot = FaxSnapshot.loads(FaxSnapshot.from_instance(instance).dumps())
+
+    assert (snapshot.sid, snapshot.from_, snapshot.num_pages) == ("FX123", "+15555550100", 2)
+    assert snapshot.date_created == created
+    assert snapshot.media_url is None
+    assert snapshot.is_terminal
+
+
+def test_inspect_document__rejects_what_twilio_cannot_send():
+    document = pymupdf.open()
+    for _ in range(4):
+        document.new_page(width=612, height=792).insert_text((72, 72), "page " * 50)
+    data = document.tobytes()
+
+    assert inspect_document(data) == DocumentInfo(4, 612.0, 792.0, False)
+    assert inspect_document(document.tobytes(encryption=pymupdf.PDF_ENCRYPT_AES_256, owner_pw="o")).encrypted
+    assert inspect_document(document.tobytes(encryption=pymupdf.PDF_ENCRYPT_AES_256, user_pw="u")) == "password protected"
+    assert isinstance(inspect_document(data[: len(data) // 3]), str)
+    assert inspect_document(b"not a pdf").startswith("not a readable pdf")
+
+
+def test_stats_deltas__count_each_change_once_in_the_creation_buckets():
+    tz = pytz.timezone("America/New_York")
+    created_on = datetime(2020, 1, 7, 3, 30, tzinfo=timezone.utc)
+    outbound = SimpleNamespace(direction="outbound", created_on=created_on, created_by_id="user")
+    inbound = SimpleNamespace(direction="inbound", created_on=created_on, created_by_id=None)
+
+    rows = deltas(
+        [
+            (outbound, None, "queued"),
+            (outbound, "queued", "busy"),
+            (outbound, "busy", "queued"),
+            (outbound, "queued", "delivered"),
+            (inbound, None, "received"),
+            (inbound, "received", None),
+        ],
+        tz,
+    )
+
+    hour = datetime(2020, 1, 7, 3, tzinfo=timezone.utc)
+    day = tz.localize(datetime(2020, 1, 6))
+    assert rows == {
+        (HOUR, hour, "user"): {"sent": 1, "delivered": 1, "failed": 0},
+        (DAY, day, "user"): {"sent": 1, "delivered": 1, "failed": 0},
+    }
+
+
+@pytest.fixture
+def redis_client():
+    # n.b. a database of its own, the tests clear the keys they use
+    client = redis.Redis.from_url(REDIS_TEST_URL)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("needs a redis server")
+    keys = [SCHEDULED, RELEASING, "test:ingest", "test:ingest:dead"]
+    client.delete(*keys)
+    yield client
+    client.delete(*keys)
+
+
+def test_from_browser_time__applies_the_browsers_utc_offset():
+    picked = datetime(2020, 3, 8, 9, 0, tzinfo=timezone.utc)
+
+    # getTimezoneOffset() is positive west of UTC: 300 is UTC-5
+    assert from_browser_time(picked, 300) == datetime(2020, 3, 8, 14, 0, tzinfo=timezone.utc)
+    assert from_browser_time(picked, -60) == datetime(2020, 3, 8, 8, 0, tzinfo=timezone.utc)
+    assert from_browser_time(picked, None) == picked
+
+
+def test_send_schedule__takes_due_faxes_once_until_released(redis_client):
+    schedule = SendSchedule(redis_client, release_timeout=60)
+    now = datetime(2020, 1, 7, 12, tzinfo=timezone.utc)
+    schedule.add(
+        [
+            SimpleNamespace(uuid="a", send_at=now - timedelta(minutes=2)),
+            SimpleNamespace(uuid="b", send_at=now - timedelta(minutes=1)),
+            SimpleNamespace(uuid="c", send_at=now + timedelta(minutes=5)),
+        ]
+    )
+
+    assert schedule.take_due(1, now) == ["a"]
+    assert schedule.take_due(10, now) == ["b"]
+    assert schedule.take_due(10, now) == []
+    assert len(schedule) == 1
+
+    schedule.released(["a"])
+    # b was never released, as if its releaser died, so it is taken again
+    later = now + timedelta(seconds=61)
+    assert schedule.take_due(10, later) == ["b"]
+    assert schedule.take_due(10, later) == []
+
+    schedule.released(["b"])
+    assert schedule.take_due(10, now + timedelta(minutes=5)) == ["c"]
+
+
+def test_inbound_fax_buffer__dead_letters_entries_that_keep_failing(redis_client):
+    buffer = InboundFaxBuffer("test:ingest", redis_client, max_deliveries=2)
+    for sid in ("FX1", "FX2", "FX3"):
+        buffer.append({"FaxSid": sid})
+
+    def drain(failing):
+        seen = []
+        for batch in buffer.batches(2):
+            seen += [body["FaxSid"] for _, body in batch]
+            buffer.ack([entry_id for entry_id, body in batch if body["FaxSid"] not in failing])
+        return seen
+
+    assert drain(failing={"FX2"}) == ["FX1", "FX2", "FX3"]
+    # the unacknowledged entry is replayed once per drain, not once per batch
+    assert drain(failing={"FX2"}) == ["FX2"]
+    assert drain(failing={"FX2"}) == []
+    assert redis_client.xlen("test:ingest") == 0
+
+    (_, fields), = redis_client.xrange("test:ingest:dead")
+    assert fields[b"body"] == b'{"FaxSid":"FX2"}'
+
+
+def test_broadcaster__skips_unreadable_messages():
+    broadcaster = Broadcaster()
+    watching, receiving = Stream({"a"}), Stream(set(), received=True)
+    broadcaster.streams.update([watching, receiving])
+
+    for data in (b"not json", b'{"uuid": "a"}', b'["status"]', b'{"event": "status"}'):
+        broadcaster.dispatch(data)
+    broadcaster.dispatch(b'{"event": "status", "uuid": "a", "status": "sending"}')
+    broadcaster.dispatch(b'{"event": "received", "uuid": "b", "status": "received"}')
+
+    assert watching.queue.get_nowait() == (STATUS, {"uuid": "a", "status": "sending"})
+    assert watching.queue.empty()
+    assert receiving.queue.get_nowait() == (RECEIVED, {"uuid": "b", "status": "received"})
+    assert receiving.queue.empty()
+
+
+def test_digest_email__lists_times_in_the_digest_time_zone():
+    faxes = [
+        SimpleNamespace(
+            created_on=datetime(2020, 7, 1, 13, 5, tzinfo=timezone.utc),
+            from_number=f"(321) 555-010{n}",
+            detail_url=f"https://example.com/faxes/{n}",
+        )
+        for n in range(2)
+    ]
+
+    subject, body = digest_email(faxes, pytz.timezone("America/New_York"))
+
+    assert subject == "2 New Faxes"
+    assert "2020-07-01 09:05 EDT from (321) 555-0100: https://example.com/faxes/0" in body
+
+
+@pytest.fixture(scope="module")
+def s3_server():
+    # n.b. every changed setting rebuilds the storage's boto3 client, once per module is enough
+    with LocalS3Server() as server:
+        overrides = dict(
+            AWS_S3_ENDPOINT_URL=server.url,
+            AWS_S3_BUCKET_NAME="test",
+            AWS_S3_ADDRESSING_STYLE="path",
+            AWS_ACCESS_KEY_ID="test",
+            AWS_SECRET_ACCESS_KEY="test",
+        )
+        with override_settings(**overrides):
+            yield server
+
+
+@pytest.fixture
+def s3(s3_server):
+    """an empty LocalS3Server behind default_storage"""
+    s3_server.objects.clear()
+    s3_server.uploads.clear()
+    return s3_server
+
+
+def test_fetch_to_storage__streams_the_media_in_parts(s3, settings):
+    settings.FAX_MEDIA_PART_SIZE = 5 * MB
+    with LocalMediaServer(12 * MB) as media:
+        upload = fetch_to_storage(media.url, "fax-media/test.pdf")
+        expected = requests.get(media.url).content
+
+    assert len(upload.parts) == 3
+    assert upload.sha256 == hash_chunks([expected])
+    assert stored_object("fax-media/test.pdf") == (12 * MB, "application/pdf")
+    assert b"".join(iter_stored("fax-media/test.pdf")) == expected
+    assert s3.uploads == {}
+
+
+def test_multipart_upload__aborts_when_the_block_raises(s3):
+    with pytest.raises(RuntimeError):
+        with MultipartUpload("fax-media/test.pdf") as upload:
+            upload.write(b"0" * (6 * MB))
+            raise RuntimeError("the source went away")
+
+    assert upload.upload_id is None
+    assert s3.uploads == {}
+    assert stored_object("fax-media/test.pdf") is None
+
+
+class BouncingBackend(locmem.EmailBackend):
+    """keeps sent messages in mail.outbox, and fails any sent to bounce@example.com"""
+
+    def send_messages(self, messages):
+        if any("bounce@example.com" in message.to for message in messages):
+            raise SMTPException("bounced")
+        return super().send_messages(messages)
+
+
+def test_send_to_all__sends_a_message_per_batch_and_returns_the_failed_ones(settings, monkeypatch):
+    settings.EMAIL_BACKEND = f"{__name__}.BouncingBackend"
+    batches = [["a@example.com", "b@example.com"], ["bounce@example.com"], ["c@example.com"]]
+    monkeypatch.setattr(notifications, "recipient_batches", lambda: iter(batches))
+
+    failed = notifications.send_to_all("New Fax - abc", "Hello")
+
+    assert failed == [["bounce@example.com"]]
+    assert [message.to for message in mail.outbox] == [batches[0], batches[2]]
+    assert mail.outbox[0].from_email == f"no-reply@{settings.HOSTNAME}"
+
+
+@pytest.fixture
+def shared_redis(redis_client, settings):
+    """the test redis behind LazyLoadedRedisClient"""
+    settings.REDIS_URL = REDIS_TEST_URL
+    reset_clients()
+    yield redis_client
+    reset_clients()
+
+
+def test_new_upload__token_is_good_for_one_fax(s3, shared_redis, settings):
+    user = SimpleNamespace(pk=1)
+    upload = new_upload(user)
+    response = requests.post(upload["url"], data=upload["fields"], files={"file": b"%PDF-1.4\n"})
+    assert response.status_code == 204
+
+    data = {"to": "(321) 555-0123", "upload": upload["token"]}
+    stranger = OutboundFaxForm(data, created_by=SimpleNamespace(pk=2))
+    assert stranger.errors["upload"] == ["The upload belongs to someone else."]
+
+    first = OutboundFaxForm(data, created_by=user)
+    assert first.is_valid(), first.errors
+    assert first.cleaned_data["upload"].startswith("fax-media/uploads/")
+
+    again = OutboundFaxForm(data, created_by=user)
+    assert again.errors["upload"] == ["This file has already been sent."]
+
+    shared_redis.delete(f"fax:upload:claimed:{first.cleaned_data['upload']}")
+
+
+def test_presigned_upload__rejects_documents_over_the_size_limit(s3):
+    upload = presigned_upload("fax-media/uploads/test.pdf", "application/pdf", max_size=10, expires=60)
+
+    response = requests.post(upload["url"], data=upload["fields"], files={"file": b"0" * 11})
+
+    assert response.status_code == 400
+    assert stored_object("fax-media/uploads/test.pdf") is None
+
+
+def test_streaming_upload_handler__stores_the_document_as_it_arrives(s3):
+    handler = S3StreamingUploadHandler()
+    handler.new_file("content", "fax.pdf", "application/pdf", 12)
+    assert handler.receive_data_chunk(b"%PDF-1.4\n", 0) is None
+    handler.receive_data_chunk(b"%%EOF", 9)
+    uploaded = handler.file_complete(14)
+
+    assert uploaded.name == "fax.pdf"
+    assert uploaded.size == 14
+    assert b"".join(iter_stored(uploaded.upload.name)) == b"%PDF-1.4\n%%EOF"
+
+    handler.discard()
+    assert stored_object(uploaded.upload.name) is None
+
+
+def test_streaming_upload_handler__passes_other_fields_through(s3):
+    handler = S3StreamingUploadHandler()
+    handler.new_file("attachment", "notes.txt", "text/plain", 5)
+
+    assert handler.receive_data_chunk(b"notes", 0) == b"notes"
+    assert handler.file_complete(5) is None
+    assert s3.objects == {}
+
+
+def test_streaming_upload_handler__stops_uploads_over_the_size_limit(s3, settings):
+    settings.FAX_UPLOAD_MAX_SIZE = 10
+    handler = S3StreamingUploadHandler()
+    handler.new_file("content", "fax.pdf", "application/pdf", None)
+    handler.receive_data_chunk(b"%PDF-1.4\n", 0)
+
+    with pytest.raises(StopUpload):
+        handler.receive_data_chunk(b"too much", 9)
+    handler.upload_complete()
+
+    assert handler.upload is None
+    assert s3.objects == {}
+
+
+class FaxCreateHandler(QuietHandler):
+    """answers a create by the last digits of `To`, e.g. 0429 is rate limited"""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        to = parse_qs(self.rfile.read(length).decode())["To"][0]
+        if to.endswith("0201"):
+            body = {"sid": f"FX{to[-4:]}", "status": "queued"}
+        elif to.endswith("0400"):
+            body = {"message": "The 'To' number is not a valid phone number."}
+        else:
+            body = {}
+        if to.endswith("0504"):
+            time.sleep(1)
+        self.respond(int(to[-3:]), json.dumps(body).encode(), {"Content-Type": "application/json"})
+
+
+class LocalFaxCreateServer(LocalService):
+    handler_class = FaxCreateHandler
+
+
+def test_create_faxes__retries_only_requests_that_never_reached_twilio(settings):
+    settings.FAX_SEND_TIMEOUT = 0.5
+    creates = [(n, {"To": f"+1321555{n}"}) for n in ("0201", "0429", "0400", "0504")]
+    auth = ("ACx", "x")
+
+    with LocalFaxCreateServer() as twilio:
+        results = asyncio.run(create_faxes(creates, 4, f"{twilio.url}/Faxes", auth))
+    unreachable = asyncio.run(create_faxes(creates[:1], 4, f"{twilio.url}/Faxes", auth))
+
+    assert [(result.uuid, result.sid, result.retry) for result in results] == [
+        ("0201", "FX0201", False),
+        ("0429", None, True),
+        ("0400", None, False),
+        ("0504", None, False),
+    ]
+    assert results[2].error == "The 'To' number is not a valid phone number."
+    assert results[3].error == "outcome unknown, ReadTimeout"
+    assert unreachable[0].retry and unreachable[0].error.startswith("ConnectError")
+
+
+def test_fax_filter_form__filters_by_number_status_and_whole_days():
+    data = {"number": "(312) 555", "status": "failed", "since": "2020-03-07", "until": "2020-03-08"}
+    form = FaxFilterForm(data)
+    assert form.is_valid(), form.errors
+
+    expected = (
+        Fax.objects.filter(Q(_to__contains="312555") | Q(_from__contains="312555"))
+        .filter(status="failed")
+        .filter(created_on__gte=datetime(2020, 3, 7, tzinfo=timezone.utc))
+        .filter(created_on__lt=datetime(2020, 3, 9, tzinfo=timezone.utc))
+    )
+    assert str(form.filter(Fax.objects.all()).query) == str(expected.query)
+    assert form.is_filtered
+
+
+def test_fax_filter_form__rejects_short_numbers_and_backwards_ranges():
+    form = FaxFilterForm({"number": "(31", "since": "2020-03-08", "until": "2020-03-07"})
+
+    assert form.errors == {
+        "number": ["Please enter at least 3 digits."],
+        "until": ["The end date is before the start date."],
+    }
+
+
+def test_inspect_upload__leaves_streamed_files_to_the_media_queue():
+    upload = SimpleNamespace(name="fax-media/uploads/missing.pdf", size=9)
+    streamed = StreamedUploadedFile(upload, "fax.pdf", "application/pdf")
+
+    # n.b. no storage is configured, reading the object would fail
+    assert inspect_upload(streamed) is None
+
+
+def test_outbound_fax_form__rejects_an_upload_and_a_file_together(s3, shared_redis):
+    user = SimpleNamespace(pk=1)
+    upload = new_upload(user)
+    requests.post(upload["url"], data=upload["fields"], files={"file": b"%PDF-1.4\n"})
+    document = pymupdf.open()
+    document.new_page()
+    content = SimpleUploadedFile("fax.pdf", document.tobytes(), "application/pdf")
+
+    data = {"to": "(321) 555-0123", "upload": upload["token"]}
+    form = OutboundFaxForm(data, {"content": content}, created_by=user)
+
+    assert form.errors == {"content": ["Please send either the uploaded file or a new one, not both."]}
+    # n.b. not claimed, the form sent back keeps its token
+    assert not shared_redis.keys("fax:upload:claimed:*")
+
+
+class FailingUploadView(StreamedUploadView):
+    def create(self, request):
+        assert request.FILES["content"].upload.name
+        raise RuntimeError("the fax could not be saved")
+
+
+def test_streamed_upload_view__discards_the_file_when_create_raises(s3):
+    content = SimpleUploadedFile("fax.pdf", b"%PDF-1.4\n", "application/pdf")
+    request = RequestFactory().post("/dashboard/new-fax/", {"to": "(321) 555-0123", "content": content})
+    request.user = SimpleNamespace(is_authenticated=True)
+    request._dont_enforce_csrf_checks = True
+
+    with pytest.raises(RuntimeError):
+        FailingUploadView.as_view()(request)
+
+    assert s3.objects == {}
@@ -0,0 +1,73 @@
+"""
+Per-page preview images for fax documents.
+
+Pages are rasterized with PyMuPDF in a process pool: each worker opens the
+document once and renders a contiguous run of pages. The pool is created
+lazily in the process that uses it, so it is safe to import before a fork.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+
+from django.conf import settings
+import pymupdf
+
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_key = None
+
+
+def get_pool(processes):
+    global _pool, _pool_key
+    key = (os.getpid(), processes)
+    if _pool is None or _pool_key != key:
+        if _pool is not None and _pool_key[0] == os.getpid():
+            _pool.shutdown(wait=False)
+        _pool = ProcessPoolExecutor(max_workers=processes)
+        _pool_key = key
+    return _pool
+
+
+def page_count(data):
+    with pymupdf.open(stream=data, filetype="pdf") as document:
+        return document.page_count
+
+
+def render_pages(data, first, last, width):
+    """png bytes for pages [first, last) scaled to `width` pixels"""
+    images = []
+    with pymupdf.open(stream=data, filetype="pdf") as document:
+        for number in range(first, last):
+            page = document[number]
+            zoom = width / page.rect.width
+            pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            images.append(pixmap.tobytes("png"))
+    return images
+
+
+def map_pages(render, data, processes, *args):
+    """
+    call `render(data, first, last, *args)` over runs of pages in the pool
+
+    `render` returns one result per page; results come back in page order.
+    """
+    pages = page_count(data)
+    if not pages:
+        return []
+
+    size = -(-pages // processes)  # ceiling division
+    runs = [(first, min(first + size, pages)) for first in range(0, pages, size)]
+    if len(runs) == 1:
+        return render(data, 0, pages, *args)
+
+    futures = [get_pool(processes).submit(render, data, first, last, *args) for first, last in runs]
+    return [result for future in futures for result in future.result()]
+
+
+def render_thumbnails(data, width=None, processes=None):
+    """png bytes for every page of the pdf in `data`, in page order"""
+    width = width or settings.FAX_THUMBNAIL_WIDTH
+    processes = processes or settings.FAX_THUMBNAIL_PROCESSES
+    return map_pages(render_pages, data, processes, width)
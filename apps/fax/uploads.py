@@ -0,0 +1,83 @@
+"""
+Upload handler that streams the New Fax form's document into S3.
+
+Each chunk the multipart parser hands over is forwarded to a MultipartUpload
+right away, so the document is stored (and hashed) by the time the form is
+validated. Nothing is spooled to local disk and the file is never read a
+second time.
+"""
+from uuid import uuid4
+import logging
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+from fax.media import UPLOAD_PREFIX, MultipartUpload
+
+
+logger = logging.getLogger(__name__)
+
+
+class StreamedUploadedFile(UploadedFile):
+    """
+    a file that is already in storage under `upload.name`
+
+    There is nothing to read locally; fax.models.MediaBlob.objects.from_upload
+    adopts it.
+    """
+
+    def __init__(self, upload, name, content_type, charset=None):
+        super().__init__(file=None, name=name, content_type=content_type, size=upload.size, charset=charset)
+        self.upload = upload
+
+
+class S3StreamingUploadHandler(FileUploadHandler):
+    """streams the files posted as `field_names` to storage; other files pass through"""
+
+    field_names = ("content",)
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.upload = None
+        self.stored = []
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name not in self.field_names:
+            self.upload = None
+            return
+        name = f"{UPLOAD_PREFIX}/{uuid4()}.pdf"
+        self.upload = MultipartUpload(name, content_type=self.content_type or "application/pdf")
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.upload is None:
+            return raw_data
+
+        if start + len(raw_data) > settings.FAX_UPLOAD_MAX_SIZE:
+            self.upload_interrupted()
+            raise StopUpload(connection_reset=True)
+        self.upload.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.upload is None:
+            return None
+        upload, self.upload = self.upload, None
+        upload.close()
+        self.stored.append(upload)
+        return StreamedUploadedFile(upload, self.file_name, self.content_type, self.charset)
+
+    def upload_interrupted(self):
+        if self.upload is not None:
+            self.upload.abort()
+            self.upload = None
+
+    def upload_complete(self):
+        # n.b. a parse that died mid-file leaves its multipart upload open
+        self.upload_interrupted()
+
+    def discard(self):
+        """remove stored files that the request ended up not using"""
+        for upload in self.stored:
+            upload.storage.delete(upload.name)
+        self.stored = []
@@ -1,79 +1,122 @@
 import logging
-import urllib.parse
 
 from django.conf import settings
+from django.db import transaction
 from django.http import HttpResponse
 from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
+from fax import events
+from fax.coalesce import StatusCoalescer
+from fax.ingest import InboundFaxBuffer
 from fax.models import Fax
-from fax.tasks import _receive_fax
+from fax.resources import ResourceCache
+from fax.status import is_terminal
+from fax.tasks import _receive_fax, attempts_ended
+from fax.webhooks import (
+    FaxStatusPayload,
+    IncomingFaxPayload,
+    InvalidWebhookPayload,
+    ReceivedFaxPayload,
+    is_valid_signature,
+)
 
 logger = logging.getLogger(__name__)
 
+# what fax.tasks.attempts_ended needs of a finished fax
+ENDED_FIELDS = ["uuid", "attempt", "status", "error_message", "direction", "created_on", "created_by"]
 
-class GetRequestBody:
-    def get_request_body(self, request):
-        """returns query params as a dictionary
-        used for storing call query params in metadata json field"""
-        query_params = request.body.decode().split("&")
-        return {
-            k.strip(): urllib.parse.unquote(v.strip())
-            for k, v in [t.split("=") for t in query_params]
-        }
 
+class TwilioWebhookView(View):
+    """rejects unsigned requests and decodes the body into `payload_class`"""
+
+    payload_class = None
 
-class FaxStatusCallback(View, GetRequestBody):
     @method_decorator(csrf_exempt)
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+    def dispatch(self, request, *args, **kwargs):
+        if settings.TWILIO_VALIDATE_WEBHOOKS and not is_valid_signature(request):
+            logger.warning(f"Rejected unsigned twilio webhook: {request.path}")
+            return HttpResponse("", content_type="text/plain", status=403)
 
-    def post(self, request, uuid):
-        body = self.get_request_body(request)
-        logger.warning(body)
+        try:
+            self.payload = self.payload_class.decode(request.body)
+        except InvalidWebhookPayload as e:
+            logger.warning(e)
+            return HttpResponse("", content_type="text/plain", status=400)
 
-        queryset = Fax.objects.filter(uuid=uuid)
-        if not queryset.exists():
-            return HttpResponse("", content_type="text/plain", status=404)
+        return super().dispatch(request, *args, **kwargs)
 
-        fax = queryset.first()
-        fax.status = body["Status"]
-        fax.fax_status = body["FaxStatus"]
-        if body.get("ErrorMessage"):
-            fax.error_message = body["ErrorMessage"]
-        fax.save()
 
+class FaxStatusCallback(TwilioWebhookView):
+    payload_class = FaxStatusPayload
+
+    def post(self, request, uuid):
+        payload = self.payload
+        logger.warning(payload)
+
+        # n.b. callback urls from before redialing have no attempt, see fax.redial
+        try:
+            attempt = int(request.GET.get("attempt", 1))
+        except ValueError:
+            return HttpResponse("", content_type="text/plain", status=400)
+
+        if payload.fax_sid:
+            # the cached snapshot still has the previous status
+            ResourceCache().invalidate(payload.fax_sid)
+
+        if settings.FAX_STATUS_COALESCE_WINDOW:
+            # written in bulk by fax.tasks._flush_status_updates
+            recorded = StatusCoalescer().record(
+                uuid, payload.status, payload.fax_status, payload.error_message, attempt
+            )
+            # n.b. the pages already show pending statuses, see StatusCoalescer.overlay
+            if recorded:
+                events.publish(
+                    events.STATUS, uuid, payload.status, attempt=attempt, error_message=payload.error_message
+                )
+            return HttpResponse("", content_type="text/plain", status=200)
+
+        finished = is_terminal(payload.status)
+        with transaction.atomic():
+            updated = Fax.update_status(
+                uuid, payload.status, payload.fax_status, payload.error_message, attempt
+            )
+            if updated and finished:
+                attempts_ended([Fax.objects.only(*ENDED_FIELDS).get(uuid=uuid)])
+        # n.b. stale callbacks also change no rows; only then pay for a lookup
+        if not updated and not Fax.objects.filter(uuid=uuid).exists():
+            return HttpResponse("", content_type="text/plain", status=404)
+
+        if updated and not finished:
+            events.publish(
+                events.STATUS, uuid, payload.status, attempt=attempt, error_message=payload.error_message
+            )
         return HttpResponse("", content_type="text/plain", status=200)
 
 
-class FaxSentView(View):
-    @method_decorator(csrf_exempt)
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+class FaxSentView(TwilioWebhookView):
+    payload_class = IncomingFaxPayload
 
     def post(self, request):
+        logger.info(self.payload)
         action = f'{settings.URL}{reverse("fax:received")}'
         response = f'<Response><Receive action="{action}" /></Response>'
         return HttpResponse(response, content_type="text/xml", status=200)
 
 
-class FaxReceivedView(View, GetRequestBody):
-    @method_decorator(csrf_exempt)
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+class FaxReceivedView(TwilioWebhookView):
+    payload_class = ReceivedFaxPayload
 
     def post(self, request):
-        body = self.get_request_body(request)
-        fax = Fax.objects.create(
-            status=body['Status'],
-            sid=body['FaxSid'],
-            fax_status=body['FaxStatus'],
-            _from=body['From'],
-            _to=body['To'],
-            direction='inbound',
-            twilio_metadata=[body],
-        )
+        payload = self.payload
+        if settings.FAX_INGEST_MODE == "buffered":
+            # stored in bulk by fax.tasks._drain_inbound_faxes
+            InboundFaxBuffer().append(payload.as_dict())
+            return HttpResponse("", content_type="text/plain", status=200)
+
+        fax = Fax.from_inbound_webhook(payload)
+        fax.save()
         _receive_fax.delay(fax.uuid)
         return HttpResponse("", content_type="text/plain", status=200)
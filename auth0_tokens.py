@@ -0,0 +1,117 @@
+"""
+Cached Auth0 management API tokens.
+
+A management token is good for hours, but `LazyLoadedAuth0Client` used to run
+a client_credentials exchange for every client it handed out. Tokens are now
+looked up in process memory, then in redis (shared by every process), and
+only fetched from Auth0 when both are missing or within
+settings.AUTH0_TOKEN_REFRESH_MARGIN seconds of expiring (at most half the
+token's lifetime).
+
+Refreshes are single-flight: a thread lock within the process and a redis
+lock across processes, re-checking the shared copy once held, so a fleet of
+workers starting together makes one request to Auth0 rather than one each.
+Every fetch is counted in redis, see `ManagementTokenCache.stats`. A token
+Auth0 rejects is forgotten everywhere, see LazyLoadedAuth0Client.request.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from redis.exceptions import LockNotOwnedError
+import ujson as json
+
+from lazy_clients import LazyLoadedRedisClient
+
+
+logger = logging.getLogger(__name__)
+
+
+class ManagementTokenCache:
+    def __init__(self, domain, fetch, margin=None):
+        """`fetch` returns auth0's token response: access_token and expires_in"""
+        self.domain = domain
+        self.fetch = fetch
+        self.margin = settings.AUTH0_TOKEN_REFRESH_MARGIN if margin is None else margin
+        self.key = f"auth0:management-token:{domain}"
+        self.client = LazyLoadedRedisClient().get_client()
+        self.local_lock = threading.Lock()
+        self.token = None
+        self.refresh_at = 0
+
+    def get(self):
+        if self.is_fresh(self.refresh_at):
+            return self.token
+
+        with self.local_lock:
+            if self.is_fresh(self.refresh_at):
+                return self.token
+            return self.refresh()
+
+    def refresh(self):
+        if self.load_shared():
+            return self.token
+
+        # n.b. held longer than others wait for it, so a slow fetch keeps it
+        lock = self.client.lock(
+            f"{self.key}:lock",
+            timeout=settings.AUTH0_TOKEN_LOCK_TIMEOUT,
+            blocking_timeout=settings.AUTH0_TOKEN_LOCK_WAIT,
+        )
+        if not lock.acquire():
+            # n.b. whoever holds the lock is slow or gone, don't wait on them forever
+            logger.warning("Timed out waiting for another process to refresh the auth0 token.")
+            return self.fetch_token()
+
+        try:
+            # another process may have refreshed it while we waited
+            if self.load_shared():
+                return self.token
+            return self.fetch_token()
+        finally:
+            try:
+                lock.release()
+            except LockNotOwnedError:
+                # the token was fetched all the same
+                logger.warning("The auth0 token lock expired during a slow refresh.")
+
+    def load_shared(self):
+        value = self.client.get(self.key)
+        if value is None:
+            return False
+        value = json.loads(value)
+        if not self.is_fresh(value["refresh_at"]):
+            return False
+        self.token, self.refresh_at = value["token"], value["refresh_at"]
+        self.count("shared_hits")
+        return True
+
+    def fetch_token(self):
+        started = time.time()
+        response = self.fetch()
+        lifetime = response["expires_in"]
+        self.token = response["access_token"]
+        self.refresh_at = started + lifetime - min(self.margin, lifetime / 2)
+
+        value = json.dumps(dict(token=self.token, refresh_at=self.refresh_at))
+        self.client.set(self.key, value, ex=max(int(lifetime), 1))
+        self.count("fetches")
+        logger.info(f"fetched an auth0 management token, valid for {response['expires_in']}s")
+        return self.token
+
+    def invalidate(self):
+        """forget the token everywhere, e.g. after auth0 rejected it"""
+        self.token, self.refresh_at = None, 0
+        self.client.delete(self.key)
+
+    def is_fresh(self, refresh_at):
+        return time.time() < refresh_at
+
+    def count(self, field):
+        self.client.hincrby(f"{self.key}:stats", field, 1)
+
+    def stats(self):
+        """fetches from auth0 and tokens picked up from redis, across all processes"""
+        values = self.client.hgetall(f"{self.key}:stats")
+        return {field.decode(): int(value) for field, value in values.items()}
@@ -1,11 +1,31 @@
+"""
+Process-wide clients for the services we talk to.
+
+Every `LazyLoaded*` class is a per-process singleton, so all callers in a
+process share one client and its keep-alive connection pool instead of paying
+for a fresh TLS handshake per call. Pool sizes come from settings.
+
+Connections must never be shared across a fork: `reset_clients` drops every
+client, and runs from gunicorn's `post_fork` and celery's
+`worker_process_init`. The registry also notices a changed pid by itself, in
+case a process is forked without those hooks.
+"""
 import logging
+import os
+import threading
 
 from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.functional import empty
 
 from auth0.v3.authentication import GetToken
+from auth0.v3.exceptions import Auth0Error
 from auth0.v3.management import Auth0
+from requests import Session
+from requests.adapters import HTTPAdapter
 from twilio.rest import Client as TwilioRestClient
 import boto3
+import redis
 
 
 logger = logging.getLogger(__name__)
@@ -13,33 +33,77 @@ logger = logging.getLogger(__name__)
 
 class Singleton(type):
     _instances = {}
+    _pid = os.getpid()
+    _lock = threading.RLock()
 
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
+        if Singleton._pid != os.getpid():
+            reset_clients()
+        instance = cls._instances.get(cls)
+        if instance is None:
+            with Singleton._lock:
+                instance = cls._instances.get(cls)
+                if instance is None:
+                    instance = cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+        return instance
 
 
-class LazyLoadedTwilioClient:
-    __metaclass__ = Singleton
+def reset_clients():
+    """
+    forget every client in this process
 
+    n.b. connections inherited from a parent are dropped, not closed: closing
+    them could end the parent's sessions too
+    """
+    Singleton._instances.clear()
+    Singleton._pid = os.getpid()
+    # the storage keeps its own boto3 client, see django_s3_storage.storage._Local
+    if default_storage._wrapped is not empty:
+        default_storage._wrapped._setup()
+
+
+def pooled_session(pool_size):
+    """requests session keeping up to `pool_size` connections alive per host"""
+    session = Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class LazyLoadedHTTPSession(metaclass=Singleton):
+    """shared session for plain https calls, e.g. fetching twilio media urls"""
+
+    session = None
+
+    def get_session(self):
+        if self.session is None:
+            self.session = pooled_session(settings.HTTP_POOL_SIZE)
+        return self.session
+
+
+class LazyLoadedTwilioClient(metaclass=Singleton):
     client = None
 
     def get_client(self):
         if self.client is not None:
             return self.client
 
+        from rate_limits import RateLimitedHttpClient
+
         twilio_logger = logging.getLogger("twilio.http_client")
         twilio_logger.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
+        http_client = RateLimitedHttpClient(logger=twilio_logger)
+        http_client.session = pooled_session(settings.TWILIO_HTTP_POOL_SIZE)
         self.client = TwilioRestClient(
-            username=settings.TWILIO_ACCOUNT_SID, password=settings.TWILIO_AUTH_TOKEN
+            username=settings.TWILIO_ACCOUNT_SID,
+            password=settings.TWILIO_AUTH_TOKEN,
+            http_client=http_client,
         )
         return self.client
 
 
-class LazyLoadedAWSClient:
-    __metaclass__ = Singleton
-
+class LazyLoadedAWSClient(metaclass=Singleton):
     bucket = None
     s3 = None
 
@@ -50,7 +114,7 @@ class LazyLoadedAWSClient:
         if self.s3 is not None:
             return self.s3
 
-        s3 = boto3.resource("s3")
+        s3 = boto3.resource("s3", endpoint_url=settings.AWS_S3_ENDPOINT_URL or None)
         self.s3 = s3
         return self.s3
 
@@ -58,29 +122,61 @@ class LazyLoadedAWSClient:
         if self.bucket:
             return self.bucket
         s3 = self.get_s3()
-        bucket = s3.Bucket(self.bucket_name)
-        return bucket
+        self.bucket = s3.Bucket(self.bucket_name)
+        return self.bucket
 
 
-class LazyLoadedAuth0Client:
-    __metaclass__ = Singleton
+class LazyLoadedRedisClient(metaclass=Singleton):
+    client = None
+
+    def get_client(self):
+        if self.client is not None:
+            return self.client
+
+        self.client = redis.Redis.from_url(
+            settings.REDIS_URL, max_connections=settings.REDIS_MAX_CONNECTIONS
+        )
+        return self.client
+
+
+class LazyLoadedAuth0Client(metaclass=Singleton):
+    client = None
+    client_token = None
 
     def __init__(self, *args, **kwargs):
         self.domain = settings.AUTH0_DOMAIN
 
+        from auth0_tokens import ManagementTokenCache
+
+        self.tokens = ManagementTokenCache(self.domain, self.fetch_token)
+
     def get_client(self):
         mgmt_api_token = self.get_token()
-        auth0 = Auth0(self.domain, mgmt_api_token)
-        return auth0
+        if self.client is None or mgmt_api_token != self.client_token:
+            self.client = Auth0(self.domain, mgmt_api_token)
+            self.client_token = mgmt_api_token
+        return self.client
 
     def get_token(self):
+        """a cached management token, see auth0_tokens.py"""
+        return self.tokens.get()
+
+    def request(self, call):
+        """`call(client)`, once more with a new token if auth0 rejects the cached one"""
+        try:
+            return call(self.get_client())
+        except Auth0Error as e:
+            if e.status_code != 401:
+                raise
+            logger.warning("Auth0 rejected the management token, fetching a new one.")
+            self.tokens.invalidate()
+            return call(self.get_client())
+
+    def fetch_token(self):
         get_token = GetToken(self.domain)
 
-        token = get_token.client_credentials(
+        return get_token.client_credentials(
             settings.AUTH0_CLIENT_ID,
             settings.AUTH0_CLIENT_SECRET,
             f"https://{self.domain}/api/v2/",
         )
-
-        mgmt_api_token = token["access_token"]
-        return mgmt_api_token
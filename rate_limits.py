@@ -0,0 +1,169 @@
+"""
+Distributed token buckets for outbound API calls.
+
+Every process shares one bucket per endpoint class, kept in redis, so the
+combined request rate of all web and celery workers stays within the limits in
+settings.TWILIO_RATE_LIMITS. The bucket is a GCRA: a single "theoretical
+arrival time" per key, updated atomically by a lua script using redis' clock.
+
+When the bucket is empty `RateLimited` is raised with the time until the next
+token. Celery tasks reschedule themselves with that countdown instead of
+holding a worker; code that may wait (management commands) runs inside
+`blocking()` and sleeps instead.
+"""
+from contextlib import contextmanager
+import logging
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from twilio.http.http_client import TwilioHttpClient
+
+from lazy_clients import LazyLoadedRedisClient
+
+
+logger = logging.getLogger(__name__)
+
+# returns 0 when a token was taken, otherwise the milliseconds until one frees up
+ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local burst = (tonumber(ARGV[2]) - 1) * interval
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local wait = tat - burst - now
+if wait > 0 then
+    return wait
+end
+redis.call('SET', KEYS[1], tat + interval, 'PX', math.ceil(burst + interval))
+return 0
+"""
+
+# (method, url pattern, endpoint class); the first match wins
+ENDPOINTS = [
+    ("POST", re.compile(r"/v1/Faxes/?$"), "fax-create"),
+    ("GET", re.compile(r"/v1/Faxes/"), "fax-fetch"),
+    (None, re.compile(r"/IncomingPhoneNumbers/"), "numbers"),
+]
+
+_state = threading.local()
+
+
+class RateLimited(Exception):
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"{endpoint} is rate limited for {retry_after:.2f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+    def countdown(self):
+        """retry delay with jitter, so rescheduled tasks don't return in lockstep"""
+        return self.retry_after * (1 + random.random())
+
+
+@contextmanager
+def blocking():
+    """wait for tokens instead of raising RateLimited, in this thread"""
+    previous = getattr(_state, "blocking", False)
+    _state.blocking = True
+    try:
+        yield
+    finally:
+        _state.blocking = previous
+
+
+def endpoint_class(method, url):
+    for endpoint_method, pattern, name in ENDPOINTS:
+        if endpoint_method in (None, method.upper()) and pattern.search(url):
+            return name
+    return "default"
+
+
+class TokenBucket:
+    def __init__(self, prefix="twilio"):
+        self.prefix = prefix
+        self.client = LazyLoadedRedisClient().get_client()
+        self.script = self.client.register_script(ACQUIRE_SCRIPT)
+
+    def limit(self, endpoint):
+        limits = settings.TWILIO_RATE_LIMITS
+        return limits.get(endpoint, limits["default"])
+
+    def try_acquire(self, endpoint):
+        """0 when a token was taken, otherwise seconds until one is available"""
+        rate, burst = self.limit(endpoint)
+        interval = 1000 / rate
+        wait = self.script(keys=[f"{self.prefix}:ratelimit:{endpoint}"], args=[interval, burst])
+        return wait / 1000
+
+    def acquire(self, endpoint):
+        """take a token, sleeping for it when blocking() is active"""
+        waited = 0
+        while True:
+            wait = self.try_acquire(endpoint)
+            if not wait:
+                break
+            if not getattr(_state, "blocking", False):
+                self.record(endpoint, throttled=1, wait=wait)
+                raise RateLimited(endpoint, wait)
+            time.sleep(wait)
+            waited += wait
+        self.record(endpoint, acquired=1, wait=waited)
+        return waited
+
+    def record(self, endpoint, acquired=0, throttled=0, wait=0):
+        key = f"{self.prefix}:ratelimit:stats:{endpoint}"
+        pipeline = self.client.pipeline(transaction=False)
+        if acquired:
+            pipeline.hincrby(key, "acquired", acquired)
+        if throttled:
+            pipeline.hincrby(key, "throttled", throttled)
+        if wait:
+            pipeline.hincrbyfloat(key, "wait_seconds", wait)
+        pipeline.execute()
+
+    def stats(self):
+        """counters per endpoint class: acquired, throttled and wait_seconds"""
+        stats = {}
+        for key in self.client.scan_iter(f"{self.prefix}:ratelimit:stats:*"):
+            endpoint = key.decode().rpartition(":")[2]
+            values = self.client.hgetall(key)
+            stats[endpoint] = {
+                "acquired": int(values.get(b"acquired", 0)),
+                "throttled": int(values.get(b"throttled", 0)),
+                "wait_seconds": float(values.get(b"wait_seconds", 0)),
+            }
+        return stats
+
+    def reset_stats(self):
+        keys = list(self.client.scan_iter(f"{self.prefix}:ratelimit:stats:*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class RateLimitedHttpClient(TwilioHttpClient):
+    """twilio http client that takes a token before every request"""
+
+    def __init__(self, *args, bucket=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bucket = bucket or TokenBucket()
+
+    def request(self, method, url, *args, **kwargs):
+        endpoint = endpoint_class(method, url)
+        while True:
+            self.bucket.acquire(endpoint)
+            response = super().request(method, url, *args, **kwargs)
+            if response.status_code != 429:
+                return response
+
+            # n.b. twilio disagrees with our limits; back off instead of retrying hot
+            headers = getattr(response, "headers", None) or {}
+            retry_after = float(headers.get("Retry-After", 1))
+            self.bucket.record(endpoint, throttled=1, wait=retry_after)
+            if not getattr(_state, "blocking", False):
+                raise RateLimited(endpoint, retry_after)
+            time.sleep(retry_after)